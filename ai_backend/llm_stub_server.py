@@ -0,0 +1,276 @@
+"""
+OpenAI-compatible stand-in server for offline load testing
+
+Serves /v1/chat/completions, both plain and streaming, with:
+- a configurable time-to-first-token distribution: log-normal with a median and p99
+- a token generation rate
+- injected 429s (with Retry-After), 500s and hung requests
+- canned responses chosen by regex on the prompt and rendered from templates
+- provider-style prefix caching: prompts sharing a previously seen prefix of at
+  least 1024 tokens report it, in 128-token steps, as
+  usage.prompt_tokens_details.cached_tokens
+
+Run it, then point the backend at it:
+    python llm_stub_server.py --port 8100 --latency-ms 600 --latency-p99-ms 3000 --error-429 0.02
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=stub uvicorn main:app --port 8000
+
+Custom responses are a JSON list of {"match": "<regex>", "response": "<template>"}.
+Templates can use {model}, {score}, {count}, {scores} and {filler}.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+FILLER_WORDS = (
+    "patient presents with intermittent symptoms consistent with the working diagnosis "
+    "vital signs stable physical examination unremarkable except as noted recommend "
+    "follow-up laboratory evaluation including complete blood count metabolic panel and "
+    "reassess in two weeks counsel on warning signs hydration rest and medication adherence"
+).split()
+
+DEFAULT_RESPONSES = [
+    # Relevance scoring asks for a bare number, or a JSON array of them when batched
+    {"match": r"JSON array", "response": "{scores}"},
+    {"match": r"numerical score|Return only the (numerical )?score", "response": "{score}"},
+    {"match": r"primary diagnosis name", "response": "Community-acquired pneumonia"},
+    # Batch coding asks for a JSON object keyed by visit number
+    {"match": r"JSON object keyed by the visit number", "response": "{coding}"},
+    {"match": r"CPT codes?", "response": "99213 - Office visit, established patient, low complexity\n99214 - Office visit, moderate complexity\n{filler}"},
+    {"match": r"SOAP note", "response": "SUBJECTIVE:\n{filler}\n\nOBJECTIVE:\n{filler}\n\nASSESSMENT:\n{filler}\n\nPLAN:\n{filler}"},
+    {"match": r".", "response": "{filler}"}
+]
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 500.0  # median time to first token
+    latency_p99_ms: float = 2500.0
+    tokens_per_s: float = 50.0
+    max_completion_tokens: int = 400  # cap on generated length regardless of max_tokens
+    error_429: float = 0.0
+    error_500: float = 0.0
+    timeout_rate: float = 0.0
+    timeout_s: float = 120.0
+    prefix_cache: bool = True
+    responses: List[Dict[str, str]] = field(default_factory=lambda: list(DEFAULT_RESPONSES))
+
+    @property
+    def latency_sigma(self) -> float:
+        # Log-normal sigma that puts the 99th percentile at latency_p99_ms
+        if self.latency_p99_ms <= self.latency_ms or self.latency_ms <= 0:
+            return 0.0
+        return math.log(self.latency_p99_ms / self.latency_ms) / 2.326
+
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_STEP = 128
+PREFIX_CACHE_ENTRIES = 100000
+
+config = StubConfig()
+stats: Dict[str, int] = {}
+prefix_cache: "OrderedDict[str, None]" = OrderedDict()
+app = FastAPI(title="LLM Stub Server")
+
+def _count(outcome: str, amount: int = 1):
+    stats[outcome] = stats.get(outcome, 0) + amount
+
+def _cached_prefix_tokens(tokens: List[str]) -> int:
+    # Hash the prompt in 128-token blocks; the longest previously seen prefix is "cached"
+    if not config.prefix_cache:
+        return 0
+    cached = 0
+    digest = hashlib.sha1()
+    for end in range(PREFIX_CACHE_STEP, len(tokens) + 1, PREFIX_CACHE_STEP):
+        digest.update("".join(tokens[end - PREFIX_CACHE_STEP:end]).encode("utf-8"))
+        key = digest.hexdigest()
+        if key in prefix_cache:
+            prefix_cache.move_to_end(key)
+            if end >= PREFIX_CACHE_MIN_TOKENS:
+                cached = end
+        else:
+            prefix_cache[key] = None
+    while len(prefix_cache) > PREFIX_CACHE_ENTRIES:
+        prefix_cache.popitem(last=False)
+    return cached
+
+def _first_token_delay() -> float:
+    if config.latency_ms <= 0:
+        return 0.0
+    return random.lognormvariate(math.log(config.latency_ms / 1000), config.latency_sigma)
+
+def _count_items(prompt: str) -> int:
+    # Batched prompts number their items "1.", "2.", ... or "[1]", "[2]", ...
+    numbered = re.findall(r"^\s*\[?(\d+)[\].]", prompt, re.MULTILINE)
+    return max((int(n) for n in numbered), default=1)
+
+def _render(prompt: str, model: str, max_tokens: int) -> str:
+    template = next(
+        (r["response"] for r in config.responses if re.search(r["match"], prompt, re.IGNORECASE)),
+        "{filler}"
+    )
+    count = _count_items(prompt)
+    length = max(1, min(max_tokens, config.max_completion_tokens) // max(1, template.count("{filler}")) - 5)
+    values = {
+        "model": model,
+        "score": f"{random.uniform(0.1, 0.95):.2f}",
+        "count": count,
+        "scores": json.dumps([round(random.uniform(0.1, 0.95), 2) for _ in range(count)]),
+        "coding": json.dumps({
+            str(number): {
+                "cpt_codes": [{"code": random.choice(["99213", "99214", "99215"]), "description": "Office visit, established patient", "modifiers": []}],
+                "icd10_codes": [{"code": random.choice(["J06.9", "I10", "E11.9", "R51.9"]), "description": "Stub diagnosis"}]
+            }
+            for number in range(1, count + 1)
+        })
+    }
+    text = template
+    for key, value in values.items():
+        text = text.replace("{" + key + "}", str(value))
+    while "{filler}" in text:
+        text = text.replace("{filler}", " ".join(random.choice(FILLER_WORDS) for _ in range(length)), 1)
+    return text
+
+def _tokens(text: str) -> List[str]:
+    # Word-level pieces stand in for tokens (leading space kept, like BPE)
+    return re.findall(r"\s*\S+", text)
+
+def _error(status: int, kind: str, message: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": message, "type": kind, "code": None}},
+        headers=headers
+    )
+
+async def _maybe_fail() -> Optional[JSONResponse]:
+    roll = random.random()
+    if roll < config.error_429:
+        _count("429")
+        return _error(429, "rate_limit_error", "Rate limit reached (stub)", {"retry-after": "1"})
+    if roll < config.error_429 + config.error_500:
+        _count("500")
+        return _error(500, "server_error", "Internal server error (stub)")
+    if roll < config.error_429 + config.error_500 + config.timeout_rate:
+        _count("timeout")
+        # Hang past any sensible client timeout
+        await asyncio.sleep(config.timeout_s)
+        return _error(504, "timeout", "Upstream timeout (stub)")
+    return None
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-4")
+    messages = body.get("messages", [])
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    max_tokens = int(body.get("max_tokens") or config.max_completion_tokens)
+
+    failure = await _maybe_fail()
+    if failure is not None:
+        return failure
+
+    pieces = _tokens(_render(prompt, model, max_tokens))[:max_tokens]
+    prompt_pieces = _tokens(prompt)
+    prompt_tokens = len(prompt_pieces)
+    cached_tokens = _cached_prefix_tokens(prompt_pieces)
+    _count("prompt_tokens", prompt_tokens)
+    _count("cached_prompt_tokens", cached_tokens)
+    completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    delay = _first_token_delay()
+
+    if body.get("stream"):
+        _count("ok_stream")
+
+        async def events():
+            await asyncio.sleep(delay)
+            for index, piece in enumerate(pieces):
+                if index:
+                    await asyncio.sleep(1 / config.tokens_per_s)
+                delta = {"role": "assistant", "content": piece} if index == 0 else {"content": piece}
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    _count("ok")
+    await asyncio.sleep(delay + len(pieces) / config.tokens_per_s)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(pieces).strip()},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(pieces),
+            "total_tokens": prompt_tokens + len(pieces),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}
+        }
+    }
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "gpt-4", "object": "model", "owned_by": "stub"}]}
+
+@app.get("/stats")
+async def get_stats():
+    return {"requests": stats, "config": {k: v for k, v in config.__dict__.items() if k != "responses"}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server for load testing")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms, help="Median time to first token")
+    parser.add_argument("--latency-p99-ms", type=float, default=config.latency_p99_ms, help="p99 time to first token")
+    parser.add_argument("--tokens-per-s", type=float, default=config.tokens_per_s)
+    parser.add_argument("--max-completion-tokens", type=int, default=config.max_completion_tokens)
+    parser.add_argument("--error-429", type=float, default=0.0, help="Fraction of requests answered 429")
+    parser.add_argument("--error-500", type=float, default=0.0, help="Fraction of requests answered 500")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument("--timeout-s", type=float, default=config.timeout_s)
+    parser.add_argument("--no-prefix-cache", action="store_true", help="Never report cached prompt tokens")
+    parser.add_argument("--responses", help="JSON file of {match, response} templates, tried before the defaults")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    config.latency_ms = args.latency_ms
+    config.latency_p99_ms = args.latency_p99_ms
+    config.tokens_per_s = args.tokens_per_s
+    config.max_completion_tokens = args.max_completion_tokens
+    config.error_429 = args.error_429
+    config.error_500 = args.error_500
+    config.timeout_rate = args.timeout_rate
+    config.timeout_s = args.timeout_s
+    config.prefix_cache = not args.no_prefix_cache
+    if args.responses:
+        with open(args.responses, "r") as f:
+            config.responses = json.load(f) + config.responses
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
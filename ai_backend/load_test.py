@@ -0,0 +1,284 @@
+"""
+Load test for the LLM-backed endpoints
+
+Drives /copilot/*, /diagnose/multimodal, /ai/clinical-decision-support and
+/symptoms/* with synthetic patients at a fixed concurrency. It reports
+throughput, latency percentiles and error rates per scenario. Run it
+against a backend that points at llm_stub_server.py and no API quota is used:
+
+    python llm_stub_server.py --port 8100 --error-429 0.02 &
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=stub uvicorn main:app --port 8000 &
+    python load_test.py --base-url http://localhost:8000 --concurrency 32 --duration 60 --stub-url http://localhost:8100
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+SYMPTOMS = ["fever", "cough", "shortness of breath", "fatigue", "headache", "chest pain",
+            "nausea", "joint pain", "dizziness", "abdominal pain", "rash", "sore throat"]
+CONDITIONS = ["hypertension", "type 2 diabetes", "asthma", "COPD", "migraine", "rheumatoid arthritis"]
+DIAGNOSES = ["Community-acquired pneumonia", "Acute bronchitis", "Migraine without aura",
+             "Type 2 diabetes mellitus", "Essential hypertension", "Viral gastroenteritis"]
+
+def _note_context(rng: random.Random) -> Dict[str, Any]:
+    symptoms = rng.sample(SYMPTOMS, rng.randint(1, 4))
+    return {
+        "patient_id": f"load-{rng.randint(1, 500)}",
+        "visit_date": datetime.now().isoformat(),
+        "chief_complaint": symptoms[0],
+        "symptoms": symptoms,
+        "vital_signs": {"temperature": round(rng.uniform(36.4, 39.5), 1), "heart_rate": rng.randint(55, 120),
+                        "blood_pressure": f"{rng.randint(100, 160)}/{rng.randint(60, 100)}"},
+        "physical_exam": "Alert and oriented, mild distress",
+        "lab_results": {"WBC": round(rng.uniform(4, 16), 1), "CRP": round(rng.uniform(0, 80), 1)},
+        "scan_results": {},
+        "current_medications": rng.sample(["lisinopril", "metformin", "albuterol", "ibuprofen"], 2),
+        "allergies": rng.sample(["penicillin", "sulfa", "none known"], 1),
+        "medical_history": ", ".join(rng.sample(CONDITIONS, 2)),
+        "family_history": "Father with coronary artery disease",
+        "social_history": "Non-smoker, occasional alcohol"
+    }
+
+def _patient(rng: random.Random) -> Dict[str, Any]:
+    return {"age": rng.randint(18, 90), "gender": rng.choice(["male", "female"]),
+            "comorbidities": rng.sample(CONDITIONS, rng.randint(0, 2))}
+
+def _png(rng: random.Random) -> bytes:
+    from PIL import Image
+    pixels = np.random.default_rng(rng.randint(0, 2 ** 31)).integers(0, 255, (224, 224), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@dataclass
+class Scenario:
+    name: str
+    build: Callable[[random.Random], Dict[str, Any]]  # -> httpx request kwargs (method, url, data, files, params)
+    weight: float = 1.0
+    stream: bool = False
+
+def _copilot(path: str, extra: Callable[[random.Random], Dict[str, Any]] = lambda rng: {}):
+    def build(rng):
+        return {"method": "POST", "url": path, "data": {"context": json.dumps(_note_context(rng)), **extra(rng)}}
+    return build
+
+def build_scenarios(with_images: bool) -> List[Scenario]:
+    def multimodal(rng):
+        request = {
+            "method": "POST", "url": "/diagnose/multimodal",
+            "data": {"symptoms": ", ".join(rng.sample(SYMPTOMS, 3)),
+                     "patient_demographics": json.dumps(_patient(rng)),
+                     "medical_history": ", ".join(rng.sample(CONDITIONS, 2)),
+                     "lab_data": json.dumps({"WBC": {"value": round(rng.uniform(4, 16), 1), "unit": "10^9/L"}})}
+        }
+        if with_images:
+            request["files"] = [("images", ("scan.png", _png(rng), "image/png"))]
+        return request
+
+    def clinical_decision_support(rng):
+        return {"method": "POST", "url": "/ai/clinical-decision-support",
+                "data": {"patient_data": json.dumps(_patient(rng)),
+                         "symptoms": json.dumps(rng.sample(SYMPTOMS, 3)),
+                         "lab_results": json.dumps({"WBC": round(rng.uniform(4, 16), 1)})}}
+
+    def symptom_track(rng):
+        return {"method": "POST", "url": "/symptoms/track",
+                "data": {"patient_id": f"load-{rng.randint(1, 50)}", "symptom": rng.choice(SYMPTOMS),
+                         "severity": str(round(rng.uniform(1, 10), 1)),
+                         "timestamp": (datetime.now() - timedelta(hours=rng.randint(0, 2000))).isoformat()}}
+
+    def symptom_timeline(rng):
+        return {"method": "GET", "url": f"/symptoms/timeline/load-{rng.randint(1, 50)}"}
+
+    def symptom_progression(rng):
+        return {"method": "POST", "url": "/symptoms/analyze-progression",
+                "data": {"patient_id": f"load-{rng.randint(1, 50)}", "condition": rng.choice(CONDITIONS)}}
+
+    def symptom_patterns(rng):
+        return {"method": "POST", "url": "/symptoms/detect-patterns",
+                "data": {"patient_id": f"load-{rng.randint(1, 50)}"}}
+
+    notes = lambda rng: {"doctor_notes": "Patient reports symptoms for 3 days, improving with rest."}
+    return [
+        Scenario("copilot_soap", _copilot("/copilot/generate-soap", notes), 2.0),
+        Scenario("copilot_soap_stream", _copilot("/copilot/generate-soap/stream", notes), 1.0, stream=True),
+        Scenario("copilot_labs", _copilot("/copilot/suggest-labs")),
+        Scenario("copilot_diagnosis", _copilot("/copilot/suggest-diagnosis")),
+        Scenario("copilot_explain", _copilot("/copilot/explain-diagnosis", lambda rng: {"diagnosis": rng.choice(DIAGNOSES)})),
+        Scenario("copilot_followup", _copilot("/copilot/suggest-followup", lambda rng: {"diagnosis": rng.choice(DIAGNOSES)})),
+        Scenario("copilot_summary", _copilot("/copilot/summarize-visit", notes)),
+        Scenario("copilot_summary_stream", _copilot("/copilot/summarize-visit/stream", notes), 0.5, stream=True),
+        Scenario("copilot_cpt", _copilot("/copilot/suggest-cpt-codes")),
+        Scenario("multimodal", multimodal, 1.5),
+        Scenario("clinical_decision_support", clinical_decision_support, 1.5),
+        Scenario("symptoms_track", symptom_track, 2.0),
+        Scenario("symptoms_timeline", symptom_timeline),
+        Scenario("symptoms_progression", symptom_progression, 0.5),
+        Scenario("symptoms_patterns", symptom_patterns, 0.5)
+    ]
+
+@dataclass
+class ScenarioResult:
+    latencies_s: List[float] = field(default_factory=list)
+    first_byte_s: List[float] = field(default_factory=list)
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies_s) + sum(self.errors.values())
+
+async def _issue(client: httpx.AsyncClient, scenario: Scenario, rng: random.Random, result: ScenarioResult):
+    request = scenario.build(rng)
+    start = time.perf_counter()
+    try:
+        if scenario.stream:
+            async with client.stream(**request) as response:
+                first_byte = None
+                body = b""
+                async for chunk in response.aiter_bytes():
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - start
+                    body += chunk
+            status = response.status_code
+            # Streams answer 200 up front; failures arrive as an error event
+            if status == 200 and b"event: error" in body:
+                status = "stream_error"
+        else:
+            response = await client.request(**request)
+            status = response.status_code
+            first_byte = None
+    except httpx.TimeoutException:
+        status = "timeout"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+
+    if status == 200:
+        result.latencies_s.append(time.perf_counter() - start)
+        if first_byte is not None:
+            result.first_byte_s.append(first_byte)
+    else:
+        result.errors[str(status)] = result.errors.get(str(status), 0) + 1
+
+async def run_load(
+    base_url: str,
+    scenarios: List[Scenario],
+    concurrency: int,
+    duration_s: float,
+    max_requests: Optional[int],
+    timeout_s: float,
+    seed: int
+) -> Dict[str, Any]:
+    results = {scenario.name: ScenarioResult() for scenario in scenarios}
+    weights = [scenario.weight for scenario in scenarios]
+    deadline = time.perf_counter() + duration_s
+    issued = 0
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout_s, limits=limits) as client:
+        async def worker(worker_id: int):
+            nonlocal issued
+            rng = random.Random(seed + worker_id)
+            while time.perf_counter() < deadline and (max_requests is None or issued < max_requests):
+                issued += 1
+                scenario = rng.choices(scenarios, weights)[0]
+                await _issue(client, scenario, rng, results[scenario.name])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {"elapsed_s": elapsed, "concurrency": concurrency, "results": results}
+
+def _summarise(name: str, result: ScenarioResult, elapsed_s: float) -> Dict[str, Any]:
+    latencies = np.array(result.latencies_s) * 1000
+    first_byte = np.array(result.first_byte_s) * 1000
+    pct = lambda values, q: round(float(np.percentile(values, q)), 1) if len(values) else None
+    return {
+        "scenario": name,
+        "requests": result.requests,
+        "throughput_rps": round(result.requests / elapsed_s, 2),
+        "error_rate": round(sum(result.errors.values()) / result.requests, 4) if result.requests else 0.0,
+        "errors": result.errors,
+        "p50_ms": pct(latencies, 50),
+        "p90_ms": pct(latencies, 90),
+        "p99_ms": pct(latencies, 99),
+        "max_ms": round(float(latencies.max()), 1) if len(latencies) else None,
+        "first_byte_p50_ms": pct(first_byte, 50),
+        "first_byte_p99_ms": pct(first_byte, 99)
+    }
+
+def build_report(run: Dict[str, Any]) -> Dict[str, Any]:
+    elapsed = run["elapsed_s"]
+    rows = [_summarise(name, result, elapsed) for name, result in run["results"].items() if result.requests]
+    overall = ScenarioResult()
+    for result in run["results"].values():
+        overall.latencies_s += result.latencies_s
+        overall.first_byte_s += result.first_byte_s
+        for status, count in result.errors.items():
+            overall.errors[status] = overall.errors.get(status, 0) + count
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "concurrency": run["concurrency"],
+        "scenarios": rows,
+        "overall": _summarise("overall", overall, elapsed)
+    }
+
+def print_report(report: Dict[str, Any]):
+    header = f"{'scenario':<28}{'reqs':>7}{'rps':>8}{'err%':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'ttfb50':>9}"
+    print(f"\n{report['elapsed_s']} s at concurrency {report['concurrency']} (latencies in ms, successful requests)")
+    print(header)
+    print("-" * len(header))
+    fmt = lambda value: "-" if value is None else f"{value:.0f}"
+    for row in report["scenarios"] + [report["overall"]]:
+        if row["scenario"] == "overall":
+            print("-" * len(header))
+        print(f"{row['scenario']:<28}{row['requests']:>7}{row['throughput_rps']:>8.2f}{row['error_rate'] * 100:>6.1f}%"
+              f"{fmt(row['p50_ms']):>9}{fmt(row['p90_ms']):>9}{fmt(row['p99_ms']):>9}{fmt(row['max_ms']):>9}"
+              f"{fmt(row['first_byte_p50_ms']):>9}")
+    if report["overall"]["errors"]:
+        print(f"errors by status: {report['overall']['errors']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the LLM-backed endpoints")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (s)")
+    parser.add_argument("--scenarios", help="Comma-separated scenario name prefixes (default: all)")
+    parser.add_argument("--with-images", action="store_true", help="Attach a synthetic scan to multimodal requests")
+    parser.add_argument("--stub-url", help="llm_stub_server URL; its request counts are printed after the run")
+    parser.add_argument("--json-out", help="Also write the report to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scenarios = build_scenarios(args.with_images)
+    if args.scenarios:
+        prefixes = args.scenarios.split(",")
+        scenarios = [s for s in scenarios if any(s.name.startswith(prefix) for prefix in prefixes)]
+    if not scenarios:
+        parser.error("no scenarios selected")
+
+    run = asyncio.run(run_load(
+        args.base_url, scenarios, args.concurrency, args.duration, args.requests, args.timeout, args.seed
+    ))
+    report = build_report(run)
+    print_report(report)
+
+    if args.stub_url:
+        stub_stats = httpx.get(f"{args.stub_url}/stats").json()
+        report["stub"] = stub_stats
+        print(f"stub server: {stub_stats['requests']}")
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
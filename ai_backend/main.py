@@ -1,10 +1,10 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
 import os
 import uuid
-import base64
+import time
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 import json
@@ -15,13 +15,19 @@ load_dotenv()
 
 from services.scan_analysis import ScanAnalysisService
 from services.bloodwork_analysis import BloodworkAnalysisService
+from services.lab_timeseries_store import lab_timeseries_store
+from services.lab_ingestion import LabIngestionService
 from services.recovery_prediction import RecoveryPredictionService
+from services.recovery_retraining import RecoveryRetrainer
 from services.feedback_service import FeedbackService
 from services.multimodal_diagnosis import MultimodalDiagnosisService
 from services.symptom_timeline import SymptomTimelineService
 from services.doctor_copilot import DoctorCopilotService, NoteContext
+from services.batch_coding import BatchCodingService
 from services.bias_fairness_dashboard import BiasFairnessDashboardService
 from services.advanced_ai_features import AdvancedAIFeaturesService
+from services.model_lifecycle import ModelUnavailableError
+from services.llm_gateway import get_llm_gateway
 from services.security_compliance import SecurityComplianceService
 from services.ai_training_sandbox import ai_training_sandbox
 from services.model_comparison_dashboard import model_comparison_dashboard
@@ -34,10 +40,16 @@ from services.medication_tracking import MedicationTrackingService
 from services.vaccination_tracking import VaccinationTrackingService
 from services.surgical_guide import SurgicalGuideService
 from utils.file_handler import FileHandler
+from utils.metrics import Histogram, render_prometheus
+from utils.sse import sse_response
 from models.response_models import (
     ScanAnalysisResponse,
     BloodworkAnalysisResponse,
     RecoveryPredictionResponse,
+    BatchRecoveryPredictionRequest,
+    SensitivitySweepRequest,
+    SensitivitySweepResponse,
+    BatchRecoveryPredictionResponse,
     FeedbackResponse,
     EnhancedBloodworkAnalysis,
     EnhancedMedicalRecord
@@ -60,12 +72,15 @@ app.add_middleware(
 
 # Initialize services
 scan_service = ScanAnalysisService()
-bloodwork_service = BloodworkAnalysisService()
+bloodwork_service = BloodworkAnalysisService(lab_store=lab_timeseries_store)
+lab_ingestion_service = LabIngestionService(bloodwork_service, lab_store=lab_timeseries_store)
 recovery_service = RecoveryPredictionService()
-feedback_service = FeedbackService()
+recovery_retrainer = RecoveryRetrainer(recovery_service)
+feedback_service = FeedbackService(retrainer=recovery_retrainer)
 multimodal_service = MultimodalDiagnosisService()
 symptom_timeline_service = SymptomTimelineService()
 doctor_copilot_service = DoctorCopilotService()
+batch_coding_service = BatchCodingService()
 bias_fairness_service = BiasFairnessDashboardService()
 advanced_ai_service = AdvancedAIFeaturesService()
 security_compliance_service = SecurityComplianceService()
@@ -76,9 +91,28 @@ file_handler = FileHandler()
 smartcard_generator = SmartcardGenerator()
 continuous_learning = continuous_learning_service
 
+multimodal_stream_latency = Histogram(
+    "medai_multimodal_stream_seconds",
+    "Streaming multimodal diagnosis latency from request start, by stage",
+    label_names=("stage",)
+)
+copilot_stream_latency = Histogram(
+    "medai_copilot_stream_seconds",
+    "Streaming copilot latency from request start, by endpoint and stage",
+    label_names=("endpoint", "stage")
+)
+
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
 
+@app.on_event("startup")
+async def start_model_loading():
+    # Startup-policy models begin loading now; lazy ones load on first use
+    await multimodal_service.models.start()
+    await advanced_ai_service.models.start()
+    # Coding jobs interrupted by the last shutdown, or orphaned by a dead worker, pick up from their pending visits
+    await batch_coding_service.start()
+
 @app.get("/")
 async def root():
     return {"message": "MedAI Healthcare Platform API", "status": "running", "version": "2.0.0"}
@@ -149,7 +183,7 @@ async def analyze_bloodwork(
         file_path = await file_handler.save_upload(file, file_id)
         
         # Analyze bloodwork
-        result = await bloodwork_service.analyze_bloodwork(file_path)
+        result = await bloodwork_service.analyze_bloodwork(file_path, patient_id=patient_id)
         
         # Clean up temporary file
         file_handler.cleanup_file(file_path)
@@ -164,6 +198,78 @@ async def analyze_bloodwork(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/labs/ingest/fhir")
+async def ingest_fhir_labs(
+    file: UploadFile = File(...),
+    analyze: bool = Form(False)
+):
+    """
+    Ingest a FHIR Bulk Data NDJSON export of lab Observation resources
+    """
+    try:
+        result = await lab_ingestion_service.ingest_fhir_ndjson(file.file, analyze=analyze)
+        return {"success": True, "ingestion": result, "timestamp": datetime.now().isoformat()}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/labs/ingest/hl7")
+async def ingest_hl7_labs(
+    file: UploadFile = File(...),
+    analyze: bool = Form(False)
+):
+    """
+    Ingest HL7v2 ORU^R01 lab result messages
+    """
+    try:
+        result = await lab_ingestion_service.ingest_hl7_oru(file.file, analyze=analyze)
+        return {"success": True, "ingestion": result, "timestamp": datetime.now().isoformat()}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/labs/trends/{patient_id}")
+async def get_lab_trends(patient_id: str, analyte: Optional[str] = None):
+    """
+    Get longitudinal lab trends (last value, delta, rolling slope and z-score)
+    """
+    try:
+        if analyte:
+            trend = lab_timeseries_store.get_trend(patient_id, analyte)
+            trends = {analyte: trend} if trend else {}
+        else:
+            trends = lab_timeseries_store.get_trends(patient_id)
+        
+        return {
+            "success": True,
+            "patient_id": patient_id,
+            "trends": {name: trend.to_dict() for name, trend in trends.items()},
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/labs/series/{patient_id}/{analyte}")
+async def get_lab_series(
+    patient_id: str,
+    analyte: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+):
+    """
+    Get the raw time series for one analyte
+    """
+    try:
+        start_dt = datetime.fromisoformat(start_date) if start_date else None
+        end_dt = datetime.fromisoformat(end_date) if end_date else None
+        
+        series = lab_timeseries_store.get_series(patient_id, analyte, start_dt, end_dt)
+        return {"success": True, "patient_id": patient_id, "series": series}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/predict/recovery", response_model=RecoveryPredictionResponse)
 async def predict_recovery(
     symptoms: str = Form(...),
@@ -172,10 +278,14 @@ async def predict_recovery(
     bloodwork_analysis: Optional[str] = Form(None),
     patient_age: Optional[int] = Form(None),
     patient_gender: Optional[str] = Form(None),
-    visit_frequency: Optional[int] = Form(1)
+    visit_frequency: Optional[int] = Form(1),
+    quantiles: Optional[str] = Form(None)
 ):
     """
     Predict recovery time and complication risk
+    
+    quantiles is an optional comma-separated list (e.g. "0.05,0.5,0.95")
+    for the per-tree recovery interval.
     """
     try:
         # Parse optional JSON inputs
@@ -189,7 +299,8 @@ async def predict_recovery(
             bloodwork_analysis=bloodwork_data,
             patient_age=patient_age,
             patient_gender=patient_gender,
-            visit_frequency=visit_frequency
+            visit_frequency=visit_frequency,
+            quantiles=quantiles
         )
         
         return RecoveryPredictionResponse(
@@ -198,6 +309,60 @@ async def predict_recovery(
             timestamp=datetime.now().isoformat()
         )
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/predict/recovery/batch", response_model=BatchRecoveryPredictionResponse)
+async def predict_recovery_batch(request: BatchRecoveryPredictionRequest):
+    """
+    Predict recovery time and complication risk for many cases in one call
+    """
+    try:
+        start_time = time.time()
+        
+        predictions = await recovery_service.predict_recovery_batch(
+            [case.model_dump() for case in request.cases],
+            quantiles=request.quantiles
+        )
+        
+        return BatchRecoveryPredictionResponse(
+            success=True,
+            predictions=predictions,
+            count=len(predictions),
+            processing_time=time.time() - start_time,
+            timestamp=datetime.now().isoformat()
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/predict/recovery/sensitivity", response_model=SensitivitySweepResponse)
+async def predict_recovery_sensitivity(request: SensitivitySweepRequest):
+    """
+    What-if sweep: recovery time and complication risk over a grid of inputs
+    """
+    try:
+        start_time = time.time()
+        
+        result = await recovery_service.sensitivity_sweep(
+            request.base_case.model_dump(),
+            request.grid,
+            include_intervals=request.include_intervals
+        )
+        
+        return SensitivitySweepResponse(
+            success=True,
+            **result,
+            processing_time=time.time() - start_time,
+            timestamp=datetime.now().isoformat()
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -208,11 +373,22 @@ async def submit_feedback(
     doctor_id: str = Form(...),
     patient_id: str = Form(...),
     comments: Optional[str] = Form(None),
-    modified_diagnosis: Optional[str] = Form(None)
+    modified_diagnosis: Optional[str] = Form(None),
+    recovery_case: Optional[str] = Form(None),
+    actual_recovery_days: Optional[float] = Form(None),
+    had_complications: Optional[bool] = Form(None)
 ):
     """
     Submit doctor feedback on AI suggestions
+    
+    recovery_case is the JSON-encoded /predict/recovery input; with the
+    observed outcome fields it is used to retrain the recovery models.
     """
+    try:
+        case = recovery_service.validate_case(json.loads(recovery_case)) if recovery_case else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid recovery_case: {e}")
+    
     try:
         result = await feedback_service.submit_feedback(
             analysis_id=analysis_id,
@@ -220,7 +396,10 @@ async def submit_feedback(
             doctor_id=doctor_id,
             patient_id=patient_id,
             comments=comments,
-            modified_diagnosis=modified_diagnosis
+            modified_diagnosis=modified_diagnosis,
+            recovery_case=case,
+            actual_recovery_days=actual_recovery_days,
+            had_complications=had_complications
         )
         
         return FeedbackResponse(
@@ -233,6 +412,55 @@ async def submit_feedback(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/feedback/process")
+async def process_feedback():
+    """
+    Process pending feedback and start recovery model retraining when due
+    """
+    try:
+        return await feedback_service.process_feedback_batch()
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/models/recovery/retraining")
+async def get_recovery_retraining_status():
+    """
+    Get incremental retraining status for the recovery models
+    """
+    try:
+        return recovery_retrainer.get_status()
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus metrics
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/models/ready")
+async def get_models_ready():
+    """
+    Readiness probe: 503 until every startup-loaded model is ready
+    """
+    status = {
+        "multimodal_model": multimodal_service.models.get_status(),
+        "advanced_ai_model": advanced_ai_service.models.get_status()
+    }
+    pending = [
+        f"{service}.{name}"
+        for service, models in status.items()
+        for name, model in models.items()
+        if model["policy"] == "startup" and model["state"] != "ready"
+    ]
+    return JSONResponse(
+        status_code=503 if pending else 200,
+        content={"ready": not pending, "pending": pending, "models": status}
+    )
+
 @app.get("/models/status")
 async def get_model_status():
     """
@@ -248,7 +476,8 @@ async def get_model_status():
             "doctor_copilot_model": await doctor_copilot_service.get_model_status(),
             "bias_fairness_model": await bias_fairness_service.get_model_status(),
             "advanced_ai_model": await advanced_ai_service.get_model_status(),
-            "security_compliance_model": await security_compliance_service.get_model_status()
+            "security_compliance_model": await security_compliance_service.get_model_status(),
+            "llm_gateway": get_llm_gateway().get_stats()
         }
         return status
     except Exception as e:
@@ -271,19 +500,15 @@ async def analyze_multimodal_diagnosis(
         demographics = json.loads(patient_demographics)
         lab_data_dict = json.loads(lab_data) if lab_data else None
         
-        # Process images if provided
+        # Pass upload bytes straight through; images are decoded once, in memory
         image_data = []
         if images:
             for image in images:
-                file_path = await file_handler.save_upload(image, str(uuid.uuid4()))
-                with open(file_path, 'rb') as f:
-                    image_bytes = f.read()
                 image_data.append({
-                    "image_data": base64.b64encode(image_bytes).decode(),
+                    "image_data": await image.read(),
                     "image_type": image.content_type,
                     "metadata": {"filename": image.filename}
                 })
-                file_handler.cleanup_file(file_path)
         
         result = await multimodal_service.analyze_multimodal(
             symptoms=symptoms,
@@ -295,6 +520,67 @@ async def analyze_multimodal_diagnosis(
         
         return result
         
+    except ModelUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/diagnose/multimodal/stream")
+async def analyze_multimodal_diagnosis_stream(
+    symptoms: str = Form(...),
+    patient_demographics: str = Form(...),  # JSON string
+    medical_history: Optional[str] = Form(None),
+    lab_data: Optional[str] = Form(None),  # JSON string
+    images: Optional[List[UploadFile]] = File(None)
+):
+    """
+    Multimodal diagnosis over server-sent events
+    
+    Emits a "diagnosis" event with the structured fields as soon as fusion
+    finishes, "explanation" events with text deltas, then "done".
+    """
+    request_start = time.perf_counter()
+    try:
+        demographics = json.loads(patient_demographics)
+        lab_data_dict = json.loads(lab_data) if lab_data else None
+        
+        image_data = []
+        if images:
+            for image in images:
+                image_data.append({
+                    "image_data": await image.read(),
+                    "image_type": image.content_type,
+                    "metadata": {"filename": image.filename}
+                })
+        
+        events = multimodal_service.analyze_multimodal_stream(
+            symptoms=symptoms,
+            images=image_data if image_data else None,
+            lab_data=lab_data_dict,
+            patient_demographics=demographics,
+            medical_history=medical_history
+        )
+        
+        async def timed_events():
+            first_token = False
+            try:
+                async for item in events:
+                    elapsed = time.perf_counter() - request_start
+                    if item["event"] == "diagnosis":
+                        multimodal_stream_latency.observe(elapsed, stage="first_byte")
+                    elif item["event"] == "explanation" and not first_token:
+                        first_token = True
+                        multimodal_stream_latency.observe(elapsed, stage="first_token")
+                    elif item["event"] == "done":
+                        multimodal_stream_latency.observe(elapsed, stage="complete")
+                    yield item
+            except ModelUnavailableError as e:
+                yield {"event": "error", "data": {"status_code": 503, "detail": str(e)}}
+            except Exception as e:
+                yield {"event": "error", "data": {"status_code": 500, "detail": str(e)}}
+        
+        return sse_response(timed_events())
+        
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -415,7 +701,8 @@ async def detect_symptom_patterns(
 async def generate_soap_note(
     context: str = Form(...),  # JSON string
     doctor_notes: Optional[str] = Form(None),
-    style_preference: str = Form("comprehensive")
+    style_preference: str = Form("comprehensive"),
+    include_alternatives: bool = Form(True)
 ):
     """
     Generate structured SOAP note from doctor's free text and patient data
@@ -428,7 +715,8 @@ async def generate_soap_note(
         result = await doctor_copilot_service.generate_soap_note(
             context=note_context,
             doctor_notes=doctor_notes,
-            style_preference=style_preference
+            style_preference=style_preference,
+            include_alternatives=include_alternatives
         )
         
         return {
@@ -443,10 +731,57 @@ async def generate_soap_note(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _timed_copilot_stream(events, endpoint: str, request_start: float):
+    """Record time to first token and completion; report failures as an error event"""
+    first_token = False
+    try:
+        async for item in events:
+            elapsed = time.perf_counter() - request_start
+            if item["event"] == "content" and not first_token:
+                first_token = True
+                copilot_stream_latency.observe(elapsed, endpoint=endpoint, stage="first_token")
+            elif item["event"] == "suggestion":
+                copilot_stream_latency.observe(elapsed, endpoint=endpoint, stage="complete")
+            yield item
+    except Exception as e:
+        yield {"event": "error", "data": {"status_code": 500, "detail": str(e)}}
+
+@app.post("/copilot/generate-soap/stream")
+async def generate_soap_note_stream(
+    context: str = Form(...),  # JSON string
+    doctor_notes: Optional[str] = Form(None),
+    style_preference: str = Form("comprehensive"),
+    include_alternatives: bool = Form(True)
+):
+    """
+    SOAP note generation over server-sent events
+    
+    Emits "content" events with text deltas as they are generated, then one
+    "suggestion" event with confidence, reasoning, alternatives and references.
+    """
+    request_start = time.perf_counter()
+    try:
+        # Parse context
+        context_data = json.loads(context)
+        note_context = NoteContext(**context_data)
+        
+        events = doctor_copilot_service.generate_soap_note_stream(
+            context=note_context,
+            doctor_notes=doctor_notes,
+            style_preference=style_preference,
+            include_alternatives=include_alternatives
+        )
+        
+        return sse_response(_timed_copilot_stream(events, "generate_soap", request_start))
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/copilot/suggest-labs")
 async def suggest_lab_tests(
     context: str = Form(...),  # JSON string
-    suspected_conditions: Optional[str] = Form(None)  # JSON string
+    suspected_conditions: Optional[str] = Form(None),  # JSON string
+    include_alternatives: bool = Form(True)
 ):
     """
     Suggest relevant laboratory tests based on symptoms and clinical context
@@ -459,7 +794,8 @@ async def suggest_lab_tests(
         
         result = await doctor_copilot_service.suggest_lab_tests(
             context=note_context,
-            suspected_conditions=suspected_conditions_list
+            suspected_conditions=suspected_conditions_list,
+            include_alternatives=include_alternatives
         )
         
         return {
@@ -478,7 +814,8 @@ async def suggest_lab_tests(
 async def suggest_diagnosis(
     context: str = Form(...),  # JSON string
     include_differential: bool = Form(True),
-    include_confidence: bool = Form(True)
+    include_confidence: bool = Form(True),
+    include_alternatives: bool = Form(True)
 ):
     """
     Suggest primary diagnosis and differential diagnoses
@@ -491,7 +828,8 @@ async def suggest_diagnosis(
         result = await doctor_copilot_service.suggest_diagnosis(
             context=note_context,
             include_differential=include_differential,
-            include_confidence=include_confidence
+            include_confidence=include_confidence,
+            include_alternatives=include_alternatives
         )
         
         return {
@@ -511,7 +849,8 @@ async def explain_diagnosis_to_patient(
     diagnosis: str = Form(...),
     context: str = Form(...),  # JSON string
     education_level: str = Form("high_school"),
-    language: str = Form("English")
+    language: str = Form("English"),
+    include_alternatives: bool = Form(True)
 ):
     """
     Generate patient-friendly explanation of diagnosis
@@ -525,7 +864,8 @@ async def explain_diagnosis_to_patient(
             diagnosis=diagnosis,
             context=note_context,
             education_level=education_level,
-            language=language
+            language=language,
+            include_alternatives=include_alternatives
         )
         
         return {
@@ -544,7 +884,8 @@ async def explain_diagnosis_to_patient(
 async def suggest_follow_up_plan(
     context: str = Form(...),  # JSON string
     diagnosis: str = Form(...),
-    treatment_initiated: Optional[str] = Form(None)  # JSON string
+    treatment_initiated: Optional[str] = Form(None),  # JSON string
+    include_alternatives: bool = Form(True)
 ):
     """
     Suggest follow-up plan and monitoring recommendations
@@ -558,7 +899,8 @@ async def suggest_follow_up_plan(
         result = await doctor_copilot_service.suggest_follow_up_plan(
             context=note_context,
             diagnosis=diagnosis,
-            treatment_initiated=treatment_list
+            treatment_initiated=treatment_list,
+            include_alternatives=include_alternatives
         )
         
         return {
@@ -577,7 +919,8 @@ async def suggest_follow_up_plan(
 async def summarize_visit(
     context: str = Form(...),  # JSON string
     doctor_notes: str = Form(...),
-    summary_type: str = Form("comprehensive")
+    summary_type: str = Form("comprehensive"),
+    include_alternatives: bool = Form(True)
 ):
     """
     Summarize the patient visit for documentation
@@ -590,7 +933,8 @@ async def summarize_visit(
         result = await doctor_copilot_service.summarize_visit(
             context=note_context,
             doctor_notes=doctor_notes,
-            summary_type=summary_type
+            summary_type=summary_type,
+            include_alternatives=include_alternatives
         )
         
         return {
@@ -605,11 +949,40 @@ async def summarize_visit(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/copilot/summarize-visit/stream")
+async def summarize_visit_stream(
+    context: str = Form(...),  # JSON string
+    doctor_notes: str = Form(...),
+    summary_type: str = Form("comprehensive"),
+    include_alternatives: bool = Form(True)
+):
+    """
+    Visit summary over server-sent events (same events as /copilot/generate-soap/stream)
+    """
+    request_start = time.perf_counter()
+    try:
+        # Parse context
+        context_data = json.loads(context)
+        note_context = NoteContext(**context_data)
+        
+        events = doctor_copilot_service.summarize_visit_stream(
+            context=note_context,
+            doctor_notes=doctor_notes,
+            summary_type=summary_type,
+            include_alternatives=include_alternatives
+        )
+        
+        return sse_response(_timed_copilot_stream(events, "summarize_visit", request_start))
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/copilot/suggest-cpt-codes")
 async def suggest_cpt_codes(
     context: str = Form(...),  # JSON string
     procedures_performed: Optional[str] = Form(None),  # JSON string
-    visit_complexity: str = Form("moderate")
+    visit_complexity: str = Form("moderate"),
+    include_alternatives: bool = Form(True)
 ):
     """
     Suggest appropriate CPT codes for billing
@@ -623,7 +996,8 @@ async def suggest_cpt_codes(
         result = await doctor_copilot_service.suggest_cpt_codes(
             context=note_context,
             procedures_performed=procedures_list,
-            visit_complexity=visit_complexity
+            visit_complexity=visit_complexity,
+            include_alternatives=include_alternatives
         )
         
         return {
@@ -638,6 +1012,80 @@ async def suggest_cpt_codes(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/copilot/alternatives")
+async def generate_copilot_alternatives(
+    suggestion_type: str = Form(...),
+    context: str = Form(...),  # JSON string
+    options: Optional[str] = Form(None)  # JSON string, arguments of the original request
+):
+    """
+    Fetch alternatives for a suggestion requested with include_alternatives=false
+    """
+    try:
+        context_data = json.loads(context)
+        note_context = NoteContext(**context_data)
+        options_dict = json.loads(options) if options else None
+        
+        alternatives = await doctor_copilot_service.generate_alternatives(
+            suggestion_type=suggestion_type,
+            context=note_context,
+            options=options_dict
+        )
+        
+        return {
+            "suggestion_type": suggestion_type,
+            "alternatives": alternatives
+        }
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/copilot/cpt-batch")
+async def create_cpt_batch_job(
+    visits: str = Form(...)  # JSON list of {visit_id, context, procedures_performed, visit_complexity}
+):
+    """
+    Queue a batch of visits for CPT/ICD-10 coding; poll the job for progress
+    """
+    try:
+        visits_list = json.loads(visits)
+        
+        return await batch_coding_service.create_job(visits_list)
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/copilot/cpt-batch/{job_id}")
+async def get_cpt_batch_job(job_id: str, include_results: bool = False):
+    """
+    Get coding job status and progress, optionally with per-visit results
+    """
+    job = batch_coding_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Coding job not found")
+    
+    try:
+        if include_results:
+            job["results"] = batch_coding_service.get_results(job_id)
+        return job
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/copilot/cpt-batch/{job_id}/resume")
+async def resume_cpt_batch_job(job_id: str):
+    """
+    Retry a coding job's failed visits and continue any still pending
+    """
+    job = await batch_coding_service.resume_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Coding job not found")
+    return job
+
 # Bias & Fairness Dashboard API
 @app.post("/bias/analyze")
 async def analyze_model_bias(
@@ -773,6 +1221,8 @@ async def analyze_voice_emotion(
             "audio_features": result.audio_features
         }
         
+    except ModelUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -872,10 +1322,14 @@ async def advanced_clinical_decision_support(
     patient_data: str = Form(...),  # JSON string
     symptoms: str = Form(...),  # JSON string
     lab_results: Optional[str] = Form(None),  # JSON string
-    imaging_results: Optional[str] = Form(None)  # JSON string
+    imaging_results: Optional[str] = Form(None),  # JSON string
+    latency_budget_ms: Optional[float] = Form(None)
 ):
     """
     Advanced clinical decision support with evidence-based recommendations
+    
+    With latency_budget_ms, steps still running at the deadline are skipped and
+    the response is marked partial.
     """
     try:
         # Parse inputs
@@ -888,7 +1342,8 @@ async def advanced_clinical_decision_support(
             patient_data=patient_data_dict,
             symptoms=symptoms_list,
             lab_results=lab_results_dict,
-            imaging_results=imaging_results_dict
+            imaging_results=imaging_results_dict,
+            latency_budget_s=latency_budget_ms / 1000 if latency_budget_ms else None
         )
         
         return {
@@ -897,7 +1352,9 @@ async def advanced_clinical_decision_support(
             "treatment_recommendations": result.treatment_recommendations,
             "risk_assessment": result.risk_assessment,
             "evidence_level": result.evidence_level,
-            "clinical_guidelines": result.clinical_guidelines
+            "clinical_guidelines": result.clinical_guidelines,
+            "partial": result.partial,
+            "pending_steps": result.pending_steps
         }
         
     except Exception as e:
@@ -1372,7 +1829,7 @@ async def analyze_bloodwork_enhanced(
         
         # Analyze bloodwork with enhanced features
         analysis = await bloodwork_service.analyze_bloodwork_enhanced(
-            file_path, patient_age, patient_gender
+            file_path, patient_age, patient_gender, patient_id=patient_id
         )
         
         # Clean up file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
 
 class Condition(BaseModel):
@@ -45,6 +45,7 @@ class BloodworkAnalysisResult(BaseModel):
     recommendations: List[str]
     urgency_level: str = Field(..., pattern="^(low|medium|high|critical)$")
     suggested_tests: List[str]
+    trends: Optional[Dict[str, Dict[str, Any]]] = None
     processing_time: float
 
 class BloodworkAnalysisResponse(BaseModel):
@@ -120,6 +121,7 @@ class EnhancedBloodworkAnalysis(BaseModel):
     recommendations: List[str]
     urgency_level: str
     suggested_tests: List[str]
+    trends: Optional[Dict[str, Dict[str, Any]]] = None
     cancer_risk: CancerRisk
     life_expectancy: LifeExpectancy
     interventions: List[str] = []
@@ -161,6 +163,42 @@ class RecoveryPredictionResponse(BaseModel):
     prediction: RecoveryPrediction
     timestamp: str
 
+class RecoveryPredictionCase(BaseModel):
+    symptoms: str
+    diagnosis: str
+    scan_analysis: Optional[Dict[str, Any]] = None
+    bloodwork_analysis: Optional[Dict[str, Any]] = None
+    patient_age: Optional[int] = None
+    patient_gender: Optional[str] = None
+    visit_frequency: int = 1
+
+class BatchRecoveryPredictionRequest(BaseModel):
+    cases: List[RecoveryPredictionCase] = Field(..., min_length=1, max_length=20000)
+    quantiles: Optional[List[float]] = None
+
+class BatchRecoveryPredictionResponse(BaseModel):
+    success: bool
+    predictions: List[RecoveryPrediction]  # in request order
+    count: int
+    processing_time: float
+    timestamp: str
+
+class SensitivitySweepRequest(BaseModel):
+    base_case: RecoveryPredictionCase
+    # Input name -> values, e.g. {"visit_frequency": [1, 2, 4], "lab_urgency": ["low", "high"]}
+    grid: Dict[str, List[Union[int, float, str]]]
+    include_intervals: bool = True
+
+class SensitivitySweepResponse(BaseModel):
+    success: bool
+    axes: Dict[str, List[Union[int, float, str]]]
+    shape: List[int]
+    points: int
+    base: Dict[str, float]
+    surface: Dict[str, List[Any]]  # nested lists indexed [axis0][axis1]...
+    processing_time: float
+    timestamp: str
+
 class FeedbackResponse(BaseModel):
     success: bool
     feedback_id: str
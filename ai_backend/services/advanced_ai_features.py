@@ -3,10 +3,10 @@ import json
 import logging
 import os
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Awaitable
 import numpy as np
 import pandas as pd
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
@@ -17,8 +17,6 @@ import base64
 import torch
 import torch.nn as nn
 from transformers import AutoTokenizer, AutoModel, pipeline
-import openai
-from openai import AsyncOpenAI
 import librosa
 import soundfile as sf
 from scipy import stats
@@ -28,6 +26,9 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 import joblib
 
+from services.llm_gateway import Priority, get_llm_gateway
+from services.model_lifecycle import ModelLifecycleManager
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -60,6 +61,8 @@ class ClinicalDecisionSupport:
     risk_assessment: Dict[str, Any]
     evidence_level: str
     clinical_guidelines: List[str]
+    partial: bool = False
+    pending_steps: List[str] = field(default_factory=list)
 
 class AdvancedAIFeaturesService:
     """
@@ -68,7 +71,7 @@ class AdvancedAIFeaturesService:
     """
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_llm_gateway().client("advanced_ai", Priority.STANDARD)
         self.model_version = "v2.0.0"
         
         # Initialize voice emotion detection
@@ -81,64 +84,51 @@ class AdvancedAIFeaturesService:
         # Initialize clinical decision support
         self.clinical_knowledge_base = self._load_clinical_knowledge()
         
-        # Load models asynchronously
-        asyncio.create_task(self._load_models())
+        # Optional end-to-end deadline for clinical decision support; unset waits for every step
+        budget = os.getenv("CDS_LATENCY_BUDGET_S")
+        self.cds_latency_budget_s = float(budget) if budget else None
+        
+        # Models load at startup or on first use (MODEL_LOAD_POLICY); requests await readiness
+        self.models = ModelLifecycleManager("advanced_ai", wait_timeout_s=float(os.getenv("MODEL_WAIT_TIMEOUT_S", 30)))
+        self.models.register("emotion_classifier", self._load_emotion_classifier)
+        self.models.register("voice_processor", self._load_voice_processor)
+        self.models.register("predictive_models", self._load_predictive_models)
         
         logger.info("AdvancedAIFeaturesService initialized")
     
-    async def _load_models(self):
-        """Load advanced AI models asynchronously"""
-        try:
-            # Load voice emotion detection model
-            self.emotion_classifier = pipeline(
-                "audio-classification",
-                model="superb/wav2vec2-base-superb-ks",
-                device=0 if torch.cuda.is_available() else -1
-            )
-            
-            # Load voice processor
-            self.voice_processor = pipeline(
-                "automatic-speech-recognition",
-                model="facebook/wav2vec2-base-960h"
-            )
-            
-            # Load predictive models
-            await self._load_predictive_models()
-            
-            logger.info("Advanced AI models loaded successfully")
-            
-        except Exception as e:
-            logger.error(f"Error loading advanced AI models: {e}")
-            raise
+    def _load_emotion_classifier(self):
+        """Load voice emotion detection model"""
+        self.emotion_classifier = pipeline(
+            "audio-classification",
+            model="superb/wav2vec2-base-superb-ks",
+            device=0 if torch.cuda.is_available() else -1
+        )
+        return self.emotion_classifier
+    
+    def _load_voice_processor(self):
+        """Load voice processor"""
+        self.voice_processor = pipeline(
+            "automatic-speech-recognition",
+            model="facebook/wav2vec2-base-960h"
+        )
+        return self.voice_processor
     
-    async def _load_predictive_models(self):
+    def _load_predictive_models(self) -> Dict[str, Any]:
         """Load predictive analytics models"""
-        try:
+        predictive_models = {
             # Disease progression models
-            self.predictive_models["disease_progression"] = RandomForestRegressor(
-                n_estimators=100, random_state=42
-            )
-            
+            "disease_progression": RandomForestRegressor(n_estimators=100, random_state=42),
             # Readmission risk model
-            self.predictive_models["readmission_risk"] = RandomForestClassifier(
-                n_estimators=100, random_state=42
-            )
-            
+            "readmission_risk": RandomForestClassifier(n_estimators=100, random_state=42),
             # Treatment response model
-            self.predictive_models["treatment_response"] = RandomForestClassifier(
-                n_estimators=100, random_state=42
-            )
-            
+            "treatment_response": RandomForestClassifier(n_estimators=100, random_state=42),
             # Mortality risk model
-            self.predictive_models["mortality_risk"] = RandomForestClassifier(
-                n_estimators=100, random_state=42
-            )
-            
-            logger.info("Predictive models initialized")
-            
-        except Exception as e:
-            logger.error(f"Error loading predictive models: {e}")
-            raise
+            "mortality_risk": RandomForestClassifier(n_estimators=100, random_state=42)
+        }
+        self.predictive_models = predictive_models
+        
+        logger.info("Predictive models initialized")
+        return predictive_models
     
     def _load_clinical_knowledge(self) -> Dict[str, Any]:
         """Load clinical knowledge base"""
@@ -185,6 +175,9 @@ class AdvancedAIFeaturesService:
         Analyze voice emotion for stress, pain, and mental health indicators
         """
         try:
+            # Wait (briefly) for the voice models if they are still loading
+            await self.models.wait_ready(["emotion_classifier", "voice_processor"])
+            
             # Save audio temporarily
             temp_audio_path = f"temp_audio_{patient_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.wav"
             with open(temp_audio_path, "wb") as f:
@@ -361,7 +354,8 @@ class AdvancedAIFeaturesService:
             features = self._prepare_progression_features(patient_data, condition)
             
             # Get model for condition
-            model = self.predictive_models.get("disease_progression")
+            predictive_models = await self.models.get("predictive_models")
+            model = predictive_models.get("disease_progression")
             
             # Make prediction (simplified for demo)
             # In production, this would use trained models with real data
@@ -477,23 +471,59 @@ class AdvancedAIFeaturesService:
         patient_data: Dict[str, Any],
         symptoms: List[str],
         lab_results: Dict[str, Any] = None,
-        imaging_results: Dict[str, Any] = None
+        imaging_results: Dict[str, Any] = None,
+        latency_budget_s: Optional[float] = None
     ) -> ClinicalDecisionSupport:
         """
         Advanced clinical decision support with evidence-based recommendations
+        
+        Steps run as a dependency graph: risk assessment does not need the
+        primary diagnosis and runs alongside it; differentials and treatments
+        run together once it is known. With a latency budget (argument or
+        CDS_LATENCY_BUDGET_S), steps still running at the deadline are dropped
+        and the result is returned with partial=True and the steps listed in
+        pending_steps.
         """
         try:
-            # Analyze symptoms and patient data
-            primary_diagnosis = await self._determine_primary_diagnosis(symptoms, patient_data, lab_results, imaging_results)
-            
-            # Generate differential diagnoses
-            differential_diagnoses = await self._generate_differential_diagnoses(symptoms, patient_data, primary_diagnosis)
-            
-            # Generate treatment recommendations
-            treatment_recommendations = await self._generate_treatment_recommendations(primary_diagnosis, patient_data)
-            
-            # Assess risk
-            risk_assessment = await self._assess_clinical_risk(primary_diagnosis, patient_data, lab_results)
+            budget = latency_budget_s if latency_budget_s is not None else self.cds_latency_budget_s
+            deadline = asyncio.get_running_loop().time() + budget if budget else None
+            pending_steps: List[str] = []
+            
+            # Assess risk (patient-level, independent of the diagnosis)
+            risk_task = asyncio.create_task(self._assess_clinical_risk(patient_data, lab_results))
+            
+            try:
+                # Analyze symptoms and patient data
+                primary_diagnosis = await self._within_budget(
+                    "primary_diagnosis",
+                    self._determine_primary_diagnosis(symptoms, patient_data, lab_results, imaging_results),
+                    deadline, None, pending_steps
+                )
+                
+                if primary_diagnosis is None:
+                    primary_diagnosis = "Unknown diagnosis"
+                    differential_diagnoses, treatment_recommendations = [], []
+                    pending_steps.extend(["differential_diagnoses", "treatment_recommendations"])
+                else:
+                    # Differential diagnoses and treatment recommendations both only need the diagnosis
+                    differential_diagnoses, treatment_recommendations = await asyncio.gather(
+                        self._within_budget(
+                            "differential_diagnoses",
+                            self._generate_differential_diagnoses(symptoms, patient_data, primary_diagnosis),
+                            deadline, [], pending_steps
+                        ),
+                        self._within_budget(
+                            "treatment_recommendations",
+                            self._generate_treatment_recommendations(primary_diagnosis, patient_data),
+                            deadline, [], pending_steps
+                        )
+                    )
+                
+                risk_assessment = await self._within_budget(
+                    "risk_assessment", risk_task, deadline, self._unknown_risk(), pending_steps
+                )
+            finally:
+                risk_task.cancel()
             
             # Determine evidence level
             evidence_level = self._determine_evidence_level(primary_diagnosis, symptoms, lab_results)
@@ -501,19 +531,36 @@ class AdvancedAIFeaturesService:
             # Get clinical guidelines
             clinical_guidelines = self._get_clinical_guidelines(primary_diagnosis)
             
+            if pending_steps:
+                logger.warning(f"Clinical decision support returned partial results; pending: {', '.join(pending_steps)}")
+            
             return ClinicalDecisionSupport(
                 primary_diagnosis=primary_diagnosis,
                 differential_diagnoses=differential_diagnoses,
                 treatment_recommendations=treatment_recommendations,
                 risk_assessment=risk_assessment,
                 evidence_level=evidence_level,
-                clinical_guidelines=clinical_guidelines
+                clinical_guidelines=clinical_guidelines,
+                partial=bool(pending_steps),
+                pending_steps=pending_steps
             )
             
         except Exception as e:
             logger.error(f"Error in advanced clinical decision support: {e}")
             raise
     
+    async def _within_budget(self, step: str, awaitable: Awaitable, deadline: Optional[float], fallback: Any, pending_steps: List[str]) -> Any:
+        """Await a pipeline step, giving up with the fallback at the deadline"""
+        if deadline is None:
+            return await awaitable
+        
+        remaining = max(0.0, deadline - asyncio.get_running_loop().time())
+        try:
+            return await asyncio.wait_for(awaitable, timeout=remaining)
+        except asyncio.TimeoutError:
+            pending_steps.append(step)
+            return fallback
+    
     def _prepare_progression_features(self, patient_data: Dict[str, Any], condition: str) -> Dict[str, Any]:
         """Prepare features for disease progression prediction"""
         features = {
@@ -822,7 +869,7 @@ class AdvancedAIFeaturesService:
             Provide only the primary diagnosis name.
             """
             
-            response = await self.client.chat.completions.create(
+            response = await self.llm.chat(
                 model="gpt-4",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=50,
@@ -852,7 +899,7 @@ class AdvancedAIFeaturesService:
             4. Recommended tests to rule out
             """
             
-            response = await self.client.chat.completions.create(
+            response = await self.llm.chat(
                 model="gpt-4",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=500,
@@ -903,7 +950,7 @@ class AdvancedAIFeaturesService:
             logger.error(f"Error generating treatment recommendations: {e}")
             return []
     
-    async def _assess_clinical_risk(self, primary_diagnosis: str, patient_data: Dict[str, Any], lab_results: Dict[str, Any] = None) -> Dict[str, Any]:
+    async def _assess_clinical_risk(self, patient_data: Dict[str, Any], lab_results: Dict[str, Any] = None) -> Dict[str, Any]:
         """Assess clinical risk factors"""
         try:
             risk_assessment = {
@@ -944,7 +991,11 @@ class AdvancedAIFeaturesService:
             
         except Exception as e:
             logger.error(f"Error assessing clinical risk: {e}")
-            return {"overall_risk": "unknown", "risk_factors": [], "risk_score": 0.0, "recommendations": []}
+            return self._unknown_risk()
+    
+    def _unknown_risk(self) -> Dict[str, Any]:
+        """Risk assessment placeholder when it could not be computed"""
+        return {"overall_risk": "unknown", "risk_factors": [], "risk_score": 0.0, "recommendations": []}
     
     def _determine_evidence_level(self, primary_diagnosis: str, symptoms: List[str], lab_results: Dict[str, Any] = None) -> str:
         """Determine evidence level for recommendations"""
@@ -970,6 +1021,7 @@ class AdvancedAIFeaturesService:
         """Get status of advanced AI models"""
         return {
             "model_version": self.model_version,
+            "models": self.models.get_status(),
             "voice_emotion_model_loaded": self.emotion_classifier is not None,
             "voice_processor_loaded": self.voice_processor is not None,
             "predictive_models_loaded": len(self.predictive_models) > 0,
@@ -0,0 +1,529 @@
+"""
+Batch CPT/ICD-10 coding for end-of-day visit backlogs
+
+Coding one visit per request repeats the instructions in every prompt and
+pays one round trip per visit. A batch job instead:
+- packs as many visits into one prompt as fit a token budget
+  (CODING_PACK_TOKENS, counting the expected reply) and asks for a JSON
+  object keyed by each visit's position in the pack
+- runs up to CODING_CONCURRENCY packs at once through the LLM gateway at
+  background priority, so it never delays interactive copilot calls
+- records every visit's outcome in SQLite as its pack completes, so a job
+  interrupted by a restart resumes from the visits still pending
+
+Visits a reply leaves out, or codes unreadably, are retried on their own;
+a pack whose call fails outright is retried as a pack after
+CODING_RETRY_DELAY_S. Either way a visit is marked failed after
+CODING_MAX_ATTEMPTS tries.
+
+Several workers can share the database, so a job only runs in the process
+that claims it: the claim is a conditional UPDATE that sets the job's owner
+and a lease (CODING_LEASE_S), and the runner renews the lease while it
+works. A job whose lease has lapsed, because its worker died, is taken
+over by the next worker to sweep for unfinished jobs.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.doctor_copilot import NoteContext
+from services.llm_gateway import CHARS_PER_TOKEN, Priority, get_llm_gateway
+
+logger = logging.getLogger(__name__)
+
+PACK_INSTRUCTIONS = """As a medical coding assistant, assign CPT and ICD-10-CM codes to each visit below.
+Code every visit independently, using only its own documentation and the visit complexity given.
+Follow CPT and ICD-10-CM coding guidelines, documentation requirements and medical necessity criteria.
+
+Return only a JSON object keyed by the visit number in brackets, in this shape:
+{"1": {"cpt_codes": [{"code": "99214", "description": "...", "modifiers": [], "rationale": "..."}], "icd10_codes": [{"code": "J06.9", "description": "..."}]}}
+
+Visits:
+"""
+
+class BatchCodingService:
+    """
+    Resumable batch coding jobs
+
+    Args:
+        db_path: SQLite file holding jobs and per-visit results (CODING_JOBS_DB)
+        pack_tokens: Prompt plus expected reply tokens per pack (CODING_PACK_TOKENS)
+        max_visits_per_pack: Upper bound on visits per prompt (CODING_MAX_VISITS_PER_PACK)
+        reply_tokens_per_visit: Reply allowance per visit (CODING_REPLY_TOKENS_PER_VISIT)
+        concurrency: Packs in flight per job (CODING_CONCURRENCY)
+        max_attempts: Tries per visit before it is marked failed (CODING_MAX_ATTEMPTS)
+        retry_delay: Seconds to wait before retrying packs whose call failed (CODING_RETRY_DELAY_S)
+        lease_seconds: How long a job claim lasts without a renewal (CODING_LEASE_S)
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        pack_tokens: Optional[int] = None,
+        max_visits_per_pack: Optional[int] = None,
+        reply_tokens_per_visit: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        retry_delay: Optional[float] = None,
+        lease_seconds: Optional[float] = None
+    ):
+        self.llm = get_llm_gateway().client("batch_coding", Priority.BACKGROUND)
+        self.model = "gpt-4"
+        self.temperature = 0.1  # coding should be repeatable
+        self.db_path = db_path or os.getenv("CODING_JOBS_DB", "batch_coding.db")
+        self.pack_tokens = pack_tokens or int(os.getenv("CODING_PACK_TOKENS", "6000"))
+        self.max_visits_per_pack = max_visits_per_pack or int(os.getenv("CODING_MAX_VISITS_PER_PACK", "20"))
+        self.reply_tokens_per_visit = reply_tokens_per_visit or int(os.getenv("CODING_REPLY_TOKENS_PER_VISIT", "250"))
+        self.concurrency = concurrency or int(os.getenv("CODING_CONCURRENCY", "4"))
+        self.max_attempts = max_attempts or int(os.getenv("CODING_MAX_ATTEMPTS", "3"))
+        self.retry_delay = retry_delay if retry_delay is not None else float(os.getenv("CODING_RETRY_DELAY_S", "30"))
+        self.lease_seconds = lease_seconds or float(os.getenv("CODING_LEASE_S", "60"))
+        # Identifies this process's claims on jobs in the shared database
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+        self._init_database()
+
+        logger.info("BatchCodingService initialized")
+
+    def _init_database(self):
+        """Initialize job and visit tables"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS coding_jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner TEXT,
+                lease_expires REAL
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS coding_visits (
+                job_id TEXT NOT NULL,
+                visit_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                dropped INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                PRIMARY KEY (job_id, visit_id)
+            )
+        ''')
+
+        # Databases created before job leases and per-visit drop counts
+        columns = {
+            "coding_jobs": [("owner", "TEXT"), ("lease_expires", "REAL")],
+            "coding_visits": [("dropped", "INTEGER NOT NULL DEFAULT 0")]
+        }
+        for table, table_columns in columns.items():
+            existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+            for name, definition in table_columns:
+                if name not in existing:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_coding_visits_status
+            ON coding_visits(job_id, status, position)
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def _get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    async def create_job(self, visits: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Queue a batch of visits for coding and start it
+
+        Each visit is {"visit_id", "context", "procedures_performed",
+        "visit_complexity"}; context takes the NoteContext fields, visit_id
+        defaults to the visit's index.
+        """
+        if not visits:
+            raise ValueError("No visits to code")
+
+        rows = []
+        seen = set()
+        for index, visit in enumerate(visits):
+            visit_id = str(visit.get("visit_id", index))
+            if visit_id in seen:
+                raise ValueError(f"Duplicate visit_id: {visit_id}")
+            seen.add(visit_id)
+            try:
+                NoteContext(**visit["context"])
+            except (KeyError, TypeError) as e:
+                raise ValueError(f"Invalid context for visit {visit_id}: {e}")
+            payload = {
+                "context": visit["context"],
+                "procedures_performed": visit.get("procedures_performed") or [],
+                "visit_complexity": visit.get("visit_complexity", "moderate")
+            }
+            rows.append((visit_id, index, json.dumps(payload, default=str)))
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._get_connection()
+        conn.execute(
+            "INSERT INTO coding_jobs (job_id, status, total, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, len(rows), now, now)
+        )
+        conn.executemany(
+            "INSERT INTO coding_visits (job_id, visit_id, position, payload, status) VALUES (?, ?, ?, ?, 'pending')",
+            [(job_id, visit_id, position, payload) for visit_id, position, payload in rows]
+        )
+        conn.commit()
+        conn.close()
+
+        self._start(job_id)
+        return self.get_job(job_id)
+
+    async def resume_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Retry a job's failed visits and continue any still pending"""
+        if self.get_job(job_id) is None:
+            return None
+
+        conn = self._get_connection()
+        conn.execute(
+            "UPDATE coding_visits SET status = 'pending', attempts = 0, dropped = 0, error = NULL WHERE job_id = ? AND status = 'failed'",
+            (job_id,)
+        )
+        conn.commit()
+        conn.close()
+
+        self._start(job_id)
+        return self.get_job(job_id)
+
+    async def resume_unfinished_jobs(self) -> int:
+        """Take over queued jobs and jobs whose owner's lease has lapsed"""
+        conn = self._get_connection()
+        job_ids = [row[0] for row in conn.execute(
+            "SELECT job_id FROM coding_jobs WHERE status = 'queued' OR (status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)) ORDER BY created_at",
+            (time.time(),)
+        )]
+        conn.close()
+
+        resumed = sum(1 for job_id in job_ids if self._start(job_id))
+        if resumed:
+            logger.info(f"Resumed {resumed} unfinished coding jobs")
+        return resumed
+
+    async def start(self):
+        """Resume unfinished jobs now, then keep sweeping for orphaned ones once per lease period"""
+        await self.resume_unfinished_jobs()
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_unfinished_jobs())
+
+    async def _sweep_unfinished_jobs(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds)
+            try:
+                await self.resume_unfinished_jobs()
+            except Exception as e:
+                logger.error(f"Error sweeping unfinished coding jobs: {e}")
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job status and progress"""
+        conn = self._get_connection()
+        job = conn.execute(
+            "SELECT status, total, created_at, updated_at FROM coding_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM coding_visits WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        conn.close()
+
+        if job is None:
+            return None
+        status, total, created_at, updated_at = job
+        finished = counts.get("coded", 0) + counts.get("failed", 0)
+        return {
+            "job_id": job_id,
+            "status": status,
+            "progress": {
+                "total": total,
+                "coded": counts.get("coded", 0),
+                "failed": counts.get("failed", 0),
+                "pending": counts.get("pending", 0),
+                "percent": round(100.0 * finished / total, 1) if total else 100.0
+            },
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def get_results(self, job_id: str) -> List[Dict[str, Any]]:
+        """Per-visit codes in submission order"""
+        conn = self._get_connection()
+        rows = conn.execute(
+            "SELECT visit_id, status, result, error FROM coding_visits WHERE job_id = ? ORDER BY position", (job_id,)
+        ).fetchall()
+        conn.close()
+
+        results = []
+        for visit_id, status, result, error in rows:
+            codes = json.loads(result) if result else {}
+            results.append({
+                "visit_id": visit_id,
+                "status": status,
+                "cpt_codes": codes.get("cpt_codes", []),
+                "icd10_codes": codes.get("icd10_codes", []),
+                "error": error
+            })
+        return results
+
+    def _start(self, job_id: str) -> bool:
+        """Run a job here if this process can claim it; False when it already runs somewhere"""
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            return False
+        if not self._claim(job_id):
+            return False
+        self._tasks[job_id] = asyncio.create_task(self._run_job(job_id))
+        return True
+
+    def _claim(self, job_id: str) -> bool:
+        """Atomically take ownership of a job unless another live worker holds it"""
+        now = time.time()
+        conn = self._get_connection()
+        cursor = conn.execute(
+            """
+            UPDATE coding_jobs SET status = 'running', owner = ?, lease_expires = ?, updated_at = ?
+            WHERE job_id = ? AND (status != 'running' OR owner IS NULL OR owner = ? OR lease_expires IS NULL OR lease_expires < ?)
+            """,
+            (self.owner, now + self.lease_seconds, now, job_id, self.owner, now)
+        )
+        conn.commit()
+        conn.close()
+        return cursor.rowcount == 1
+
+    def _renew_lease(self, job_id: str) -> bool:
+        conn = self._get_connection()
+        cursor = conn.execute(
+            "UPDATE coding_jobs SET lease_expires = ? WHERE job_id = ? AND owner = ? AND status = 'running'",
+            (time.time() + self.lease_seconds, job_id, self.owner)
+        )
+        conn.commit()
+        conn.close()
+        return cursor.rowcount == 1
+
+    async def _keep_lease(self, job_id: str, runner: asyncio.Task):
+        """Renew the job's lease while it runs; stop the runner if another worker took the job over"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = self._renew_lease(job_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not renew lease on coding job {job_id}: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Lost lease on coding job {job_id}; stopping here")
+                runner.cancel()
+                return
+
+    def _finish(self, job_id: str) -> Optional[str]:
+        """Mark an owned job finished unless visits were re-queued meanwhile; returns the final status"""
+        conn = self._get_connection()
+        failed = conn.execute(
+            "SELECT COUNT(*) FROM coding_visits WHERE job_id = ? AND status = 'failed'", (job_id,)
+        ).fetchone()[0]
+        status = "completed_with_errors" if failed else "completed"
+        cursor = conn.execute(
+            """
+            UPDATE coding_jobs SET status = ?, owner = NULL, lease_expires = NULL, updated_at = ?
+            WHERE job_id = ? AND owner = ?
+            AND NOT EXISTS (SELECT 1 FROM coding_visits WHERE job_id = ? AND status = 'pending')
+            """,
+            (status, time.time(), job_id, self.owner, job_id)
+        )
+        conn.commit()
+        conn.close()
+        return status if cursor.rowcount == 1 else None
+
+    async def _run_job(self, job_id: str):
+        """Code pending visits pack by pack until none are left"""
+        lease = asyncio.create_task(self._keep_lease(job_id, asyncio.current_task()))
+        try:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def run_pack(pack: List[Tuple[str, int, int, Dict[str, Any]]]) -> bool:
+                async with semaphore:
+                    return await self._code_pack(job_id, pack)
+
+            while True:
+                pending = self._load_pending(job_id)
+                if pending:
+                    outcomes = await asyncio.gather(*(run_pack(pack) for pack in self._pack(pending)))
+                    if not all(outcomes):
+                        # Calls failed outright (rate limit, timeout, outage); give the provider time
+                        await asyncio.sleep(self.retry_delay)
+                    continue
+                status = self._finish(job_id)
+                if status is not None:
+                    break
+                if not self._renew_lease(job_id):
+                    status = "taken over by another worker"
+                    break
+
+            logger.info(f"Coding job {job_id} finished ({status})")
+
+        except asyncio.CancelledError:
+            # Left as running; once the lease lapses another worker, or this one after a restart, takes it over
+            raise
+        except Exception as e:
+            logger.error(f"Coding job {job_id} failed: {e}")
+            self._set_job_status(job_id, "failed")
+        finally:
+            lease.cancel()
+            self._tasks.pop(job_id, None)
+
+    def _load_pending(self, job_id: str) -> List[Tuple[str, int, int, Dict[str, Any]]]:
+        conn = self._get_connection()
+        rows = conn.execute(
+            "SELECT visit_id, attempts, dropped, payload FROM coding_visits WHERE job_id = ? AND status = 'pending' ORDER BY position",
+            (job_id,)
+        ).fetchall()
+        conn.close()
+        return [(visit_id, attempts, dropped, json.loads(payload)) for visit_id, attempts, dropped, payload in rows]
+
+    def _pack(self, visits: List[Tuple[str, int, int, Dict[str, Any]]]) -> List[List[Tuple[str, int, int, Dict[str, Any]]]]:
+        """Group visits greedily so each prompt plus its reply fits pack_tokens"""
+        base_tokens = len(PACK_INSTRUCTIONS) / CHARS_PER_TOKEN
+        packs: List[List[Tuple[str, int, int, Dict[str, Any]]]] = []
+        current: List[Tuple[str, int, int, Dict[str, Any]]] = []
+        current_tokens = base_tokens
+
+        for visit in visits:
+            # A visit a parsed reply left out is retried on its own; one whose call failed stays packed
+            if visit[2] > 0:
+                packs.append([visit])
+                continue
+            tokens = len(self._format_visit(0, visit[3])) / CHARS_PER_TOKEN + self.reply_tokens_per_visit
+            if current and (current_tokens + tokens > self.pack_tokens or len(current) >= self.max_visits_per_pack):
+                packs.append(current)
+                current, current_tokens = [], base_tokens
+            current.append(visit)
+            current_tokens += tokens
+
+        if current:
+            packs.append(current)
+        return packs
+
+    def _format_visit(self, number: int, payload: Dict[str, Any]) -> str:
+        context = payload["context"]
+        procedures = payload["procedures_performed"]
+        return f"""
+[{number}]
+- Chief complaint: {context.get('chief_complaint')}
+- Symptoms: {', '.join(context.get('symptoms') or [])}
+- Visit complexity: {payload['visit_complexity']}
+- Procedures performed: {', '.join(procedures) if procedures else 'None specified'}
+- Physical exam findings: {context.get('physical_exam')}
+- Lab tests ordered: {json.dumps(context.get('lab_results'))}
+- Imaging ordered: {json.dumps(context.get('scan_results'))}
+- Medical history: {context.get('medical_history')}
+"""
+
+    async def _code_pack(self, job_id: str, pack: List[Tuple[str, int, int, Dict[str, Any]]]) -> bool:
+        """Code one pack and record each visit's outcome; False when the call itself failed"""
+        prompt = PACK_INSTRUCTIONS + "".join(
+            self._format_visit(number, payload) for number, (_, _, _, payload) in enumerate(pack, start=1)
+        )
+
+        try:
+            response = await self.llm.chat(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=self.reply_tokens_per_visit * len(pack) + 50,
+                temperature=self.temperature
+            )
+            codes = self._parse_pack_reply(response.choices[0].message.content, len(pack))
+            called, error = True, "Visit missing from coding reply"
+        except Exception as e:
+            logger.warning(f"Coding pack of {len(pack)} visits failed: {e}")
+            codes, called, error = {}, False, str(e)
+
+        conn = self._get_connection()
+        for number, (visit_id, attempts, dropped, _) in enumerate(pack, start=1):
+            if number in codes:
+                conn.execute(
+                    "UPDATE coding_visits SET status = 'coded', attempts = ?, result = ?, error = NULL WHERE job_id = ? AND visit_id = ?",
+                    (attempts + 1, json.dumps(codes[number]), job_id, visit_id)
+                )
+            else:
+                status = "failed" if attempts + 1 >= self.max_attempts else "pending"
+                conn.execute(
+                    "UPDATE coding_visits SET status = ?, attempts = ?, dropped = ?, error = ? WHERE job_id = ? AND visit_id = ?",
+                    (status, attempts + 1, dropped + 1 if called else dropped, error, job_id, visit_id)
+                )
+        conn.execute("UPDATE coding_jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+        conn.commit()
+        conn.close()
+        return called
+
+    def _parse_pack_reply(self, content: str, expected: int) -> Dict[int, Dict[str, List[Dict[str, Any]]]]:
+        """Codes per visit number; visits with no usable CPT list are left out"""
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end <= start:
+            return {}
+        try:
+            reply = json.loads(content[start:end + 1])
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(reply, dict):
+            return {}
+
+        codes = {}
+        for key, value in reply.items():
+            try:
+                number = int(str(key).strip("[] "))
+            except ValueError:
+                continue
+            if not 1 <= number <= expected or not isinstance(value, dict):
+                continue
+            cpt_codes = self._normalise_codes(value.get("cpt_codes"))
+            if cpt_codes is None:
+                continue
+            codes[number] = {
+                "cpt_codes": cpt_codes,
+                "icd10_codes": self._normalise_codes(value.get("icd10_codes")) or []
+            }
+        return codes
+
+    def _normalise_codes(self, entries: Any) -> Optional[List[Dict[str, Any]]]:
+        if not isinstance(entries, list):
+            return None
+        normalised = []
+        for entry in entries:
+            if isinstance(entry, str):
+                entry = {"code": entry}
+            if isinstance(entry, dict) and entry.get("code"):
+                normalised.append({**entry, "code": str(entry["code"]).strip()})
+        return normalised
+
+    def _set_job_status(self, job_id: str, status: str):
+        """Set a terminal status and release this process's claim"""
+        conn = self._get_connection()
+        conn.execute(
+            "UPDATE coding_jobs SET status = ?, owner = NULL, lease_expires = NULL, updated_at = ? WHERE job_id = ? AND owner = ?",
+            (status, time.time(), job_id, self.owner)
+        )
+        conn.commit()
+        conn.close()
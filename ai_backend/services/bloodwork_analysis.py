@@ -4,19 +4,27 @@ import pdfplumber
 import tabula
 import re
 import time
-from typing import Dict, List, Any, Optional
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
 import logging
 from models.response_models import BloodworkAnalysisResult, LabValue, EnhancedBloodworkAnalysis, CancerRisk, LifeExpectancy
 
 logger = logging.getLogger(__name__)
 
+URGENCY_LEVELS = ["low", "medium", "high", "critical"]
+
 class BloodworkAnalysisService:
-    def __init__(self):
+    def __init__(self, lab_store=None):
         self.model_status = "loaded"
         self.reference_ranges = self._load_reference_ranges()
+        self.analyte_aliases = self._load_analyte_aliases()
         self.critical_values = self._load_critical_values()
+        self.delta_thresholds = self._load_delta_thresholds()
         self.cancer_markers = self._load_cancer_markers()
         self.life_expectancy_factors = self._load_life_expectancy_factors()
+        # Optional LabTimeSeriesStore; without one every analysis is stateless
+        self.lab_store = lab_store
+        self.trend_zscore_threshold = 3.0
         
     def _load_reference_ranges(self) -> Dict[str, Dict[str, Any]]:
         """Load reference ranges for common lab values"""
@@ -187,6 +195,23 @@ class BloodworkAnalysisService:
             }
         }
     
+    def _load_delta_thresholds(self) -> Dict[str, float]:
+        """Load absolute change between consecutive draws that is clinically significant"""
+        return {
+            "Creatinine": 0.3,  # KDIGO acute kidney injury criterion
+            "BUN": 10,
+            "Potassium": 1.0,
+            "Sodium": 8,
+            "Glucose": 100,
+            "Hemoglobin": 2.0,
+            "Platelets": 100,
+            "WBC": 5.0,
+            "ALT": 100,
+            "AST": 100,
+            "Bilirubin Total": 1.5,
+            "PSA": 0.75
+        }
+    
     def _load_cancer_markers(self) -> Dict[str, Dict[str, Any]]:
         """Load cancer marker information and risk factors"""
         return {
@@ -247,12 +272,15 @@ class BloodworkAnalysisService:
             }
         }
     
-    async def analyze_bloodwork(self, file_path: str) -> BloodworkAnalysisResult:
+    async def analyze_bloodwork(
+        self,
+        file_path: str,
+        patient_id: Optional[str] = None,
+        collected_at: Optional[datetime] = None
+    ) -> BloodworkAnalysisResult:
         """
         Analyze bloodwork from PDF or CSV file
         """
-        start_time = time.time()
-        
         try:
             # Parse file based on extension
             if file_path.lower().endswith('.pdf'):
@@ -262,28 +290,293 @@ class BloodworkAnalysisService:
             else:
                 raise ValueError("Unsupported file format. Only PDF and CSV are supported.")
             
-            # Analyze lab values
+            return await self.analyze_lab_values(lab_values, patient_id, collected_at)
+            
+        except Exception as e:
+            logger.error(f"Error analyzing bloodwork: {e}")
+            raise
+
+    def _load_analyte_aliases(self) -> Dict[str, str]:
+        """Map common report spellings onto reference-range keys"""
+        aliases = {
+            "white blood cells": "WBC",
+            "white blood cell count": "WBC",
+            "leukocytes": "WBC",
+            "red blood cells": "RBC",
+            "red blood cell count": "RBC",
+            "erythrocytes": "RBC",
+            "hgb": "Hemoglobin",
+            "hb": "Hemoglobin",
+            "hct": "Hematocrit",
+            "plt": "Platelets",
+            "platelet count": "Platelets",
+            "blood urea nitrogen": "BUN",
+            "urea nitrogen": "BUN",
+            "na": "Sodium",
+            "k": "Potassium",
+            "cl": "Chloride",
+            "bicarbonate": "CO2",
+            "carbon dioxide": "CO2",
+            "ca": "Calcium",
+            "bilirubin": "Bilirubin Total",
+            "total bilirubin": "Bilirubin Total",
+            "bilirubin, total": "Bilirubin Total",
+            "sgpt": "ALT",
+            "alanine aminotransferase": "ALT",
+            "sgot": "AST",
+            "aspartate aminotransferase": "AST",
+            "alp": "Alkaline Phosphatase",
+            "alk phos": "Alkaline Phosphatase",
+            "protein, total": "Total Protein",
+            "ca 125": "CA-125",
+            "ca125": "CA-125",
+            "ca 19-9": "CA-19-9",
+            "ca19-9": "CA-19-9"
+        }
+        aliases.update({name.lower(): name for name in self.reference_ranges})
+        return aliases
+
+    def _match_analyte(self, label: str) -> Optional[str]:
+        """Reference-range key for a report label, or None when it is not a known analyte"""
+        key = re.sub(r"\s+", " ", label.strip().strip(":").lower())
+        return self.analyte_aliases.get(key)
+
+    def _make_lab_value(self, name: str, value: float, unit: Optional[str] = None) -> LabValue:
+        status, reference_range = self.classify_lab_value(name, value)
+        ranges = self.reference_ranges.get(name, {})
+        return LabValue(
+            name=name,
+            value=value,
+            unit=unit or ranges.get("unit", ""),
+            reference_range=reference_range,
+            status=status
+        )
+
+    async def _parse_csv(self, file_path: str) -> List[LabValue]:
+        """Parse a lab report CSV with test name and result columns (unit optional)"""
+        df = pd.read_csv(file_path)
+        columns = {str(column).strip().lower(): column for column in df.columns}
+
+        name_column = next((columns[c] for c in ("test", "test name", "name", "analyte", "component") if c in columns), None)
+        value_column = next((columns[c] for c in ("value", "result", "result value") if c in columns), None)
+        unit_column = next((columns[c] for c in ("unit", "units") if c in columns), None)
+        if name_column is None or value_column is None:
+            raise ValueError("CSV must have a test name column and a value column")
+
+        lab_values = []
+        for _, row in df.iterrows():
+            name = self._match_analyte(str(row[name_column]))
+            value = pd.to_numeric(row[value_column], errors="coerce")
+            if name is None or pd.isna(value):
+                continue
+            unit = row[unit_column] if unit_column is not None and not pd.isna(row[unit_column]) else None
+            lab_values.append(self._make_lab_value(name, float(value), unit))
+
+        return lab_values
+
+    async def _parse_pdf(self, file_path: str) -> List[LabValue]:
+        """Parse lab values from a PDF report, from its tables first and its text otherwise"""
+        lab_values: Dict[str, LabValue] = {}
+
+        with pdfplumber.open(file_path) as pdf:
+            for page in pdf.pages:
+                rows = [row for table in page.extract_tables() for row in table]
+                rows.extend(line.split() for line in (page.extract_text() or "").splitlines())
+                for row in rows:
+                    lab_value = self._parse_report_row([cell for cell in row if cell])
+                    if lab_value is not None and lab_value.name not in lab_values:
+                        lab_values[lab_value.name] = lab_value
+
+        return list(lab_values.values())
+
+    def _parse_report_row(self, cells: List[str]) -> Optional[LabValue]:
+        """LabValue from a table row or whitespace-split text line: label cells, a number, then an optional unit"""
+        for index, cell in enumerate(cells):
+            match = re.fullmatch(r"[<>]?\s*(-?\d+(?:\.\d+)?)\s*([HLhl*]?)", str(cell).strip())
+            if not match or index == 0:
+                continue
+            name = self._match_analyte(" ".join(str(c) for c in cells[:index]))
+            if name is None:
+                return None
+            # Skip a separate high/low flag column between the value and its unit
+            rest = [str(c) for c in cells[index + 1:] if not re.fullmatch(r"[HLhl]{1,2}|\*", str(c).strip())]
+            unit = rest[0] if rest and not re.match(r"^[\d<>(]", rest[0]) else None
+            return self._make_lab_value(name, float(match.group(1)), unit)
+        return None
+
+    def _identify_abnormalities(self, lab_values: List[LabValue]) -> List[str]:
+        """Describe every value outside its reference range"""
+        abnormalities = []
+
+        for lab_value in lab_values:
+            if lab_value.status == "normal":
+                continue
+            description = f"{lab_value.name} {lab_value.status} ({lab_value.value} {lab_value.unit}"
+            description += f", reference {lab_value.reference_range})" if lab_value.reference_range else ")"
+            if lab_value.status == "critical":
+                description = "CRITICAL: " + description
+            abnormalities.append(description)
+
+        return abnormalities
+
+    def _generate_recommendations(self, lab_values: List[LabValue], abnormalities: List[str]) -> List[str]:
+        """Generate follow-up recommendations for the abnormal values"""
+        if not abnormalities:
+            return ["All values within reference ranges; continue routine monitoring"]
+
+        statuses = {lv.name: lv.status for lv in lab_values}
+        recommendations = []
+
+        if "critical" in statuses.values():
+            recommendations.append("Notify the ordering physician immediately about critical values")
+        if statuses.get("Glucose") in ["high", "critical"]:
+            recommendations.append("Evaluate for diabetes; repeat fasting glucose and check HbA1c")
+        if statuses.get("Hemoglobin") == "low" or statuses.get("RBC") == "low":
+            recommendations.append("Evaluate for anemia and its cause")
+        if statuses.get("WBC") in ["high", "critical"]:
+            recommendations.append("Assess for infection or inflammation")
+        if statuses.get("Creatinine") in ["high", "critical"] or statuses.get("BUN") in ["high", "critical"]:
+            recommendations.append("Assess kidney function and review nephrotoxic medications")
+        if any(statuses.get(name) in ["high", "critical"] for name in ["ALT", "AST", "Bilirubin Total", "Alkaline Phosphatase"]):
+            recommendations.append("Assess liver function and review hepatotoxic medications")
+        if any(statuses.get(name, "normal") != "normal" for name in ["Sodium", "Potassium", "Chloride", "CO2", "Calcium"]):
+            recommendations.append("Correct electrolyte imbalance and recheck")
+        if any(statuses.get(name) in ["high", "critical"] for name in self.cancer_markers):
+            recommendations.append("Refer for specialist review of elevated tumor markers")
+
+        recommendations.append("Repeat abnormal tests to confirm results")
+        return recommendations
+
+    def _determine_urgency(self, lab_values: List[LabValue], abnormalities: List[str]) -> str:
+        """Urgency from the number and severity of abnormal values"""
+        for lab_value in lab_values:
+            if lab_value.status == "critical":
+                return "critical"
+            if lab_value.value < self.critical_values["critical_low"].get(lab_value.name, float("-inf")):
+                return "critical"
+            if lab_value.value > self.critical_values["critical_high"].get(lab_value.name, float("inf")):
+                return "critical"
+
+        abnormal = [lv for lv in lab_values if lv.status != "normal"]
+        if len(abnormal) >= 3 or any(lv.name in ["Potassium", "Sodium"] for lv in abnormal):
+            return "high"
+        if abnormal:
+            return "medium"
+        return "low"
+
+    def _suggest_additional_tests(self, lab_values: List[LabValue], abnormalities: List[str]) -> List[str]:
+        """Suggest follow-up tests for the abnormal values"""
+        test_mapping = {
+            "Glucose": ["HbA1c", "Fasting Glucose"],
+            "Hemoglobin": ["Iron Studies", "Vitamin B12", "Folate", "Reticulocyte Count"],
+            "RBC": ["Iron Studies", "Peripheral Blood Smear"],
+            "WBC": ["WBC Differential", "Blood Culture", "C-Reactive Protein"],
+            "Platelets": ["Peripheral Blood Smear", "Coagulation Panel"],
+            "Creatinine": ["eGFR", "Urinalysis", "Urine Albumin-to-Creatinine Ratio"],
+            "BUN": ["eGFR", "Urinalysis"],
+            "Potassium": ["ECG", "Repeat Basic Metabolic Panel"],
+            "Sodium": ["Serum Osmolality", "Urine Sodium"],
+            "Calcium": ["Parathyroid Hormone", "Vitamin D"],
+            "ALT": ["Hepatitis Panel", "Liver Ultrasound"],
+            "AST": ["Hepatitis Panel", "GGT"],
+            "Bilirubin Total": ["Direct Bilirubin", "Liver Ultrasound"],
+            "Alkaline Phosphatase": ["GGT", "Liver Ultrasound"],
+            "PSA": ["Free PSA", "Urology Referral"],
+            "CEA": ["Colonoscopy"],
+            "AFP": ["Liver Ultrasound"],
+            "CA-125": ["Pelvic Ultrasound"],
+            "CA-19-9": ["Abdominal CT"]
+        }
+
+        suggested_tests = []
+        for lab_value in lab_values:
+            if lab_value.status == "normal":
+                continue
+            for test in test_mapping.get(lab_value.name, []):
+                if test not in suggested_tests:
+                    suggested_tests.append(test)
+
+        return suggested_tests
+
+    async def analyze_lab_values(
+        self,
+        lab_values: List[LabValue],
+        patient_id: Optional[str] = None,
+        collected_at: Optional[datetime] = None
+    ) -> BloodworkAnalysisResult:
+        """
+        Analyze an already-parsed panel of lab values
+        
+        When a patient_id is given and a lab store is configured, the values
+        are appended to the patient's history and urgency is escalated on
+        significant changes since earlier draws.
+        """
+        return self.analyze_panels([(patient_id, lab_values, collected_at)])[0]
+    
+    def analyze_panels(
+        self,
+        panels: List[Tuple[Optional[str], List[LabValue], Optional[datetime]]]
+    ) -> List[BloodworkAnalysisResult]:
+        """
+        Analyze (patient_id, lab_values, collected_at) panels in order
+        
+        Panels with a patient_id are recorded in the lab store in a single
+        transaction; each panel's trends are those right after its own draw.
+        Blocking, so bulk callers run it in a worker thread.
+        """
+        start_time = time.time()
+        
+        recorded = [panel for panel in panels if panel[0] and self.lab_store is not None]
+        recorded_trends = iter(self.lab_store.record_panels(recorded)) if recorded else iter(())
+        # Spread the shared store write evenly over the panels' processing times
+        store_time = (time.time() - start_time) / len(panels) if panels else 0.0
+        
+        results = []
+        for patient_id, lab_values, _ in panels:
+            panel_start = time.time()
+            
             abnormalities = self._identify_abnormalities(lab_values)
             recommendations = self._generate_recommendations(lab_values, abnormalities)
             urgency_level = self._determine_urgency(lab_values, abnormalities)
             suggested_tests = self._suggest_additional_tests(lab_values, abnormalities)
             
-            processing_time = time.time() - start_time
+            # Longitudinal trends
+            trends = None
+            if patient_id and self.lab_store is not None:
+                trends = next(recorded_trends)
+                urgency_level, trend_alerts = self._escalate_urgency_from_trends(urgency_level, trends)
+                abnormalities.extend(trend_alerts)
             
-            return BloodworkAnalysisResult(
+            results.append(BloodworkAnalysisResult(
                 lab_values=lab_values,
                 abnormalities=abnormalities,
                 recommendations=recommendations,
                 urgency_level=urgency_level,
                 suggested_tests=suggested_tests,
-                processing_time=processing_time
-            )
-            
-        except Exception as e:
-            logger.error(f"Error analyzing bloodwork: {e}")
-            raise
+                trends={name: trend.to_dict() for name, trend in trends.items()} if trends else None,
+                processing_time=time.time() - panel_start + store_time
+            ))
+        
+        return results
     
-    async def analyze_bloodwork_enhanced(self, file_path: str, patient_age: int = 50, patient_gender: str = "unknown") -> EnhancedBloodworkAnalysis:
+    def classify_lab_value(self, name: str, value: float) -> tuple:
+        """Classify a value against its reference range; returns (status, reference_range)"""
+        ranges = self.reference_ranges.get(name)
+        if not ranges:
+            return "normal", ""
+        
+        low, high = ranges["normal_range"]
+        reference_range = f"{low}-{high} {ranges['unit']}"
+        
+        if value < ranges["critical_low"] or value > ranges["critical_high"]:
+            return "critical", reference_range
+        if value < low:
+            return "low", reference_range
+        if value > high:
+            return "high", reference_range
+        return "normal", reference_range
+    
+    async def analyze_bloodwork_enhanced(self, file_path: str, patient_age: int = 50, patient_gender: str = "unknown", patient_id: Optional[str] = None) -> EnhancedBloodworkAnalysis:
         """
         Enhanced bloodwork analysis with cancer risk and life expectancy assessment
         """
@@ -291,7 +584,7 @@ class BloodworkAnalysisService:
         
         try:
             # Get basic analysis
-            basic_analysis = await self.analyze_bloodwork(file_path)
+            basic_analysis = await self.analyze_bloodwork(file_path, patient_id=patient_id)
             
             # Enhanced analysis
             cancer_risk = self._assess_cancer_risk(basic_analysis.lab_values, patient_age, patient_gender)
@@ -307,6 +600,7 @@ class BloodworkAnalysisService:
                 recommendations=basic_analysis.recommendations,
                 urgency_level=basic_analysis.urgency_level,
                 suggested_tests=basic_analysis.suggested_tests,
+                trends=basic_analysis.trends,
                 cancer_risk=cancer_risk,
                 life_expectancy=life_expectancy,
                 interventions=interventions,
@@ -318,6 +612,26 @@ class BloodworkAnalysisService:
             logger.error(f"Error in enhanced bloodwork analysis: {e}")
             raise
     
+    def _escalate_urgency_from_trends(self, urgency_level: str, trends: Dict[str, Any]) -> tuple:
+        """Raise urgency one level when any analyte changed significantly since earlier draws"""
+        alerts = []
+        
+        for name, trend in trends.items():
+            if trend is None or trend.delta is None:
+                continue
+            
+            threshold = self.delta_thresholds.get(name)
+            direction = "rising" if trend.delta > 0 else "falling"
+            if threshold is not None and abs(trend.delta) >= threshold:
+                alerts.append(f"{name} {direction} ({trend.delta:+.2f} {trend.unit} since previous draw)")
+            elif trend.rolling_zscore is not None and abs(trend.rolling_zscore) >= self.trend_zscore_threshold:
+                alerts.append(f"{name} {direction} outside patient baseline (z={trend.rolling_zscore:+.1f})")
+        
+        if alerts and urgency_level in URGENCY_LEVELS:
+            urgency_level = URGENCY_LEVELS[min(URGENCY_LEVELS.index(urgency_level) + 1, len(URGENCY_LEVELS) - 1)]
+        
+        return urgency_level, alerts
+    
     def _assess_cancer_risk(self, lab_values: List[LabValue], age: int, gender: str) -> CancerRisk:
         """Assess cancer risk based on lab values and patient factors"""
         risk_factors = []
@@ -557,5 +871,6 @@ class BloodworkAnalysisService:
             "model_name": "Bloodwork Analysis Model",
             "status": self.model_status,
             "version": "1.0.0",
-            "last_updated": "2024-01-01"
+            "last_updated": "2024-01-01",
+            "longitudinal_trends": self.lab_store is not None
         } 
\ No newline at end of file
@@ -0,0 +1,260 @@
+"""
+Compiled tree-ensemble predictor
+
+Flattens a fitted scikit-learn random forest into contiguous node arrays
+(feature, threshold, children, leaf value) and evaluates every tree for every
+row in one vectorised numpy traversal. For small batches this avoids the
+per-call validation and joblib dispatch that dominate sklearn's predict; for
+large batches sklearn's native tree loop is faster, so callers should switch
+back above a few hundred rows.
+
+Latency benchmark and parity check (run from ai_backend/):
+    python -m services.compiled_forest
+Self-contained per-tree parity check on tiny forests, exits non-zero on drift:
+    python -m services.compiled_forest --check
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class CompiledForest:
+    """
+    Flat-array representation of a random forest
+
+    Leaves are encoded as self-loops (both children point at the leaf, the
+    threshold is +inf), so a fixed number of traversal steps equal to the
+    maximum tree depth lands every row on its leaf without branching.
+    """
+
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        children_left: np.ndarray,
+        children_right: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        max_depth: int
+    ):
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @classmethod
+    def from_sklearn(cls, forest, positive_class: Optional[int] = None) -> "CompiledForest":
+        """
+        Compile a fitted RandomForestRegressor or RandomForestClassifier
+
+        For classifiers, leaf values are the per-tree probability of
+        positive_class (default: the last class), matching predict_proba.
+        """
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+
+        if hasattr(forest, "classes_"):
+            classes = list(forest.classes_)
+            class_index = classes.index(positive_class) if positive_class is not None else len(classes) - 1
+        else:
+            class_index = None
+
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            node_ids = np.arange(n_nodes, dtype=np.int32)
+            is_leaf = tree.children_left == -1
+
+            left = np.where(is_leaf, node_ids, tree.children_left) + offset
+            right = np.where(is_leaf, node_ids, tree.children_right) + offset
+
+            if class_index is None:
+                leaf_value = tree.value[:, 0, 0]
+            else:
+                counts = tree.value[:, 0, :]
+                leaf_value = counts[:, class_index] / counts.sum(axis=1)
+
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(left.astype(np.int32))
+            rights.append(right.astype(np.int32))
+            values.append(leaf_value.astype(np.float64))
+            roots.append(offset)
+
+            offset += n_nodes
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            children_left=np.concatenate(lefts),
+            children_right=np.concatenate(rights),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth
+        )
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Plain arrays for persistence (memory-mappable with joblib)"""
+        return {
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "children_left": self.children_left,
+            "children_right": self.children_right,
+            "value": self.value,
+            "roots": self.roots,
+            "max_depth": np.asarray(self.max_depth)
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "CompiledForest":
+        return cls(**{**arrays, "max_depth": int(arrays["max_depth"])})
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """Return the (n_samples, n_trees) matrix of leaf node indices"""
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_samples, n_features = X.shape
+        flat_X = X.ravel()
+
+        # One traversal slot per (row, tree); slots drop out once they reach a leaf
+        nodes = np.tile(self.roots, n_samples)
+        row_offsets = np.repeat(np.arange(n_samples, dtype=np.int64) * n_features, self.n_trees)
+        active = np.arange(nodes.size)
+
+        for _ in range(self.max_depth):
+            current = nodes[active]
+            go_left = flat_X[row_offsets[active] + self.feature[current]] <= self.threshold[current]
+            following = np.where(go_left, self.children_left[current], self.children_right[current])
+            nodes[active] = following
+            active = active[following != current]
+            if not active.size:
+                break
+
+        return nodes.reshape(n_samples, self.n_trees)
+
+    def predict_per_tree(self, X: np.ndarray) -> np.ndarray:
+        """Per-tree predictions, shape (n_samples, n_trees)"""
+        return self.value[self.apply(X)]
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Ensemble mean: predict for regressors, positive-class predict_proba for classifiers"""
+        return self.predict_per_tree(X).mean(axis=1)
+
+    def check_parity(self, forest, X: np.ndarray, atol: float = 1e-9) -> float:
+        """Return the max absolute difference from sklearn; raise if it exceeds atol"""
+        if hasattr(forest, "classes_"):
+            expected = forest.predict_proba(X)[:, -1]
+        else:
+            expected = forest.predict(X)
+        difference = float(np.max(np.abs(self.predict(X) - expected))) if len(X) else 0.0
+        if difference > atol:
+            raise ValueError(f"Compiled forest differs from sklearn by {difference:.3g}")
+        return difference
+
+def check_tiny_forests(seed: int = 0) -> List[str]:
+    """
+    Fit tiny forests, compile them and compare every tree with sklearn
+
+    Probe rows include values exactly on, and one float32 step either side
+    of, every split threshold, plus forests with single-leaf trees, so leaf
+    and threshold edge cases are covered. Returns one message per mismatch.
+    """
+    from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
+
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(200, 4))
+    X[:, 3] = rng.integers(0, 3, size=200)  # ties on a discrete feature
+    targets = {
+        "regressor": (RandomForestRegressor, X[:, 0] * 3 + (X[:, 3] == 2) + rng.normal(scale=0.1, size=200), None),
+        "regressor_single_leaf": (RandomForestRegressor, np.full(200, 4.2), None),
+        "binary_classifier": (RandomForestClassifier, (X[:, 1] + X[:, 3] > 1).astype(int), 1),
+        "multiclass_classifier": (RandomForestClassifier, X[:, 3].astype(int), 0)
+    }
+
+    failures = []
+    for name, (model_cls, y, positive_class) in targets.items():
+        forest = model_cls(n_estimators=8, max_depth=6, random_state=seed).fit(X, y)
+        compiled = CompiledForest.from_sklearn(forest, positive_class=positive_class)
+
+        probes = [X, rng.normal(scale=3, size=(100, 4))]
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            for node in np.flatnonzero(tree.children_left != -1):
+                at = np.tile(X[:3], (3, 1))
+                split = np.float32(tree.threshold[node])
+                at[:, tree.feature[node]] = np.repeat(
+                    [split, np.nextafter(split, np.float32(-np.inf)), np.nextafter(split, np.float32(np.inf))], 3
+                )
+                probes.append(at)
+        probe = np.vstack(probes)
+
+        per_tree = compiled.predict_per_tree(probe)
+        for index, estimator in enumerate(forest.estimators_):
+            if positive_class is None:
+                expected = estimator.predict(probe)
+            else:
+                expected = estimator.predict_proba(probe)[:, list(forest.classes_).index(positive_class)]
+            if not np.allclose(per_tree[:, index], expected):
+                failures.append(f"{name} tree {index}: max |diff| {np.max(np.abs(per_tree[:, index] - expected)):.3g}")
+
+        if positive_class is None:
+            ensemble = forest.predict(probe)
+        else:
+            ensemble = forest.predict_proba(probe)[:, list(forest.classes_).index(positive_class)]
+        if not np.allclose(compiled.predict(probe), ensemble):
+            failures.append(f"{name} ensemble: max |diff| {np.max(np.abs(compiled.predict(probe) - ensemble)):.3g}")
+
+    return failures
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description="Compiled forest latency benchmark and parity check")
+    parser.add_argument("--check", action="store_true", help="Only run the tiny-forest parity check")
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check_tiny_forests()
+        for failure in failures:
+            print(f"FAIL {failure}")
+        print("compiled forest parity: " + ("FAILED" if failures else "ok"))
+        sys.exit(1 if failures else 0)
+
+    from services.recovery_prediction import RecoveryPredictionService
+
+    logging.basicConfig(level=logging.WARNING)
+    service = RecoveryPredictionService()
+    rng = np.random.default_rng(0)
+
+    def timed(fn, X, repeats):
+        fn(X)  # warm up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn(X)
+        return (time.perf_counter() - start) / repeats * 1000
+
+    print(f"{'model':<22}{'batch':>6}{'sklearn ms':>12}{'compiled ms':>13}{'speedup':>9}{'max |diff|':>12}")
+    for name, forest in (("recovery_model", service.recovery_model), ("complication_model", service.complication_model)):
+        compiled = CompiledForest.from_sklearn(forest)
+        sklearn_fn = forest.predict_proba if hasattr(forest, "classes_") else forest.predict
+        for batch_size in (1, 16, 1024):
+            X = rng.normal(size=(batch_size, forest.n_features_in_))
+            difference = compiled.check_parity(forest, X)
+            repeats = 200 if batch_size < 1024 else 20
+            sklearn_ms = timed(sklearn_fn, X, repeats)
+            compiled_ms = timed(compiled.predict, X, repeats)
+            print(f"{name:<22}{batch_size:>6}{sklearn_ms:>12.3f}{compiled_ms:>13.3f}{sklearn_ms / compiled_ms:>8.1f}x{difference:>12.1e}")
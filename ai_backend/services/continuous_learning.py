@@ -23,8 +23,8 @@ from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 import torch
 import torch.nn as nn
 from transformers import AutoTokenizer, AutoModel
-import openai
-from openai import AsyncOpenAI
+
+from services.llm_gateway import Priority, get_llm_gateway
 
 logger = logging.getLogger(__name__)
 
@@ -69,7 +69,7 @@ class ContinuousLearningService:
     """
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_llm_gateway().client("continuous_learning", Priority.BACKGROUND)
         self.knowledge_base_path = "data/knowledge_base"
         self.model_registry_path = "data/model_registry"
         self.performance_log_path = "data/performance_logs"
@@ -79,8 +79,14 @@ class ContinuousLearningService:
         os.makedirs(self.model_registry_path, exist_ok=True)
         os.makedirs(self.performance_log_path, exist_ok=True)
         
+        # Relevance scoring: items per prompt and prompts in flight at once
+        self.relevance_batch_size = int(os.getenv("RELEVANCE_BATCH_SIZE", 25))
+        self.relevance_concurrency = int(os.getenv("RELEVANCE_CONCURRENCY", 4))
+        self.max_scored_items = 50000
+        
         # Load current knowledge base
         self.knowledge_base = self._load_knowledge_base()
+        self.knowledge_base.setdefault("scored_items", {})  # content hash -> relevance score
         self.model_performance = self._load_model_performance()
         
         # Start automated tasks
@@ -138,23 +144,36 @@ class ContinuousLearningService:
     async def _update_knowledge_base(self):
         """Automatically update knowledge base from multiple sources"""
         try:
-            updates = []
-            
-            # PubMed updates
-            pubmed_updates = await self._fetch_pubmed_updates()
-            updates.extend(pubmed_updates)
+            # PubMed, FDA and clinical guideline updates
+            sources = await asyncio.gather(
+                self._fetch_pubmed_updates(),
+                self._fetch_fda_updates(),
+                self._fetch_clinical_guidelines()
+            )
+            fetched = [update for source_updates in sources for update in source_updates]
             
-            # FDA updates
-            fda_updates = await self._fetch_fda_updates()
-            updates.extend(fda_updates)
+            # Items scored on an earlier run (or repeated within this one) are skipped
+            scored_items = self.knowledge_base["scored_items"]
+            pending = {}
+            for update in fetched:
+                content_hash = self._content_hash(update)
+                if content_hash not in scored_items:
+                    pending[content_hash] = update
+            updates = list(pending.values())
             
-            # Clinical guidelines updates
-            guideline_updates = await self._fetch_clinical_guidelines()
-            updates.extend(guideline_updates)
+            # Score in batches, then process; items that could not be scored are retried next run
+            scores = await self._assess_relevance_batched(updates)
+            unscored = 0
+            for update, relevance_score in zip(updates, scores):
+                if relevance_score is None:
+                    unscored += 1
+                    continue
+                scored_items[self._content_hash(update)] = round(relevance_score, 3)
+                await self._process_knowledge_update(update, relevance_score)
             
-            # Process updates
-            for update in updates:
-                await self._process_knowledge_update(update)
+            # Oldest scores are forgotten first
+            for content_hash in list(scored_items)[:max(0, len(scored_items) - self.max_scored_items)]:
+                del scored_items[content_hash]
             
             # Update knowledge base version
             self.knowledge_base["version"] = self._increment_version(self.knowledge_base["version"])
@@ -163,7 +182,10 @@ class ContinuousLearningService:
             # Save updated knowledge base
             await self._save_knowledge_base()
             
-            logger.info(f"Knowledge base updated with {len(updates)} new items")
+            logger.info(
+                f"Knowledge base updated with {len(updates) - unscored} new items "
+                f"({len(fetched) - len(updates)} already scored, {unscored} left for the next run)"
+            )
             
         except Exception as e:
             logger.error(f"Error updating knowledge base: {e}")
@@ -245,11 +267,14 @@ class ContinuousLearningService:
         
         return updates
     
-    async def _process_knowledge_update(self, update: KnowledgeUpdate):
+    async def _process_knowledge_update(self, update: KnowledgeUpdate, relevance_score: Optional[float] = None):
         """Process and integrate knowledge update"""
         try:
             # Analyze impact and relevance
-            relevance_score = await self._assess_relevance(update)
+            if relevance_score is None:
+                relevance_score = await self._assess_relevance(update)
+            if relevance_score is None:
+                return
             
             if relevance_score > 0.7:  # High relevance threshold
                 # Add to knowledge base
@@ -295,8 +320,93 @@ class ContinuousLearningService:
         except Exception as e:
             logger.error(f"Error processing knowledge update: {e}")
     
-    async def _assess_relevance(self, update: KnowledgeUpdate) -> float:
-        """Assess relevance of knowledge update to our medical domain"""
+    def _content_hash(self, update: KnowledgeUpdate) -> str:
+        """Identity of an item's scored content, independent of fetch time"""
+        content = "\n".join([update.source, update.content_type, update.title.strip(), update.summary.strip()])
+        return hashlib.sha1(content.casefold().encode("utf-8")).hexdigest()
+    
+    async def _assess_relevance_batched(self, updates: List[KnowledgeUpdate]) -> List[Optional[float]]:
+        """
+        Relevance scores for many updates, in input order (None where scoring failed)
+        
+        Updates are scored relevance_batch_size per prompt, with up to
+        relevance_concurrency prompts in flight. Each prompt goes through the
+        shared LLM gateway at background priority.
+        """
+        semaphore = asyncio.Semaphore(self.relevance_concurrency)
+        batches = [
+            updates[start:start + self.relevance_batch_size]
+            for start in range(0, len(updates), self.relevance_batch_size)
+        ]
+        
+        async def score(batch: List[KnowledgeUpdate]) -> List[Optional[float]]:
+            async with semaphore:
+                return await self._assess_relevance_batch(batch)
+        
+        results = await asyncio.gather(*(score(batch) for batch in batches))
+        return [relevance_score for batch_scores in results for relevance_score in batch_scores]
+    
+    async def _assess_relevance_batch(self, updates: List[KnowledgeUpdate]) -> List[Optional[float]]:
+        """Score several updates with one prompt; falls back to per-item scoring if the reply is unusable"""
+        if len(updates) == 1:
+            return [await self._assess_relevance(updates[0])]
+        
+        try:
+            items = "\n".join(
+                f"[{index}] Title: {update.title} | Summary: {update.summary} | "
+                f"Source: {update.source} | Content Type: {update.content_type}"
+                for index, update in enumerate(updates, start=1)
+            )
+            prompt = f"""
+            Assess the relevance of each of these medical knowledge updates to our AI telemedicine platform:
+            
+            {items}
+            
+            Rate each item's relevance from 0.0 to 1.0 where:
+            0.0 = Not relevant to our medical AI platform
+            1.0 = Highly relevant and important for our platform
+            
+            Consider factors like:
+            - Relevance to medical diagnosis
+            - Impact on patient care
+            - Applicability to AI/ML in healthcare
+            - Clinical significance
+            
+            Return only a JSON array of {len(updates)} numbers, one score per item, in item order.
+            """
+            
+            response = await self.llm.chat(
+                model="gpt-4",
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=6 * len(updates) + 20,
+                temperature=0.1
+            )
+            
+            scores = self._parse_relevance_scores(response.choices[0].message.content, len(updates))
+            if scores is not None:
+                return scores
+            logger.warning(f"Unusable batch relevance reply for {len(updates)} items; scoring individually")
+        
+        except Exception as e:
+            logger.error(f"Error assessing batch relevance: {e}")
+        
+        return list(await asyncio.gather(*(self._assess_relevance(update) for update in updates)))
+    
+    def _parse_relevance_scores(self, content: str, expected: int) -> Optional[List[float]]:
+        """The JSON array in a batch reply, clipped to [0, 1]; None if missing or the wrong length"""
+        start, end = content.find("["), content.rfind("]")
+        if start == -1 or end < start:
+            return None
+        try:
+            scores = [float(value) for value in json.loads(content[start:end + 1])]
+        except (ValueError, TypeError):
+            return None
+        if len(scores) != expected:
+            return None
+        return [min(1.0, max(0.0, value)) for value in scores]
+    
+    async def _assess_relevance(self, update: KnowledgeUpdate) -> Optional[float]:
+        """Assess relevance of knowledge update to our medical domain; None if no score came back"""
         try:
             # Use AI to assess relevance
             prompt = f"""
@@ -320,21 +430,25 @@ class ContinuousLearningService:
             Return only the numerical score.
             """
             
-            response = await self.client.chat.completions.create(
+            # The same published item is re-scored on every scan; cache its score
+            response = await self.llm.chat(
                 model="gpt-4",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=10,
-                temperature=0.1
+                temperature=0.1,
+                cache=True,
+                cache_ttl_s=7 * 86400
             )
             
             try:
-                return float(response.choices[0].message.content.strip())
+                return min(1.0, max(0.0, float(response.choices[0].message.content.strip())))
             except ValueError:
-                return 0.5  # Default score if parsing fails
+                logger.warning(f"Unparseable relevance score for {update.title!r}")
+                return None
         
         except Exception as e:
             logger.error(f"Error assessing relevance: {e}")
-            return 0.5
+            return None
     
     async def _check_model_performance(self):
         """Check model performance and detect drift"""
@@ -1,15 +1,19 @@
 import asyncio
-import json
 import logging
-import os
+import math
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Union
-import openai
-from openai import AsyncOpenAI
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple, Union
 from dataclasses import dataclass
 
+from services.llm_gateway import Priority, get_llm_gateway
+from services.prompt_context import ContextBuilder
+from services.prompt_templates import compile_templates
+
 logger = logging.getLogger(__name__)
 
+# Alternatives are shown as short previews; clinical text averages ~3 characters per token
+PREVIEW_CHARS_PER_TOKEN = 3
+
 @dataclass
 class NoteContext:
     """Context for note editing assistance"""
@@ -44,11 +48,17 @@ class DoctorCopilotService:
     """
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_llm_gateway().client("doctor_copilot", Priority.INTERACTIVE)
         self.model_version = "v1.4.2"
         self.max_tokens = 2000
         self.temperature = 0.3  # Lower temperature for more consistent medical advice
         
+        # Fits history, labs and imaging into a per-task token budget
+        self.context_builder = ContextBuilder()
+        
+        # Compiled once at startup; each task's static instructions form a cacheable prompt prefix
+        self.prompts = compile_templates()
+        
         # Medical knowledge base references
         self.medical_references = {
             "icd10": "ICD-10-CM coding guidelines",
@@ -63,62 +73,25 @@ class DoctorCopilotService:
         self,
         context: NoteContext,
         doctor_notes: str = None,
-        style_preference: str = "comprehensive"
+        style_preference: str = "comprehensive",
+        include_alternatives: bool = True
     ) -> CopilotSuggestion:
         """
         Generate structured SOAP note from doctor's free text and patient data
         """
         try:
-            # Prepare context for SOAP note generation
-            context_prompt = self._prepare_soap_context(context, doctor_notes)
-            
-            # Generate SOAP note using GPT
-            soap_prompt = f"""
-            As a medical AI assistant, generate a comprehensive SOAP note based on the following information:
-            
-            {context_prompt}
-            
-            Style preference: {style_preference}
-            
-            Please structure the response as:
-            
-            SUBJECTIVE:
-            - Chief complaint
-            - History of present illness
-            - Review of systems
-            - Past medical history
-            - Medications and allergies
-            - Social and family history
-            
-            OBJECTIVE:
-            - Vital signs
-            - Physical examination findings
-            - Lab results
-            - Imaging results
-            
-            ASSESSMENT:
-            - Primary diagnosis
-            - Differential diagnoses
-            - Problem list
-            
-            PLAN:
-            - Treatment plan
-            - Medications
-            - Follow-up recommendations
-            - Patient education
-            
-            Ensure the note is:
-            1. Clinically accurate and evidence-based
-            2. Well-structured and professional
-            3. Complete and comprehensive
-            4. Appropriate for medical documentation
-            """
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": soap_prompt}],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+            soap_messages, prompt_version = self._build_soap_messages(context, doctor_notes, style_preference)
+            
+            # Alternatives are independent of the primary note, so fetch them alongside it
+            response, alternatives = await asyncio.gather(
+                self.llm.chat(
+                    model="gpt-4",
+                    messages=soap_messages,
+                    prompt_version=prompt_version,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature
+                ),
+                self._generate_soap_alternatives(context, style_preference) if include_alternatives else self._no_alternatives()
             )
             
             soap_content = response.choices[0].message.content
@@ -131,7 +104,7 @@ class DoctorCopilotService:
                 content=soap_content,
                 confidence=confidence,
                 reasoning="Generated based on patient data, symptoms, and clinical context",
-                alternatives=await self._generate_soap_alternatives(context, style_preference),
+                alternatives=alternatives,
                 references=[self.medical_references["soap"]]
             )
             
@@ -139,53 +112,111 @@ class DoctorCopilotService:
             logger.error(f"Error generating SOAP note: {e}")
             raise
     
+    async def generate_soap_note_stream(
+        self,
+        context: NoteContext,
+        doctor_notes: str = None,
+        style_preference: str = "comprehensive",
+        include_alternatives: bool = True
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of generate_soap_note
+        
+        Yields {"event", "data"} items: "content" events with text deltas as
+        GPT produces them, then one "suggestion" event with the structured fields.
+        """
+        async for item in self._stream_suggestion(
+            prompt=self._build_soap_messages(context, doctor_notes, style_preference),
+            alternatives=self._generate_soap_alternatives(context, style_preference) if include_alternatives else self._no_alternatives(),
+            suggestion_type="soap_note",
+            confidence=self._calculate_soap_confidence(context),
+            reasoning="Generated based on patient data, symptoms, and clinical context",
+            references=[self.medical_references["soap"]]
+        ):
+            yield item
+    
+    async def summarize_visit_stream(
+        self,
+        context: NoteContext,
+        doctor_notes: str,
+        summary_type: str = "comprehensive",
+        include_alternatives: bool = True
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Streaming variant of summarize_visit (same events as generate_soap_note_stream)"""
+        async for item in self._stream_suggestion(
+            prompt=self._build_summary_messages(context, doctor_notes, summary_type),
+            alternatives=self._generate_summary_alternatives(context, doctor_notes, summary_type) if include_alternatives else self._no_alternatives(),
+            suggestion_type="visit_summary",
+            confidence=0.9,
+            reasoning="Based on comprehensive visit data and doctor's notes",
+            references=[self.medical_references["soap"]]
+        ):
+            yield item
+    
+    async def _stream_suggestion(
+        self,
+        prompt: Tuple[List[Dict[str, str]], str],
+        alternatives: Awaitable[Optional[List[str]]],
+        suggestion_type: str,
+        confidence: float,
+        reasoning: str,
+        references: List[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        # Alternatives are fetched while the primary text streams
+        alternatives_task = asyncio.ensure_future(alternatives)
+        messages, prompt_version = prompt
+        try:
+            async for delta in self.llm.chat_stream(
+                model="gpt-4",
+                messages=messages,
+                prompt_version=prompt_version,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature
+            ):
+                yield {"event": "content", "data": {"delta": delta}}
+            
+            yield {
+                "event": "suggestion",
+                "data": {
+                    "suggestion_type": suggestion_type,
+                    "confidence": confidence,
+                    "reasoning": reasoning,
+                    "alternatives": await alternatives_task,
+                    "references": references
+                }
+            }
+        except Exception as e:
+            logger.error(f"Error streaming {suggestion_type}: {e}")
+            raise
+        finally:
+            alternatives_task.cancel()
+    
     async def suggest_lab_tests(
         self,
         context: NoteContext,
-        suspected_conditions: List[str] = None
+        suspected_conditions: List[str] = None,
+        include_alternatives: bool = True
     ) -> CopilotSuggestion:
         """
         Suggest relevant laboratory tests based on symptoms and clinical context
         """
         try:
             # Prepare lab suggestion prompt
-            lab_prompt = f"""
-            As a medical AI assistant, suggest appropriate laboratory tests based on the following clinical information:
-            
-            Patient Information:
-            - Chief complaint: {context.chief_complaint}
-            - Symptoms: {', '.join(context.symptoms)}
-            - Vital signs: {json.dumps(context.vital_signs)}
-            - Physical exam findings: {context.physical_exam}
-            - Current medications: {', '.join(context.current_medications)}
-            - Allergies: {', '.join(context.allergies)}
-            - Medical history: {context.medical_history}
-            
-            Suspected conditions: {', '.join(suspected_conditions) if suspected_conditions else 'Not specified'}
-            
-            Please suggest laboratory tests that are:
-            1. Clinically indicated based on symptoms and presentation
-            2. Evidence-based and guideline-recommended
-            3. Cost-effective and appropriate for the clinical setting
-            4. Prioritized by urgency and clinical importance
-            
-            For each suggested test, provide:
-            - Test name and code
-            - Clinical rationale
-            - Expected results interpretation
-            - Urgency level (routine, urgent, stat)
-            
-            Organize suggestions by:
-            - Essential tests (must have)
-            - Recommended tests (should have)
-            - Optional tests (consider if resources allow)
-            """
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": lab_prompt}],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+            lab_messages, prompt_version = self._render_prompt(
+                "lab_suggestions",
+                context,
+                suspected_conditions=', '.join(suspected_conditions) if suspected_conditions else 'Not specified'
+            )
+            
+            response, alternatives = await asyncio.gather(
+                self.llm.chat(
+                    model="gpt-4",
+                    messages=lab_messages,
+                    prompt_version=prompt_version,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature
+                ),
+                self._generate_lab_alternatives(context, suspected_conditions) if include_alternatives else self._no_alternatives()
             )
             
             lab_suggestions = response.choices[0].message.content
@@ -198,7 +229,7 @@ class DoctorCopilotService:
                 content=lab_suggestions,
                 confidence=confidence,
                 reasoning="Based on symptoms, clinical presentation, and evidence-based guidelines",
-                alternatives=await self._generate_lab_alternatives(context, suspected_conditions),
+                alternatives=alternatives,
                 references=[self.medical_references["clinical_guidelines"]]
             )
             
@@ -210,45 +241,25 @@ class DoctorCopilotService:
         self,
         context: NoteContext,
         include_differential: bool = True,
-        include_confidence: bool = True
+        include_confidence: bool = True,
+        include_alternatives: bool = True
     ) -> CopilotSuggestion:
         """
         Suggest primary diagnosis and differential diagnoses
         """
         try:
             # Prepare diagnosis suggestion prompt
-            diagnosis_prompt = f"""
-            As a medical AI assistant, provide diagnostic suggestions based on the following clinical information:
-            
-            Patient Information:
-            - Chief complaint: {context.chief_complaint}
-            - Symptoms: {', '.join(context.symptoms)}
-            - Vital signs: {json.dumps(context.vital_signs)}
-            - Physical exam findings: {context.physical_exam}
-            - Lab results: {json.dumps(context.lab_results)}
-            - Imaging results: {json.dumps(context.scan_results)}
-            - Medical history: {context.medical_history}
-            - Current medications: {', '.join(context.current_medications)}
-            
-            Please provide:
-            1. Primary diagnosis with confidence level
-            2. Differential diagnoses (top 3-5 alternatives)
-            3. Clinical reasoning for each diagnosis
-            4. Red flags or concerning features
-            5. Recommended next steps for confirmation
-            
-            Focus on:
-            - Evidence-based diagnostic criteria
-            - Clinical presentation patterns
-            - Risk factors and comorbidities
-            - Age and gender-specific considerations
-            """
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": diagnosis_prompt}],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+            diagnosis_messages, prompt_version = self._render_prompt("diagnosis", context)
+            
+            response, alternatives = await asyncio.gather(
+                self.llm.chat(
+                    model="gpt-4",
+                    messages=diagnosis_messages,
+                    prompt_version=prompt_version,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature
+                ),
+                self._generate_diagnosis_alternatives(context) if include_alternatives else self._no_alternatives()
             )
             
             diagnosis_suggestions = response.choices[0].message.content
@@ -261,7 +272,7 @@ class DoctorCopilotService:
                 content=diagnosis_suggestions,
                 confidence=confidence,
                 reasoning="Based on clinical presentation, lab results, and evidence-based diagnostic criteria",
-                alternatives=await self._generate_diagnosis_alternatives(context),
+                alternatives=alternatives,
                 references=[self.medical_references["clinical_guidelines"]]
             )
             
@@ -274,49 +285,31 @@ class DoctorCopilotService:
         diagnosis: str,
         context: NoteContext,
         education_level: str = "high_school",
-        language: str = "English"
+        language: str = "English",
+        include_alternatives: bool = True
     ) -> CopilotSuggestion:
         """
         Generate patient-friendly explanation of diagnosis
         """
         try:
             # Prepare patient explanation prompt
-            explanation_prompt = f"""
-            As a medical AI assistant, explain the following diagnosis to a patient in simple, understandable terms:
-            
-            Diagnosis: {diagnosis}
-            
-            Patient Context:
-            - Chief complaint: {context.chief_complaint}
-            - Symptoms: {', '.join(context.symptoms)}
-            - Age and relevant history: {context.medical_history}
-            
-            Education level: {education_level}
-            Language: {language}
-            
-            Please provide an explanation that includes:
-            1. What the diagnosis means in simple terms
-            2. What caused this condition (if known)
-            3. What symptoms to expect
-            4. How it will be treated
-            5. What the patient can do to help themselves
-            6. When to seek immediate medical attention
-            7. What to expect in terms of recovery
-            
-            Guidelines:
-            - Use simple, non-medical language
-            - Avoid jargon and complex medical terms
-            - Be encouraging but realistic
-            - Include practical advice
-            - Address common concerns and fears
-            - Provide hope and positive outlook when appropriate
-            """
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": explanation_prompt}],
-                max_tokens=self.max_tokens,
-                temperature=0.7  # Slightly higher for more natural patient communication
+            explanation_messages, prompt_version = self._render_prompt(
+                "patient_explanation",
+                context,
+                diagnosis=diagnosis,
+                education_level=education_level,
+                language=language
+            )
+            
+            response, alternatives = await asyncio.gather(
+                self.llm.chat(
+                    model="gpt-4",
+                    messages=explanation_messages,
+                    prompt_version=prompt_version,
+                    max_tokens=self.max_tokens,
+                    temperature=0.7  # Slightly higher for more natural patient communication
+                ),
+                self._generate_explanation_alternatives(diagnosis, context, education_level) if include_alternatives else self._no_alternatives()
             )
             
             patient_explanation = response.choices[0].message.content
@@ -326,7 +319,7 @@ class DoctorCopilotService:
                 content=patient_explanation,
                 confidence=0.9,  # High confidence for patient communication
                 reasoning="Tailored for patient education level and language preference",
-                alternatives=await self._generate_explanation_alternatives(diagnosis, context, education_level),
+                alternatives=alternatives,
                 references=["Patient education guidelines", "Health literacy best practices"]
             )
             
@@ -338,46 +331,30 @@ class DoctorCopilotService:
         self,
         context: NoteContext,
         diagnosis: str,
-        treatment_initiated: List[str] = None
+        treatment_initiated: List[str] = None,
+        include_alternatives: bool = True
     ) -> CopilotSuggestion:
         """
         Suggest follow-up plan and monitoring recommendations
         """
         try:
             # Prepare follow-up suggestion prompt
-            followup_prompt = f"""
-            As a medical AI assistant, suggest a comprehensive follow-up plan for the following case:
-            
-            Patient Information:
-            - Diagnosis: {diagnosis}
-            - Chief complaint: {context.chief_complaint}
-            - Treatment initiated: {', '.join(treatment_initiated) if treatment_initiated else 'None specified'}
-            - Medical history: {context.medical_history}
-            - Current medications: {', '.join(context.current_medications)}
-            
-            Please provide a follow-up plan that includes:
-            1. Recommended follow-up timeline
-            2. Monitoring parameters to track
-            3. Signs and symptoms to watch for
-            4. When to return for follow-up
-            5. When to seek immediate medical attention
-            6. Lifestyle modifications if applicable
-            7. Medication monitoring if applicable
-            8. Referral recommendations if needed
-            
-            Consider:
-            - Standard of care for the diagnosis
-            - Patient's individual risk factors
-            - Treatment response monitoring
-            - Prevention of complications
-            - Patient education needs
-            """
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": followup_prompt}],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+            followup_messages, prompt_version = self._render_prompt(
+                "follow_up",
+                context,
+                diagnosis=diagnosis,
+                treatment_initiated=', '.join(treatment_initiated) if treatment_initiated else 'None specified'
+            )
+            
+            response, alternatives = await asyncio.gather(
+                self.llm.chat(
+                    model="gpt-4",
+                    messages=followup_messages,
+                    prompt_version=prompt_version,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature
+                ),
+                self._generate_followup_alternatives(context, diagnosis, treatment_initiated) if include_alternatives else self._no_alternatives()
             )
             
             followup_plan = response.choices[0].message.content
@@ -387,7 +364,7 @@ class DoctorCopilotService:
                 content=followup_plan,
                 confidence=0.85,
                 reasoning="Based on diagnosis, treatment plan, and standard follow-up protocols",
-                alternatives=await self._generate_followup_alternatives(context, diagnosis, treatment_initiated),
+                alternatives=alternatives,
                 references=[self.medical_references["clinical_guidelines"]]
             )
             
@@ -399,44 +376,24 @@ class DoctorCopilotService:
         self,
         context: NoteContext,
         doctor_notes: str,
-        summary_type: str = "comprehensive"
+        summary_type: str = "comprehensive",
+        include_alternatives: bool = True
     ) -> CopilotSuggestion:
         """
         Summarize the patient visit for documentation
         """
         try:
-            # Prepare summary prompt
-            summary_prompt = f"""
-            As a medical AI assistant, create a {summary_type} summary of the following patient visit:
-            
-            Visit Information:
-            - Date: {context.visit_date}
-            - Chief complaint: {context.chief_complaint}
-            - Doctor's notes: {doctor_notes}
-            
-            Patient Data:
-            - Symptoms: {', '.join(context.symptoms)}
-            - Vital signs: {json.dumps(context.vital_signs)}
-            - Physical exam: {context.physical_exam}
-            - Lab results: {json.dumps(context.lab_results)}
-            - Imaging: {json.dumps(context.scan_results)}
-            
-            Please create a {summary_type} summary that includes:
-            1. Key findings and observations
-            2. Clinical decisions made
-            3. Treatment plan initiated
-            4. Follow-up recommendations
-            5. Important patient education provided
-            6. Any concerns or red flags identified
-            
-            Style: Professional, concise, and clinically relevant
-            """
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": summary_prompt}],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+            summary_messages, prompt_version = self._build_summary_messages(context, doctor_notes, summary_type)
+            
+            response, alternatives = await asyncio.gather(
+                self.llm.chat(
+                    model="gpt-4",
+                    messages=summary_messages,
+                    prompt_version=prompt_version,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature
+                ),
+                self._generate_summary_alternatives(context, doctor_notes, summary_type) if include_alternatives else self._no_alternatives()
             )
             
             visit_summary = response.choices[0].message.content
@@ -446,7 +403,7 @@ class DoctorCopilotService:
                 content=visit_summary,
                 confidence=0.9,
                 reasoning="Based on comprehensive visit data and doctor's notes",
-                alternatives=await self._generate_summary_alternatives(context, doctor_notes, summary_type),
+                alternatives=alternatives,
                 references=[self.medical_references["soap"]]
             )
             
@@ -458,47 +415,30 @@ class DoctorCopilotService:
         self,
         context: NoteContext,
         procedures_performed: List[str] = None,
-        visit_complexity: str = "moderate"
+        visit_complexity: str = "moderate",
+        include_alternatives: bool = True
     ) -> CopilotSuggestion:
         """
         Suggest appropriate CPT codes for billing
         """
         try:
             # Prepare CPT suggestion prompt
-            cpt_prompt = f"""
-            As a medical AI assistant, suggest appropriate CPT codes for the following visit:
-            
-            Visit Information:
-            - Chief complaint: {context.chief_complaint}
-            - Visit complexity: {visit_complexity}
-            - Procedures performed: {', '.join(procedures_performed) if procedures_performed else 'None specified'}
-            - Physical exam findings: {context.physical_exam}
-            - Lab tests ordered: {json.dumps(context.lab_results)}
-            - Imaging ordered: {json.dumps(context.scan_results)}
-            
-            Please suggest CPT codes for:
-            1. Evaluation and Management (E&M) codes based on visit complexity
-            2. Procedure codes if any procedures were performed
-            3. Lab test codes for ordered tests
-            4. Imaging codes for ordered studies
-            
-            For each code, provide:
-            - CPT code and description
-            - Documentation requirements
-            - Modifiers if applicable
-            - Rationale for code selection
-            
-            Ensure compliance with:
-            - CPT coding guidelines
-            - Documentation requirements
-            - Medical necessity criteria
-            """
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": cpt_prompt}],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+            cpt_messages, prompt_version = self._render_prompt(
+                "cpt_codes",
+                context,
+                visit_complexity=visit_complexity,
+                procedures_performed=', '.join(procedures_performed) if procedures_performed else 'None specified'
+            )
+            
+            response, alternatives = await asyncio.gather(
+                self.llm.chat(
+                    model="gpt-4",
+                    messages=cpt_messages,
+                    prompt_version=prompt_version,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature
+                ),
+                self._generate_cpt_alternatives(context, procedures_performed, visit_complexity) if include_alternatives else self._no_alternatives()
             )
             
             cpt_suggestions = response.choices[0].message.content
@@ -508,7 +448,7 @@ class DoctorCopilotService:
                 content=cpt_suggestions,
                 confidence=0.8,
                 reasoning="Based on visit complexity, procedures, and CPT coding guidelines",
-                alternatives=await self._generate_cpt_alternatives(context, procedures_performed, visit_complexity),
+                alternatives=alternatives,
                 references=[self.medical_references["cpt"]]
             )
             
@@ -516,33 +456,37 @@ class DoctorCopilotService:
             logger.error(f"Error suggesting CPT codes: {e}")
             raise
     
-    def _prepare_soap_context(self, context: NoteContext, doctor_notes: str = None) -> str:
-        """Prepare context string for SOAP note generation"""
-        context_str = f"""
-        Patient ID: {context.patient_id}
-        Visit Date: {context.visit_date}
-        
-        Chief Complaint: {context.chief_complaint}
-        Symptoms: {', '.join(context.symptoms)}
-        
-        Vital Signs: {json.dumps(context.vital_signs)}
-        Physical Examination: {context.physical_exam}
-        
-        Lab Results: {json.dumps(context.lab_results)}
-        Imaging Results: {json.dumps(context.scan_results)}
-        
-        Current Medications: {', '.join(context.current_medications)}
-        Allergies: {', '.join(context.allergies)}
-        
-        Medical History: {context.medical_history}
-        Family History: {context.family_history}
-        Social History: {context.social_history}
-        """
-        
-        if doctor_notes:
-            context_str += f"\nDoctor's Notes: {doctor_notes}"
-        
-        return context_str
+    def _build_soap_messages(self, context: NoteContext, doctor_notes: str, style_preference: str) -> Tuple[List[Dict[str, str]], str]:
+        """SOAP note prompt shared by the plain and streaming endpoints"""
+        return self._render_prompt(
+            "soap_note",
+            context,
+            doctor_notes=doctor_notes or "None provided",
+            style_preference=style_preference
+        )
+    
+    def _build_summary_messages(self, context: NoteContext, doctor_notes: str, summary_type: str) -> Tuple[List[Dict[str, str]], str]:
+        """Visit summary prompt shared by the plain and streaming endpoints"""
+        return self._render_prompt(
+            "visit_summary",
+            context,
+            doctor_notes=doctor_notes,
+            summary_type=summary_type
+        )
+    
+    def _render_prompt(self, task: str, context: NoteContext, **values: str) -> Tuple[List[Dict[str, str]], str]:
+        """Messages for a task's template, with the patient context compacted to the task's budget, and its version label"""
+        prompt = self.prompts[task]
+        patient_values = {
+            "patient_id": context.patient_id,
+            "visit_date": context.visit_date,
+            "chief_complaint": context.chief_complaint,
+            "symptoms": ', '.join(context.symptoms),
+            "current_medications": ', '.join(context.current_medications),
+            "allergies": ', '.join(context.allergies),
+            **self.context_builder.compact(context, task)
+        }
+        return prompt.render(**patient_values, **values), prompt.label
     
     def _calculate_soap_confidence(self, context: NoteContext) -> float:
         """Calculate confidence score for SOAP note generation"""
@@ -596,71 +540,119 @@ class DoctorCopilotService:
         
         return min(confidence, 0.85)  # Cap at 85% for diagnosis suggestions
     
+    async def generate_alternatives(
+        self,
+        suggestion_type: str,
+        context: NoteContext,
+        options: Dict[str, Any] = None
+    ) -> List[str]:
+        """
+        Alternatives for a suggestion that was generated with include_alternatives=False
+        
+        options carries the arguments of the original call (e.g. style_preference,
+        diagnosis, education_level) that the alternatives depend on.
+        """
+        options = options or {}
+        generators = {
+            "soap_note": lambda: self._generate_soap_alternatives(
+                context, options.get("style_preference", "comprehensive")),
+            "lab_suggestions": lambda: self._generate_lab_alternatives(
+                context, options.get("suspected_conditions")),
+            "diagnosis": lambda: self._generate_diagnosis_alternatives(context),
+            "patient_explanation": lambda: self._generate_explanation_alternatives(
+                options["diagnosis"], context, options.get("education_level", "high_school")),
+            "follow_up": lambda: self._generate_followup_alternatives(
+                context, options["diagnosis"], options.get("treatment_initiated")),
+            "visit_summary": lambda: self._generate_summary_alternatives(
+                context, options.get("doctor_notes", ""), options.get("summary_type", "comprehensive")),
+            "cpt_codes": lambda: self._generate_cpt_alternatives(
+                context, options.get("procedures_performed"), options.get("visit_complexity", "moderate"))
+        }
+        
+        if suggestion_type not in generators:
+            raise ValueError(f"Unknown suggestion type: {suggestion_type}")
+        if suggestion_type in ("patient_explanation", "follow_up") and "diagnosis" not in options:
+            raise ValueError(f"{suggestion_type} alternatives require options.diagnosis")
+        
+        return await generators[suggestion_type]()
+    
+    async def _no_alternatives(self) -> None:
+        return None
+    
+    async def _generate_alternatives(
+        self,
+        variants: List[Tuple[str, str]],
+        preview_chars: int,
+        temperature: float = None
+    ) -> List[str]:
+        """
+        Fetch (label, prompt) alternatives concurrently
+        
+        Only the first preview_chars characters of each alternative are shown,
+        so each completion's token budget is sized to that preview.
+        """
+        results = await asyncio.gather(*(
+            self._generate_alternative(label, prompt, preview_chars, temperature)
+            for label, prompt in variants
+        ))
+        return [result for result in results if result is not None]
+    
+    async def _generate_alternative(
+        self,
+        label: str,
+        prompt: str,
+        preview_chars: int,
+        temperature: float = None
+    ) -> Optional[str]:
+        try:
+            # Previews queue behind primary suggestions. Alternative prompts carry
+            # no patient data, so repeats are served from the response cache
+            response = await self.llm.chat(
+                model="gpt-4",
+                messages=[{"role": "user", "content": prompt}],
+                priority=Priority.STANDARD,
+                cache=True,
+                max_tokens=math.ceil(preview_chars / PREVIEW_CHARS_PER_TOKEN),
+                temperature=self.temperature if temperature is None else temperature
+            )
+            return f"{label}: {response.choices[0].message.content[:preview_chars]}..."
+        except Exception as e:
+            logger.error(f"Error generating {label} alternative: {e}")
+            return None
+    
     async def _generate_soap_alternatives(self, context: NoteContext, style_preference: str) -> List[str]:
         """Generate alternative SOAP note styles"""
-        alternatives = []
-        
-        # Generate different style alternatives
         styles = ["concise", "detailed", "problem-focused", "comprehensive"]
-        for style in styles:
-            if style != style_preference:
-                try:
-                    alt_prompt = f"Generate a {style} SOAP note for the same patient case"
-                    response = await self.client.chat.completions.create(
-                        model="gpt-4",
-                        messages=[{"role": "user", "content": alt_prompt}],
-                        max_tokens=1000,
-                        temperature=self.temperature
-                    )
-                    alternatives.append(f"{style.capitalize()} style: {response.choices[0].message.content[:200]}...")
-                except Exception as e:
-                    logger.error(f"Error generating {style} alternative: {e}")
-        
-        return alternatives
+        return await self._generate_alternatives(
+            [
+                (f"{style.capitalize()} style", f"Generate a {style} SOAP note for the same patient case")
+                for style in styles if style != style_preference
+            ],
+            preview_chars=200
+        )
     
     async def _generate_lab_alternatives(self, context: NoteContext, suspected_conditions: List[str] = None) -> List[str]:
         """Generate alternative lab test suggestions"""
-        alternatives = []
-        
-        # Generate conservative vs comprehensive alternatives
+        # Conservative vs comprehensive alternatives
         approaches = ["conservative", "comprehensive", "minimal"]
-        
-        for approach in approaches:
-            try:
-                alt_prompt = f"Suggest {approach} lab tests for the same clinical scenario"
-                response = await self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": alt_prompt}],
-                    max_tokens=500,
-                    temperature=self.temperature
-                )
-                alternatives.append(f"{approach.capitalize()} approach: {response.choices[0].message.content[:150]}...")
-            except Exception as e:
-                logger.error(f"Error generating {approach} lab alternative: {e}")
-        
-        return alternatives
+        return await self._generate_alternatives(
+            [
+                (f"{approach.capitalize()} approach", f"Suggest {approach} lab tests for the same clinical scenario")
+                for approach in approaches
+            ],
+            preview_chars=150
+        )
     
     async def _generate_diagnosis_alternatives(self, context: NoteContext) -> List[str]:
         """Generate alternative diagnostic approaches"""
-        alternatives = []
-        
-        # Generate different diagnostic perspectives
         perspectives = ["differential diagnosis", "working diagnosis", "rule-out approach"]
-        
-        for perspective in perspectives:
-            try:
-                alt_prompt = f"Provide {perspective} for the same clinical presentation"
-                response = await self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": alt_prompt}],
-                    max_tokens=500,
-                    temperature=self.temperature
-                )
-                alternatives.append(f"{perspective.replace('_', ' ').title()}: {response.choices[0].message.content[:150]}...")
-            except Exception as e:
-                logger.error(f"Error generating {perspective} alternative: {e}")
-        
-        return alternatives
+        return await self._generate_alternatives(
+            [
+                (perspective.replace('_', ' ').title(), f"Provide {perspective} for the same clinical presentation")
+                for perspective in perspectives
+            ],
+            preview_chars=150
+        )
     
     async def _generate_explanation_alternatives(
         self,
@@ -669,25 +661,16 @@ class DoctorCopilotService:
         education_level: str
     ) -> List[str]:
         """Generate alternative patient explanations"""
-        alternatives = []
-        
-        # Generate explanations for different education levels
+        # Explanations for the other education levels
         levels = ["elementary", "high_school", "college"]
-        for level in levels:
-            if level != education_level:
-                try:
-                    alt_prompt = f"Explain {diagnosis} to a patient with {level} education level"
-                    response = await self.client.chat.completions.create(
-                        model="gpt-4",
-                        messages=[{"role": "user", "content": alt_prompt}],
-                        max_tokens=300,
-                        temperature=0.7
-                    )
-                    alternatives.append(f"{level.replace('_', ' ').title()} level: {response.choices[0].message.content[:100]}...")
-                except Exception as e:
-                    logger.error(f"Error generating {level} explanation alternative: {e}")
-        
-        return alternatives
+        return await self._generate_alternatives(
+            [
+                (f"{level.replace('_', ' ').title()} level", f"Explain {diagnosis} to a patient with {level} education level")
+                for level in levels if level != education_level
+            ],
+            preview_chars=100,
+            temperature=0.7
+        )
     
     async def _generate_followup_alternatives(
         self,
@@ -696,25 +679,14 @@ class DoctorCopilotService:
         treatment_initiated: List[str] = None
     ) -> List[str]:
         """Generate alternative follow-up plans"""
-        alternatives = []
-        
-        # Generate different follow-up approaches
         approaches = ["conservative", "aggressive", "standard"]
-        
-        for approach in approaches:
-            try:
-                alt_prompt = f"Suggest {approach} follow-up plan for {diagnosis}"
-                response = await self.client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": alt_prompt}],
-                    max_tokens=400,
-                    temperature=self.temperature
-                )
-                alternatives.append(f"{approach.capitalize()} approach: {response.choices[0].message.content[:100]}...")
-            except Exception as e:
-                logger.error(f"Error generating {approach} follow-up alternative: {e}")
-        
-        return alternatives
+        return await self._generate_alternatives(
+            [
+                (f"{approach.capitalize()} approach", f"Suggest {approach} follow-up plan for {diagnosis}")
+                for approach in approaches
+            ],
+            preview_chars=100
+        )
     
     async def _generate_summary_alternatives(
         self,
@@ -723,25 +695,14 @@ class DoctorCopilotService:
         summary_type: str
     ) -> List[str]:
         """Generate alternative visit summaries"""
-        alternatives = []
-        
-        # Generate different summary types
         types = ["brief", "detailed", "problem-focused", "comprehensive"]
-        for summary_type_alt in types:
-            if summary_type_alt != summary_type:
-                try:
-                    alt_prompt = f"Generate {summary_type_alt} visit summary"
-                    response = await self.client.chat.completions.create(
-                        model="gpt-4",
-                        messages=[{"role": "user", "content": alt_prompt}],
-                        max_tokens=500,
-                        temperature=self.temperature
-                    )
-                    alternatives.append(f"{summary_type_alt.capitalize()} summary: {response.choices[0].message.content[:100]}...")
-                except Exception as e:
-                    logger.error(f"Error generating {summary_type_alt} summary alternative: {e}")
-        
-        return alternatives
+        return await self._generate_alternatives(
+            [
+                (f"{summary_type_alt.capitalize()} summary", f"Generate {summary_type_alt} visit summary")
+                for summary_type_alt in types if summary_type_alt != summary_type
+            ],
+            preview_chars=100
+        )
     
     async def _generate_cpt_alternatives(
         self,
@@ -750,25 +711,14 @@ class DoctorCopilotService:
         visit_complexity: str = None
     ) -> List[str]:
         """Generate alternative CPT code suggestions"""
-        alternatives = []
-        
-        # Generate alternatives for different complexity levels
         complexities = ["low", "moderate", "high"]
-        for complexity in complexities:
-            if complexity != visit_complexity:
-                try:
-                    alt_prompt = f"Suggest CPT codes for {complexity} complexity visit"
-                    response = await self.client.chat.completions.create(
-                        model="gpt-4",
-                        messages=[{"role": "user", "content": alt_prompt}],
-                        max_tokens=400,
-                        temperature=self.temperature
-                    )
-                    alternatives.append(f"{complexity.capitalize()} complexity: {response.choices[0].message.content[:100]}...")
-                except Exception as e:
-                    logger.error(f"Error generating {complexity} CPT alternative: {e}")
-        
-        return alternatives
+        return await self._generate_alternatives(
+            [
+                (f"{complexity.capitalize()} complexity", f"Suggest CPT codes for {complexity} complexity visit")
+                for complexity in complexities if complexity != visit_complexity
+            ],
+            preview_chars=100
+        )
     
     async def get_model_status(self) -> Dict[str, Any]:
         """Get status of the copilot service"""
@@ -783,7 +733,13 @@ class DoctorCopilotService:
                 "explain_diagnosis_to_patient",
                 "suggest_follow_up_plan",
                 "summarize_visit",
-                "suggest_cpt_codes"
+                "suggest_cpt_codes",
+                "generate_alternatives"
             ],
+            "context_compaction": self.context_builder.get_stats(),
+            "prompt_templates": {
+                name: {"version": prompt.version, "prefix_tokens": prompt.prefix_tokens, "prefix_hash": prompt.prefix_hash}
+                for name, prompt in self.prompts.items()
+            },
             "last_updated": datetime.now().isoformat()
         } 
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+Embedding cache for encoder outputs
+
+Two tiers:
+- an in-process LRU of recently used vectors
+- an optional fixed-size on-disk table, memory-mapped by every worker on the
+  host, so one worker's encodings are reused by the others
+
+Text is keyed by its normalised form (case-folded, whitespace collapsed);
+images by a hash of their raw bytes. Keys are namespaced by model so a new
+encoder never reads stale vectors.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils.metrics import MetricSample, register_collector
+
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 20  # sha1 digest
+_WHITESPACE = re.compile(r"\s+")
+
+class _DiskTier:
+    """
+    Open-addressed table of float32 vectors in two memory-mapped files
+
+    The header row for each slot holds the key digest and a CRC32 of the
+    vector, so a torn write from another process reads as a miss rather
+    than a wrong embedding. Full probe sequences overwrite their first slot.
+    """
+
+    def __init__(self, path_prefix: str, dim: int, slots: int, probes: int = 8):
+        self.dim = dim
+        self.slots = slots
+        self.probes = probes
+
+        vectors_path = f"{path_prefix}.{dim}d.f32"
+        headers_path = f"{path_prefix}.{dim}d.idx"
+        self.vectors = self._open(vectors_path, (slots, dim), np.float32)
+        self.headers = self._open(headers_path, (slots, KEY_BYTES + 4), np.uint8)
+
+    def _open(self, path: str, shape: tuple, dtype) -> np.memmap:
+        expected = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if not os.path.exists(path) or os.path.getsize(path) != expected:
+            # Append mode never clobbers a table another worker already filled
+            with open(path, "ab") as f:
+                f.truncate(expected)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _candidate_slots(self, key: bytes) -> List[int]:
+        start = int.from_bytes(key[:8], "little") % self.slots
+        return [(start + i) % self.slots for i in range(self.probes)]
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        for slot in self._candidate_slots(key):
+            header = self.headers[slot]
+            if header[:KEY_BYTES].tobytes() == key:
+                vector = np.array(self.vectors[slot])
+                if zlib.crc32(vector.tobytes()) == int.from_bytes(header[KEY_BYTES:].tobytes(), "little"):
+                    return vector
+                return None
+        return None
+
+    def put(self, key: bytes, vector: np.ndarray):
+        candidates = self._candidate_slots(key)
+        empty = bytes(KEY_BYTES)
+        target = candidates[0]
+        for slot in candidates:
+            existing = self.headers[slot, :KEY_BYTES].tobytes()
+            if existing == key or existing == empty:
+                target = slot
+                break
+
+        checksum = zlib.crc32(vector.tobytes()).to_bytes(4, "little")
+        self.vectors[target] = vector
+        self.headers[target] = np.frombuffer(key + checksum, dtype=np.uint8)
+
+class EmbeddingCache:
+    """
+    Two-tier cache of embeddings for one encoder
+
+    Args:
+        name: Cache name, used in metrics and disk file names
+        namespace: Model identifier mixed into every key
+        dim: Embedding width; lets the disk tier open before the first write
+        capacity: In-process LRU size (vectors)
+        disk_dir: Directory for the shared memory-mapped tier; None disables it
+        disk_slots: Number of vectors the disk tier holds
+    """
+
+    def __init__(
+        self,
+        name: str,
+        namespace: str,
+        dim: Optional[int] = None,
+        capacity: int = 4096,
+        disk_dir: Optional[str] = None,
+        disk_slots: int = 65536
+    ):
+        self.name = name
+        self.namespace = namespace
+        self.capacity = capacity
+        self.disk_dir = disk_dir
+        self.disk_slots = disk_slots
+
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._disk: Optional[_DiskTier] = None
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_dir and dim:
+            self._disk_tier(dim)
+
+        register_collector(self._collect_metrics)
+
+    def text_key(self, text: str) -> bytes:
+        """Key for text, insensitive to case and whitespace differences"""
+        normalised = _WHITESPACE.sub(" ", text).strip().casefold()
+        return self._digest(normalised.encode("utf-8"))
+
+    def image_key(self, image_data: Any) -> bytes:
+        """Key for raw image bytes, a base64 string or a decoded array"""
+        if isinstance(image_data, str):
+            image_data = base64.b64decode(image_data)
+        if isinstance(image_data, np.ndarray):
+            header = f"{image_data.dtype.str}{image_data.shape}".encode()
+            return self._digest(header + np.ascontiguousarray(image_data).tobytes())
+        if hasattr(image_data, "tobytes"):
+            # PIL image
+            header = f"{image_data.mode}{image_data.size}".encode()
+            return self._digest(header + image_data.tobytes())
+        return self._digest(bytes(image_data))
+
+    def _digest(self, payload: bytes) -> bytes:
+        digest = hashlib.sha1(self.namespace.encode("utf-8") + b"\0")
+        digest.update(payload)
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """Look a vector up in memory, then on disk (promoting disk hits)"""
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+            if self._disk is not None:
+                vector = self._disk.get(key)
+                if vector is not None:
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, key: bytes, vector: np.ndarray):
+        """Store a 1-D vector in both tiers"""
+        vector = np.ascontiguousarray(vector, dtype=np.float32).reshape(-1)
+        with self._lock:
+            self._remember(key, vector)
+            if self.disk_dir:
+                try:
+                    self._disk_tier(vector.shape[0]).put(key, vector)
+                except Exception as e:
+                    logger.warning(f"Embedding cache {self.name}: disk tier disabled: {e}")
+                    self.disk_dir = None
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def _disk_tier(self, dim: int) -> _DiskTier:
+        # Created lazily, once the embedding width is known
+        if self._disk is None or self._disk.dim != dim:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk = _DiskTier(os.path.join(self.disk_dir, self.name), dim, self.disk_slots)
+        return self._disk
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and sizes"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_capacity": self.capacity,
+            "disk_enabled": bool(self.disk_dir),
+            "disk_slots": self.disk_slots if self.disk_dir else 0
+        }
+
+    def _collect_metrics(self) -> List[MetricSample]:
+        labels = {"cache": self.name}
+        return [
+            MetricSample("medai_embedding_cache_lookups_total", self.memory_hits, {**labels, "result": "memory_hit"},
+                         "counter", "Embedding cache lookups by result"),
+            MetricSample("medai_embedding_cache_lookups_total", self.disk_hits, {**labels, "result": "disk_hit"}, "counter"),
+            MetricSample("medai_embedding_cache_lookups_total", self.misses, {**labels, "result": "miss"}, "counter"),
+            MetricSample("medai_embedding_cache_entries", len(self._memory), labels,
+                         "gauge", "Vectors held in the in-process tier")
+        ]
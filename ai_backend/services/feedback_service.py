@@ -9,9 +9,11 @@ from models.response_models import FeedbackResponse
 logger = logging.getLogger(__name__)
 
 class FeedbackService:
-    def __init__(self):
+    def __init__(self, retrainer=None):
         self.feedback_log = []  # In production, this would be a database
         self.model_status = "loaded"
+        # RecoveryRetrainer that receives labelled outcomes from processed feedback
+        self.retrainer = retrainer
     
     async def submit_feedback(
         self,
@@ -20,10 +22,17 @@ class FeedbackService:
         doctor_id: str,
         patient_id: str,
         comments: Optional[str] = None,
-        modified_diagnosis: Optional[str] = None
+        modified_diagnosis: Optional[str] = None,
+        recovery_case: Optional[Dict[str, Any]] = None,
+        actual_recovery_days: Optional[float] = None,
+        had_complications: Optional[bool] = None
     ) -> Dict[str, Any]:
         """
         Submit doctor feedback on AI suggestions
+        
+        recovery_case (the predict_recovery inputs) together with the observed
+        actual_recovery_days and had_complications make the feedback a
+        labelled outcome for recovery model retraining.
         """
         try:
             # Validate feedback type
@@ -41,6 +50,9 @@ class FeedbackService:
                 "patient_id": patient_id,
                 "comments": comments,
                 "modified_diagnosis": modified_diagnosis,
+                "recovery_case": recovery_case,
+                "actual_recovery_days": actual_recovery_days,
+                "had_complications": had_complications,
                 "timestamp": datetime.now().isoformat(),
                 "processed": False
             }
@@ -85,6 +97,9 @@ class FeedbackService:
                 "patient_id": feedback_record["patient_id"],
                 "comments": feedback_record["comments"],
                 "modified_diagnosis": feedback_record["modified_diagnosis"],
+                "recovery_case": feedback_record["recovery_case"],
+                "actual_recovery_days": feedback_record["actual_recovery_days"],
+                "had_complications": feedback_record["had_complications"],
                 "processed": False
             }
             
@@ -175,35 +190,55 @@ class FeedbackService:
             if not unprocessed:
                 return {"message": "No unprocessed feedback found", "processed_count": 0}
             
-            # Process feedback (in production, this would trigger model retraining)
+            # Process feedback
             processed_count = 0
+            outcomes = []
             for feedback in unprocessed:
                 try:
+                    if self._is_labelled_outcome(feedback):
+                        outcomes.append({
+                            "outcome_id": feedback["feedback_id"],
+                            "case": feedback["recovery_case"],
+                            "actual_recovery_days": feedback["actual_recovery_days"],
+                            "had_complications": feedback["had_complications"],
+                            "recorded_at": datetime.fromisoformat(feedback["timestamp"]).timestamp()
+                        })
+                    
                     # Mark as processed
                     feedback["processed"] = True
                     feedback["processed_timestamp"] = datetime.now().isoformat()
                     
-                    # In production, this would:
-                    # 1. Extract features from the original analysis
-                    # 2. Compare with doctor feedback
-                    # 3. Update training dataset
-                    # 4. Trigger model retraining if enough new data
-                    
                     processed_count += 1
                     
                 except Exception as e:
                     logger.error(f"Error processing feedback {feedback['feedback_id']}: {e}")
             
-            return {
+            result = {
                 "message": f"Processed {processed_count} feedback records",
                 "processed_count": processed_count,
-                "total_unprocessed": len(unprocessed)
+                "total_unprocessed": len(unprocessed),
+                "labelled_outcomes": len(outcomes)
             }
             
+            # Feed labelled outcomes to the recovery models; retraining runs in the background
+            if self.retrainer is not None and outcomes:
+                self.retrainer.add_outcomes(outcomes)
+                result["retraining"] = await self.retrainer.maybe_retrain()
+            
+            return result
+            
         except Exception as e:
             logger.error(f"Error processing feedback batch: {e}")
             raise
     
+    def _is_labelled_outcome(self, feedback: Dict[str, Any]) -> bool:
+        """Feedback carries everything needed to train the recovery models"""
+        return (
+            feedback.get("recovery_case") is not None
+            and feedback.get("actual_recovery_days") is not None
+            and feedback.get("had_complications") is not None
+        )
+    
     async def get_model_improvement_metrics(self) -> Dict[str, Any]:
         """
         Get metrics for model improvement tracking
@@ -0,0 +1,401 @@
+"""
+Streaming bulk lab ingestion
+
+Parses FHIR Bulk Data NDJSON (Observation resources) and HL7v2 ORU^R01
+messages line by line, maps LOINC codes onto the reference-range keys used by
+BloodworkAnalysisService, and feeds batches into the lab time-series store
+and, optionally, the bloodwork analysis pipeline.
+
+Benchmark (run from ai_backend/):
+    python -m services.lab_ingestion generate --output labs.ndjson --size-gb 2
+    python -m services.lab_ingestion bench --input labs.ndjson [--with-store | --analyze]
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Iterator, BinaryIO, Tuple
+
+from models.response_models import LabValue
+
+logger = logging.getLogger(__name__)
+
+# LOINC code -> BloodworkAnalysisService reference-range key
+LOINC_TO_ANALYTE = {
+    "6690-2": "WBC",
+    "789-8": "RBC",
+    "718-7": "Hemoglobin",
+    "4544-3": "Hematocrit",
+    "777-3": "Platelets",
+    "2345-7": "Glucose",
+    "2339-0": "Glucose",
+    "2160-0": "Creatinine",
+    "3094-0": "BUN",
+    "2951-2": "Sodium",
+    "2823-3": "Potassium",
+    "2075-0": "Chloride",
+    "2028-9": "CO2",
+    "17861-6": "Calcium",
+    "1751-7": "Albumin",
+    "2885-2": "Total Protein",
+    "1975-2": "Bilirubin Total",
+    "1742-6": "ALT",
+    "1920-8": "AST",
+    "6768-6": "Alkaline Phosphatase",
+    "2857-1": "PSA",
+    "2039-6": "CEA",
+    "1834-1": "AFP",
+    "10334-1": "CA-125",
+    "24108-3": "CA-19-9"
+}
+
+# (analyte, UCUM unit) -> factor into the reference unit; identity entries
+# cover UCUM spellings of the units used in the reference ranges
+UNIT_CONVERSIONS = {
+    ("WBC", "10*3/uL"): 1.0,
+    ("RBC", "10*6/uL"): 1.0,
+    ("Platelets", "10*3/uL"): 1.0,
+    ("Hemoglobin", "g/L"): 0.1,
+    ("Glucose", "mmol/L"): 18.016,
+    ("Creatinine", "umol/L"): 1 / 88.42,
+    ("BUN", "mmol/L"): 2.801,
+    ("Sodium", "mmol/L"): 1.0,
+    ("Potassium", "mmol/L"): 1.0,
+    ("Chloride", "mmol/L"): 1.0,
+    ("CO2", "mmol/L"): 1.0,
+    ("Calcium", "mmol/L"): 4.008,
+    ("Albumin", "g/L"): 0.1,
+    ("Total Protein", "g/L"): 0.1,
+    ("Bilirubin Total", "umol/L"): 1 / 17.1,
+    ("PSA", "ug/L"): 1.0,
+    ("CEA", "ug/L"): 1.0,
+    ("AFP", "ug/L"): 1.0
+}
+
+LOINC_SYSTEM = "http://loinc.org"
+
+# LOINC-shaped codes; a prefilter only, so lines without a mapped code skip JSON decoding
+_LOINC_PATTERN = re.compile(rb'"code"\s*:\s*"(\d{1,5}-\d)"')
+_SEGMENT_SPLIT = re.compile(rb'[\r\n]+')
+
+# (patient_id, analyte, observed_at, value, unit, status)
+ObservationRow = Tuple[str, str, float, float, str, str]
+
+class LabIngestionService:
+    """
+    Streaming FHIR/HL7 lab ingestion into the analysis pipeline and lab store
+    """
+
+    def __init__(self, bloodwork_service, lab_store=None, batch_size: int = 5000):
+        self.bloodwork_service = bloodwork_service
+        self.lab_store = lab_store
+        self.batch_size = batch_size
+
+        ranges = bloodwork_service.reference_ranges
+        self._reference_units = {name: info["unit"] for name, info in ranges.items()}
+        # Codes as bytes so the regex prefilter can be matched without decoding
+        self._loinc_bytes = {code.encode(): analyte for code, analyte in LOINC_TO_ANALYTE.items()}
+
+        logger.info("LabIngestionService initialized")
+
+    def _to_reference_unit(self, analyte: str, value: float, unit: Optional[str]) -> Optional[float]:
+        """Convert a value into the reference unit, or None when the unit is unknown"""
+        reference_unit = self._reference_units.get(analyte)
+        if not unit or unit == reference_unit:
+            return value
+        factor = UNIT_CONVERSIONS.get((analyte, unit))
+        return value * factor if factor is not None else None
+
+    def _make_row(
+        self,
+        patient_id: str,
+        analyte: str,
+        observed_at: float,
+        value: float,
+        unit: Optional[str],
+        stats: Dict[str, int]
+    ) -> Optional[ObservationRow]:
+        value = self._to_reference_unit(analyte, value, unit)
+        if value is None:
+            stats["unit_mismatches"] += 1
+            return None
+        status, _ = self.bloodwork_service.classify_lab_value(analyte, value)
+        return (patient_id, analyte, observed_at, value, self._reference_units.get(analyte, unit or ""), status)
+
+    @staticmethod
+    def _loinc_analyte(code: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Analyte for the first mapped LOINC coding of a FHIR CodeableConcept"""
+        if not isinstance(code, dict):
+            return None
+        for coding in code.get("coding") or []:
+            if isinstance(coding, dict) and coding.get("system") == LOINC_SYSTEM:
+                analyte = LOINC_TO_ANALYTE.get(coding.get("code"))
+                if analyte:
+                    return analyte
+        return None
+
+    def iter_fhir_ndjson(self, stream: BinaryIO, stats: Dict[str, int]) -> Iterator[ObservationRow]:
+        """Yield observation rows from a FHIR Bulk Data NDJSON byte stream"""
+        for line in stream:
+            stats["lines"] += 1
+            stats["bytes"] += len(line)
+
+            if not any(match.group(1) in self._loinc_bytes for match in _LOINC_PATTERN.finditer(line)):
+                stats["skipped"] += 1
+                continue
+
+            try:
+                resource = json.loads(line)
+                # The analyte comes from Observation.code, never from component
+                # codes or codings in other systems that the prefilter also matches
+                analyte = self._loinc_analyte(resource.get("code")) if resource.get("resourceType") == "Observation" else None
+                if analyte is None:
+                    stats["skipped"] += 1
+                    continue
+
+                quantity = resource["valueQuantity"]
+                subject = resource["subject"]["reference"]
+                effective = resource.get("effectiveDateTime") or resource.get("issued")
+                observed_at = datetime.fromisoformat(effective).timestamp()
+                row = self._make_row(
+                    subject.rsplit("/", 1)[-1],
+                    analyte,
+                    observed_at,
+                    float(quantity["value"]),
+                    quantity.get("code") or quantity.get("unit"),
+                    stats
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                stats["errors"] += 1
+                logger.debug(f"Skipping malformed Observation: {e}")
+                continue
+
+            if row is not None:
+                yield row
+
+    def _iter_hl7_segments(self, stream: BinaryIO, chunk_size: int = 1 << 20) -> Iterator[bytes]:
+        """Split an HL7v2 byte stream into segments (CR, LF or CRLF terminated)"""
+        remainder = b""
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            parts = _SEGMENT_SPLIT.split(remainder + chunk)
+            remainder = parts.pop()
+            for segment in parts:
+                if segment:
+                    yield segment
+        if remainder:
+            yield remainder
+
+    @staticmethod
+    def _parse_hl7_timestamp(value: bytes) -> Optional[float]:
+        digits = value[:14].decode()
+        formats = {14: "%Y%m%d%H%M%S", 12: "%Y%m%d%H%M", 8: "%Y%m%d"}
+        fmt = formats.get(len(digits))
+        return datetime.strptime(digits, fmt).timestamp() if fmt else None
+
+    def iter_hl7_oru(self, stream: BinaryIO, stats: Dict[str, int]) -> Iterator[ObservationRow]:
+        """Yield observation rows from a stream of HL7v2 ORU^R01 messages"""
+        field_sep = b"|"
+        component_sep = b"^"
+        patient_id = None
+        request_time = None
+
+        for segment in self._iter_hl7_segments(stream):
+            stats["lines"] += 1
+            stats["bytes"] += len(segment) + 1
+            segment_type = segment[:3]
+
+            if segment_type == b"MSH":
+                field_sep = segment[3:4]
+                component_sep = segment[4:5]
+                patient_id = None
+                request_time = None
+                continue
+
+            fields = segment.split(field_sep)
+            try:
+                if segment_type == b"PID":
+                    patient_id = fields[3].split(component_sep)[0].decode()
+                elif segment_type == b"OBR":
+                    request_time = self._parse_hl7_timestamp(fields[7]) if len(fields) > 7 and fields[7] else None
+                elif segment_type == b"OBX":
+                    identifier = fields[3].split(component_sep)
+                    analyte = None
+                    if len(identifier) > 2 and identifier[2] == b"LN":
+                        analyte = self._loinc_bytes.get(identifier[0])
+                    elif len(identifier) > 5 and identifier[5] == b"LN":
+                        analyte = self._loinc_bytes.get(identifier[3])
+                    if analyte is None or patient_id is None or fields[2] not in (b"NM", b"SN"):
+                        stats["skipped"] += 1
+                        continue
+
+                    observed_at = request_time
+                    if len(fields) > 14 and fields[14]:
+                        observed_at = self._parse_hl7_timestamp(fields[14])
+                    if observed_at is None:
+                        stats["errors"] += 1
+                        continue
+
+                    # SN values look like ">^10" or "^10"; take the numeric component
+                    raw_value = fields[5].split(component_sep)[-1]
+                    unit = fields[6].split(component_sep)[0].decode() if len(fields) > 6 else None
+                    row = self._make_row(patient_id, analyte, observed_at, float(raw_value), unit, stats)
+                    if row is not None:
+                        yield row
+                else:
+                    stats["skipped"] += 1
+            except (IndexError, UnicodeDecodeError, ValueError) as e:
+                stats["errors"] += 1
+                logger.debug(f"Skipping malformed {segment_type!r} segment: {e}")
+
+    async def ingest_fhir_ndjson(self, stream: BinaryIO, analyze: bool = False) -> Dict[str, Any]:
+        """Ingest a FHIR Bulk Data NDJSON export of Observation resources"""
+        stats = self._new_stats()
+        return await self._ingest(self.iter_fhir_ndjson(stream, stats), stats, analyze)
+
+    async def ingest_hl7_oru(self, stream: BinaryIO, analyze: bool = False) -> Dict[str, Any]:
+        """Ingest a file of HL7v2 ORU^R01 messages"""
+        stats = self._new_stats()
+        return await self._ingest(self.iter_hl7_oru(stream, stats), stats, analyze)
+
+    @staticmethod
+    def _new_stats() -> Dict[str, int]:
+        return defaultdict(int)
+
+    async def _ingest(self, rows: Iterator[ObservationRow], stats: Dict[str, int], analyze: bool) -> Dict[str, Any]:
+        """
+        Drain a row iterator in batches into the lab store and analysis pipeline
+
+        Reading and parsing a batch, and writing it to the store, run in a
+        worker thread so a multi-GB upload never blocks the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        start_time = time.time()
+        urgency_counts: Dict[str, int] = defaultdict(int)
+        patients = set()
+
+        while True:
+            batch = await loop.run_in_executor(None, self._read_batch, rows, patients)
+            if not batch:
+                break
+            if analyze:
+                for result in await self._analyze_batch(batch):
+                    urgency_counts[result.urgency_level] += 1
+            elif self.lab_store is not None:
+                await loop.run_in_executor(None, self.lab_store.append_observations, batch)
+            stats["observations"] += len(batch)
+
+        elapsed = time.time() - start_time
+        result = dict(stats)
+        result.update({
+            "patients": len(patients),
+            "processing_time": elapsed,
+            "observations_per_second": stats["observations"] / elapsed if elapsed > 0 else 0.0,
+            "megabytes_per_second": stats["bytes"] / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+        })
+        if analyze:
+            result["urgency_levels"] = dict(urgency_counts)
+        return result
+
+    def _read_batch(self, rows: Iterator[ObservationRow], patients: set) -> List[ObservationRow]:
+        """Pull the next batch off the parser; runs in a worker thread"""
+        batch = list(itertools.islice(rows, self.batch_size))
+        patients.update(row[0] for row in batch)
+        return batch
+
+    async def _analyze_batch(self, batch: List[ObservationRow]) -> List[Any]:
+        """Group a batch into per-patient panels and run them through the bloodwork pipeline"""
+        panels: Dict[Tuple[str, float], List[LabValue]] = defaultdict(list)
+        for patient_id, analyte, observed_at, value, unit, status in batch:
+            _, reference_range = self.bloodwork_service.classify_lab_value(analyte, value)
+            panels[(patient_id, observed_at)].append(LabValue(
+                name=analyte,
+                value=value,
+                unit=unit,
+                reference_range=reference_range,
+                status=status
+            ))
+
+        ordered = [
+            (patient_id, lab_values, datetime.fromtimestamp(observed_at))
+            for (patient_id, observed_at), lab_values in sorted(panels.items(), key=lambda item: item[0][1])
+        ]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.bloodwork_service.analyze_panels, ordered)
+
+def _generate_ndjson(output: str, size_gb: float, patients: int = 100000):
+    """Write a synthetic FHIR Observation NDJSON file of roughly the requested size"""
+    import random
+
+    random.seed(42)
+    codes = [
+        ("2160-0", "mg/dL", 0.6, 2.0), ("2345-7", "mg/dL", 60, 250), ("718-7", "g/dL", 9, 17),
+        ("2823-3", "mmol/L", 3.0, 6.0), ("2951-2", "mmol/L", 128, 150), ("777-3", "10*3/uL", 100, 500),
+        ("8867-4", "/min", 50, 120)  # heart rate: unmapped, exercises the prefilter
+    ]
+    target = int(size_gb * 1024 ** 3)
+    written = 0
+    base = datetime(2024, 1, 1).timestamp()
+
+    with open(output, "w") as f:
+        i = 0
+        while written < target:
+            code, unit, low, high = codes[i % len(codes)]
+            resource = {
+                "resourceType": "Observation",
+                "id": str(i),
+                "status": "final",
+                "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category", "code": "laboratory"}]}],
+                "code": {"coding": [{"system": "http://loinc.org", "code": code}]},
+                "subject": {"reference": f"Patient/{i % patients}"},
+                "effectiveDateTime": datetime.fromtimestamp(base + (i // patients) * 86400).isoformat(),
+                "valueQuantity": {"value": round(random.uniform(low, high), 2), "unit": unit, "system": "http://unitsofmeasure.org", "code": unit}
+            }
+            line = json.dumps(resource, separators=(",", ":")) + "\n"
+            f.write(line)
+            written += len(line)
+            i += 1
+
+    print(f"Wrote {i} observations ({written / 1024 ** 3:.2f} GB) to {output}")
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+
+    from services.bloodwork_analysis import BloodworkAnalysisService
+    from services.lab_timeseries_store import LabTimeSeriesStore
+
+    parser = argparse.ArgumentParser(description="FHIR/HL7 lab ingestion benchmark")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    generate = subparsers.add_parser("generate", help="Generate a synthetic FHIR NDJSON file")
+    generate.add_argument("--output", required=True)
+    generate.add_argument("--size-gb", type=float, default=2.0)
+    bench = subparsers.add_parser("bench", help="Measure ingestion throughput")
+    bench.add_argument("--input", required=True)
+    bench.add_argument("--format", choices=["fhir", "hl7"], default="fhir")
+    bench.add_argument("--batch-size", type=int, default=5000)
+    bench.add_argument("--with-store", action="store_true", help="Also persist into a scratch lab store")
+    bench.add_argument("--analyze", action="store_true", help="Run every panel through the bloodwork pipeline")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        _generate_ndjson(args.output, args.size_gb)
+    else:
+        store = None
+        if args.with_store or args.analyze:
+            store = LabTimeSeriesStore(db_path=os.path.join(tempfile.mkdtemp(), "bench.db"))
+        service = LabIngestionService(BloodworkAnalysisService(lab_store=store), lab_store=store, batch_size=args.batch_size)
+
+        with open(args.input, "rb", buffering=1 << 20) as f:
+            ingest = service.ingest_fhir_ndjson if args.format == "fhir" else service.ingest_hl7_oru
+            result = asyncio.run(ingest(f, analyze=args.analyze))
+
+        print(json.dumps(result, indent=2))
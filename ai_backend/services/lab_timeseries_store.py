@@ -0,0 +1,461 @@
+"""
+Longitudinal lab time-series store
+
+Persists parsed lab values per patient and analyte in an append-only SQLite
+log and keeps an in-memory columnar copy of each series. Trend aggregates
+(last value, delta, rolling slope, rolling z-score) are updated on insert so
+trend reads never rescan the history.
+
+The in-memory copy is a per-process LRU of patients. Several workers can
+share one database, so before a cached patient is served the store folds in
+any rows with a higher rowid than it has seen; that is one indexed range
+query which returns nothing when the cache is current.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Iterable, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400.0
+
+# (patient_id, analyte, observed_at, value, unit, status)
+ObservationRow = Tuple[str, str, float, float, str, Optional[str]]
+
+@dataclass
+class LabTrend:
+    """Incrementally maintained aggregates for one patient/analyte series"""
+    analyte: str
+    unit: str
+    count: int
+    last_value: float
+    last_observed_at: datetime
+    delta: Optional[float] = None  # change since the previous draw
+    rolling_slope: Optional[float] = None  # units per day over the rolling window
+    rolling_zscore: Optional[float] = None  # last value against the preceding window
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["last_observed_at"] = self.last_observed_at.isoformat()
+        return data
+
+class _LabSeries:
+    """
+    Columnar, append-only series for a single analyte
+
+    Timestamps and values live in growable numpy arrays. Rolling-window sums
+    are maintained on append so the slope and z-score are O(1) to update.
+    """
+
+    def __init__(self, analyte: str, unit: str, window: int, capacity: int = 16):
+        self.analyte = analyte
+        self.unit = unit
+        self.window = window
+        self.size = 0
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.trend: Optional[LabTrend] = None
+        self._reset_sums()
+
+    def _reset_sums(self):
+        self._n = 0
+        self._sum_t = 0.0
+        self._sum_v = 0.0
+        self._sum_tt = 0.0
+        self._sum_tv = 0.0
+        self._sum_vv = 0.0
+
+    def _grow(self, min_capacity: int):
+        capacity = max(min_capacity, 2 * len(self.values))
+        self.timestamps = np.resize(self.timestamps, capacity)
+        self.values = np.resize(self.values, capacity)
+
+    def _days(self, ts: float) -> float:
+        # Offset from the first observation keeps the squared sums well conditioned
+        return (ts - self.timestamps[0]) / SECONDS_PER_DAY
+
+    def _add_to_window(self, t: float, v: float, sign: float):
+        self._n += int(sign)
+        self._sum_t += sign * t
+        self._sum_v += sign * v
+        self._sum_tt += sign * t * t
+        self._sum_tv += sign * t * v
+        self._sum_vv += sign * v * v
+
+    def _window_zscore(self, value: float) -> Optional[float]:
+        if self._n < 2:
+            return None
+        mean = self._sum_v / self._n
+        variance = max(self._sum_vv / self._n - mean * mean, 0.0)
+        if variance <= 1e-12:
+            return None
+        return (value - mean) / np.sqrt(variance)
+
+    def _window_slope(self) -> Optional[float]:
+        if self._n < 2:
+            return None
+        denominator = self._n * self._sum_tt - self._sum_t * self._sum_t
+        if abs(denominator) <= 1e-12:
+            return None
+        return (self._n * self._sum_tv - self._sum_t * self._sum_v) / denominator
+
+    def append(self, ts: float, value: float):
+        """Append one observation and update the aggregates in O(1)"""
+        if self.size and ts < self.timestamps[self.size - 1]:
+            self._insert_out_of_order(ts, value)
+            return
+
+        if self.size == len(self.values):
+            self._grow(self.size + 1)
+
+        previous = self.values[self.size - 1] if self.size else None
+        self.timestamps[self.size] = ts
+        self.values[self.size] = value
+        self.size += 1
+
+        # z-score is measured against the window before this draw joins it
+        zscore = self._window_zscore(value)
+
+        self._add_to_window(self._days(ts), value, 1.0)
+        if self._n > self.window:
+            evicted = self.size - self.window - 1
+            self._add_to_window(self._days(self.timestamps[evicted]), self.values[evicted], -1.0)
+
+        self._update_trend(ts, value, previous, zscore)
+
+    def extend(self, timestamps: np.ndarray, values: np.ndarray):
+        """Bulk-load sorted observations and rebuild the aggregates once"""
+        if self.size + len(values) > len(self.values):
+            self._grow(self.size + len(values))
+        self.timestamps[self.size:self.size + len(values)] = timestamps
+        self.values[self.size:self.size + len(values)] = values
+        self.size += len(values)
+        self._rebuild()
+
+    def _insert_out_of_order(self, ts: float, value: float):
+        """Late-arriving draw: insert in time order and rebuild the window"""
+        index = int(np.searchsorted(self.timestamps[:self.size], ts, side="right"))
+        if self.size == len(self.values):
+            self._grow(self.size + 1)
+        self.timestamps[index + 1:self.size + 1] = self.timestamps[index:self.size].copy()
+        self.values[index + 1:self.size + 1] = self.values[index:self.size].copy()
+        self.timestamps[index] = ts
+        self.values[index] = value
+        self.size += 1
+        self._rebuild()
+
+    def _rebuild(self):
+        self._reset_sums()
+        if self.size == 0:
+            self.trend = None
+            return
+
+        # Replay the window preceding the last draw, then the draw itself
+        start = max(0, self.size - self.window - 1)
+        for i in range(start, self.size - 1):
+            self._add_to_window(self._days(self.timestamps[i]), self.values[i], 1.0)
+
+        ts = self.timestamps[self.size - 1]
+        value = self.values[self.size - 1]
+        zscore = self._window_zscore(value)
+        self._add_to_window(self._days(ts), value, 1.0)
+        if self._n > self.window:
+            self._add_to_window(self._days(self.timestamps[start]), self.values[start], -1.0)
+
+        previous = self.values[self.size - 2] if self.size > 1 else None
+        self._update_trend(ts, value, previous, zscore)
+
+    def _update_trend(self, ts: float, value: float, previous: Optional[float], zscore: Optional[float]):
+        slope = self._window_slope()
+        self.trend = LabTrend(
+            analyte=self.analyte,
+            unit=self.unit,
+            count=self.size,
+            last_value=float(value),
+            last_observed_at=datetime.fromtimestamp(ts),
+            delta=float(value - previous) if previous is not None else None,
+            rolling_slope=float(slope) if slope is not None else None,
+            rolling_zscore=float(zscore) if zscore is not None else None
+        )
+
+    def slice(self, start: Optional[float] = None, end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        timestamps = self.timestamps[:self.size]
+        lo = int(np.searchsorted(timestamps, start, side="left")) if start is not None else 0
+        hi = int(np.searchsorted(timestamps, end, side="right")) if end is not None else self.size
+        return timestamps[lo:hi], self.values[lo:hi]
+
+class LabTimeSeriesStore:
+    """
+    Per-patient, per-analyte lab history with incremental trend aggregates
+
+    SQLite is the durable append-only log; each patient's series are loaded
+    into columnar memory on first access and caught up from the log, by
+    rowid, on every later access.
+    """
+
+    def __init__(self, db_path: str = "lab_timeseries.db", window: int = 10, max_patients: int = 10000):
+        self.db_path = db_path
+        self.window = window
+        self.max_patients = max_patients
+        self._series: "OrderedDict[str, Dict[str, _LabSeries]]" = OrderedDict()
+        self._last_rowid: Dict[str, int] = {}  # highest log rowid folded into each cached patient
+        self._lock = threading.RLock()
+
+        self._init_database()
+
+        logger.info(f"LabTimeSeriesStore initialized ({db_path}, window={window})")
+
+    def _init_database(self):
+        """Initialize the append-only observation log"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS lab_observations (
+                patient_id TEXT NOT NULL,
+                analyte TEXT NOT NULL,
+                observed_at REAL NOT NULL,
+                value REAL NOT NULL,
+                unit TEXT,
+                status TEXT
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_patient_analyte_time
+            ON lab_observations(patient_id, analyte, observed_at)
+        ''')
+
+        # Entries are ordered by (patient_id, rowid), so catching a cached patient up is a range seek
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_patient_rowid
+            ON lab_observations(patient_id)
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def _get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path)
+
+    def _load_patient(self, patient_id: str, conn: Optional[sqlite3.Connection] = None) -> Dict[str, _LabSeries]:
+        """Load a patient's history into columnar memory, or catch the cached copy up with the log"""
+        series = self._series.get(patient_id)
+        if series is not None:
+            self._series.move_to_end(patient_id)
+            self._catch_up(patient_id, series, conn)
+            return series
+
+        own_conn = conn is None
+        conn = conn or self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT analyte, observed_at, value, unit, rowid
+            FROM lab_observations
+            WHERE patient_id = ?
+            ORDER BY analyte, observed_at
+        ''', (patient_id,))
+        rows = cursor.fetchall()
+        if own_conn:
+            conn.close()
+
+        series = {}
+        last_rowid = 0
+        grouped: Dict[str, Tuple[str, List[float], List[float]]] = {}
+        for analyte, observed_at, value, unit, rowid in rows:
+            _, timestamps, values = grouped.setdefault(analyte, (unit or "", [], []))
+            timestamps.append(observed_at)
+            values.append(value)
+            last_rowid = max(last_rowid, rowid)
+
+        for analyte, (unit, timestamps, values) in grouped.items():
+            lab_series = _LabSeries(analyte, unit, self.window, capacity=max(16, len(values)))
+            lab_series.extend(np.asarray(timestamps), np.asarray(values))
+            series[analyte] = lab_series
+
+        self._series[patient_id] = series
+        self._last_rowid[patient_id] = last_rowid
+        while len(self._series) > self.max_patients:
+            evicted, _ = self._series.popitem(last=False)
+            self._last_rowid.pop(evicted, None)
+        return series
+
+    def _catch_up(self, patient_id: str, series: Dict[str, _LabSeries], conn: Optional[sqlite3.Connection] = None):
+        """Fold in rows written since the patient was cached, by this or another process"""
+        own_conn = conn is None
+        conn = conn or self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT analyte, observed_at, value, unit, rowid
+            FROM lab_observations
+            WHERE patient_id = ? AND rowid > ?
+            ORDER BY rowid
+        ''', (patient_id, self._last_rowid.get(patient_id, 0)))
+        rows = cursor.fetchall()
+        if own_conn:
+            conn.close()
+
+        for analyte, observed_at, value, unit, rowid in rows:
+            lab_series = series.get(analyte)
+            if lab_series is None:
+                lab_series = series[analyte] = _LabSeries(analyte, unit or "", self.window)
+            lab_series.append(observed_at, value)
+            self._last_rowid[patient_id] = rowid
+
+    def append_observations(self, rows: Iterable[ObservationRow]) -> int:
+        """
+        Append a batch of observations, possibly spanning many patients
+
+        Rows are written in a single transaction; cached patients pick them
+        up from the log on their next read. Returns the number of rows stored.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+
+        with self._lock:
+            conn = self._get_connection()
+            conn.executemany('''
+                INSERT INTO lab_observations
+                (patient_id, analyte, observed_at, value, unit, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+            conn.close()
+
+        return len(rows)
+
+    def record_lab_values(
+        self,
+        patient_id: str,
+        lab_values: List[Any],
+        observed_at: Optional[datetime] = None
+    ) -> Dict[str, LabTrend]:
+        """
+        Record a panel of parsed `LabValue`s drawn at the same time
+
+        Returns the updated trend for each analyte in the panel.
+        """
+        return self.record_panels([(patient_id, lab_values, observed_at)])[0]
+
+    def record_panels(self, panels: List[Tuple[str, List[Any], Optional[datetime]]]) -> List[Dict[str, LabTrend]]:
+        """
+        Record (patient_id, lab_values, observed_at) panels in one transaction
+
+        Returns each panel's trends as they stood right after it, the same as
+        recording the panels one at a time in order.
+        """
+        if not panels:
+            return []
+
+        with self._lock:
+            conn = self._get_connection()
+            try:
+                # Hold the write lock from catch-up to commit so no other process appends in between
+                conn.execute("BEGIN IMMEDIATE")
+                series_by_patient = {
+                    patient_id: self._load_patient(patient_id, conn)
+                    for patient_id in dict.fromkeys(patient_id for patient_id, _, _ in panels)
+                }
+
+                cursor = conn.cursor()
+                timestamps = []
+                rowids = []
+                for patient_id, lab_values, observed_at in panels:
+                    ts = (observed_at or datetime.now()).timestamp()
+                    for lv in lab_values:
+                        cursor.execute('''
+                            INSERT INTO lab_observations
+                            (patient_id, analyte, observed_at, value, unit, status)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', (patient_id, lv.name, ts, float(lv.value), lv.unit, lv.status))
+                    timestamps.append(ts)
+                    rowids.append(cursor.lastrowid)
+                conn.commit()
+            finally:
+                conn.close()
+
+            results = []
+            for (patient_id, lab_values, _), ts, rowid in zip(panels, timestamps, rowids):
+                series = series_by_patient[patient_id]
+                for lv in lab_values:
+                    lab_series = series.get(lv.name)
+                    if lab_series is None:
+                        lab_series = series[lv.name] = _LabSeries(lv.name, lv.unit or "", self.window)
+                    lab_series.append(ts, float(lv.value))
+                # A patient evicted while this batch was loading is reloaded from the log on next read
+                if patient_id in self._last_rowid:
+                    self._last_rowid[patient_id] = rowid
+                results.append({lv.name: series[lv.name].trend for lv in lab_values})
+            return results
+
+    def get_trend(self, patient_id: str, analyte: str) -> Optional[LabTrend]:
+        """Get the current aggregates for one analyte"""
+        with self._lock:
+            lab_series = self._load_patient(patient_id).get(analyte)
+            return lab_series.trend if lab_series else None
+
+    def get_trends(self, patient_id: str) -> Dict[str, LabTrend]:
+        """Get the current aggregates for every analyte on record"""
+        with self._lock:
+            return {
+                analyte: lab_series.trend
+                for analyte, lab_series in self._load_patient(patient_id).items()
+            }
+
+    def get_series(
+        self,
+        patient_id: str,
+        analyte: str,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """Get the raw time series for one analyte, optionally bounded in time"""
+        with self._lock:
+            lab_series = self._load_patient(patient_id).get(analyte)
+            if lab_series is None:
+                return {"analyte": analyte, "unit": None, "timestamps": [], "values": []}
+
+            timestamps, values = lab_series.slice(
+                start_date.timestamp() if start_date else None,
+                end_date.timestamp() if end_date else None
+            )
+            return {
+                "analyte": analyte,
+                "unit": lab_series.unit,
+                "timestamps": [datetime.fromtimestamp(ts).isoformat() for ts in timestamps],
+                "values": values.tolist()
+            }
+
+    def get_store_stats(self) -> Dict[str, Any]:
+        """Get storage statistics"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), COUNT(DISTINCT patient_id) FROM lab_observations')
+        total_observations, total_patients = cursor.fetchone()
+        conn.close()
+
+        return {
+            "total_observations": total_observations,
+            "total_patients": total_patients,
+            "patients_in_memory": len(self._series),
+            "max_patients_in_memory": self.max_patients,
+            "rolling_window": self.window,
+            "database_path": self.db_path
+        }
+
+# Global instance for easy access
+lab_timeseries_store = LabTimeSeriesStore(
+    db_path=os.getenv("LAB_TIMESERIES_DB", "lab_timeseries.db"),
+    window=int(os.getenv("LAB_TREND_WINDOW", 10)),
+    max_patients=int(os.getenv("LAB_SERIES_CACHE_SIZE", 10000))
+)
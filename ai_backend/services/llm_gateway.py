@@ -0,0 +1,508 @@
+"""
+Shared LLM gateway
+
+Every service sends its chat completions through one gateway per process
+instead of constructing its own AsyncOpenAI client. The gateway provides:
+- one pooled HTTP client, so connections are reused across services
+- token buckets for requests/min and tokens/min, matching the provider's limits
+- a concurrency cap
+- priority classes: waiting interactive calls are admitted before background ones
+- retries with exponential backoff and full jitter on 429, 5xx and connection
+  errors, honouring Retry-After when the provider sends it
+- per-call latency, queue wait, retry and token metrics on /metrics
+- an opt-in prompt-response cache (cache=True) with single-flight
+  coalescing, so concurrent identical prompts make one upstream call
+- cached versus uncached prompt tokens per prompt template version
+  (prompt_version=...), as reported by the provider's prefix cache
+
+The gateway lives in one process. Under several uvicorn workers
+(WEB_CONCURRENCY) the LLM_REQUESTS_PER_MIN, LLM_TOKENS_PER_MIN and
+LLM_MAX_CONCURRENCY settings are deployment-wide budgets, and each worker
+enforces an equal share of them. Traffic spread unevenly across workers can
+therefore be throttled before the deployment reaches its budget.
+
+Usage:
+    self.llm = get_llm_gateway().client("doctor_copilot", Priority.INTERACTIVE)
+    response = await self.llm.chat(messages=[...], max_tokens=500, temperature=0.3)
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from enum import IntEnum
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from services.llm_response_cache import CachedCompletion, LLMResponseCache
+from utils.metrics import Histogram, MetricSample, register_collector
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-4"
+CHARS_PER_TOKEN = 4  # rough prompt size estimate used for admission
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # a clinician or patient is waiting on the response
+    STANDARD = 1  # request-scoped analysis
+    BACKGROUND = 2  # scheduled jobs, batch scoring
+
+class TokenBucket:
+    """Continuously refilled bucket holding up to one minute of allowance"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (0 if it is now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+class LLMGateway:
+    """
+    Process-wide admission control and retry layer in front of the OpenAI API
+
+    Explicit limits apply to this process as given; limits read from the
+    environment are split evenly across WEB_CONCURRENCY workers.
+
+    Args:
+        requests_per_minute: Request budget (LLM_REQUESTS_PER_MIN)
+        tokens_per_minute: Prompt + completion token budget (LLM_TOKENS_PER_MIN)
+        max_concurrency: Calls in flight at once (LLM_MAX_CONCURRENCY)
+        max_retries: Retries after a 429/5xx/connection error (LLM_MAX_RETRIES)
+        backoff_base_s: First backoff ceiling; doubles each attempt
+        backoff_max_s: Largest backoff ceiling
+        timeout_s: Per-request timeout (LLM_TIMEOUT_S)
+        client: Preconfigured AsyncOpenAI-compatible client (tests, stub servers)
+        cache: Response cache for cache=True calls (default from LLM_CACHE_* env)
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_base_s: float = 0.5,
+        backoff_max_s: float = 30.0,
+        timeout_s: Optional[float] = None,
+        client: Any = None,
+        cache: Optional[LLMResponseCache] = None
+    ):
+        self.workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+        self.requests = TokenBucket(requests_per_minute or float(os.getenv("LLM_REQUESTS_PER_MIN", "500")) / self.workers)
+        self.tokens = TokenBucket(tokens_per_minute or float(os.getenv("LLM_TOKENS_PER_MIN", "80000")) / self.workers)
+        self.max_concurrency = max_concurrency or max(1, int(os.getenv("LLM_MAX_CONCURRENCY", "16")) // self.workers)
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "4"))
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.timeout_s = timeout_s or float(os.getenv("LLM_TIMEOUT_S", "60"))
+        self.api_key = os.getenv("OPENAI_API_KEY")
+
+        self._client = client
+        self._in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future, float]] = []  # (priority, seq, future, tokens)
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        
+        self.cache = cache or LLMResponseCache(
+            capacity=int(os.getenv("LLM_CACHE_SIZE", 2048)),
+            ttl_s=float(os.getenv("LLM_CACHE_TTL_S", 86400)),
+            db_path=os.getenv("LLM_CACHE_DB")
+        )
+        self._pending: Dict[str, asyncio.Future] = {}  # cache key -> in-flight call
+
+        self._counters: Dict[Tuple[str, ...], float] = {}
+        self.latency = Histogram(
+            "medai_llm_request_seconds", "LLM call latency including retries",
+            label_names=("caller", "model", "outcome"),
+            buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+        )
+        self.queue_wait = Histogram(
+            "medai_llm_queue_wait_seconds", "Time LLM calls waited for admission",
+            label_names=("priority",)
+        )
+        self._prompt_usage: Dict[str, List[float]] = {}  # prompt version -> [calls, prompt tokens, cached tokens]
+        self.prompt_latency = Histogram(
+            "medai_llm_prompt_seconds", "LLM call latency by prompt template and provider prefix-cache use",
+            label_names=("prompt", "prefix_cache"),
+            buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+        )
+        register_collector(self._collect_metrics)
+
+    @property
+    def available(self) -> bool:
+        return self._client is not None or bool(self.api_key)
+
+    def client(self, caller: str, priority: Priority = Priority.STANDARD) -> "LLMClient":
+        """A handle that tags every call with the caller's name and default priority"""
+        return LLMClient(self, caller, priority)
+
+    def _get_client(self):
+        if self._client is None:
+            # One pooled connection set for every service; retries are done here, not in the SDK
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                ),
+                timeout=self.timeout_s
+            )
+            self._client = AsyncOpenAI(api_key=self.api_key, max_retries=0, http_client=http_client)
+        return self._client
+
+    # Admission
+
+    async def _acquire(self, priority: Priority, tokens: float) -> float:
+        """Wait for a concurrency slot and rate budget; returns seconds waited"""
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._sequence), future, tokens))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as the caller gave up; hand the slot on
+                self._release()
+            raise
+        return time.monotonic() - start
+
+    def _release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admit waiters in priority order while slots and budget allow"""
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+        while self._waiters and self._in_flight < self.max_concurrency:
+            _, _, future, tokens = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                # Strict priority: lower classes do not overtake a throttled head
+                self._wakeup = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self._in_flight += 1
+            future.set_result(None)
+
+    # Calls
+
+    def _estimate_tokens(self, messages: List[Dict[str, Any]], max_tokens: Optional[int]) -> float:
+        prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+        return prompt_chars / CHARS_PER_TOKEN + (max_tokens or 0)
+
+    def _is_retryable(self, error: Exception) -> bool:
+        status = getattr(error, "status_code", None)
+        if status is not None:
+            return status == 429 or status >= 500
+        return isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError, httpx.TransportError))
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max_s)
+            except ValueError:
+                pass
+        # Full jitter keeps retrying workers from synchronising
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * 2 ** attempt))
+
+    async def _create_with_retries(self, caller: str, priority: Priority, estimate: float, params: Dict[str, Any]):
+        """Admit and issue one create() call, retrying transient failures; caller must _release()"""
+        attempt = 0
+        while True:
+            waited = await self._acquire(priority, estimate)
+            self.queue_wait.observe(waited, priority=priority.name.lower())
+            try:
+                return await self._get_client().chat.completions.create(**params)
+            except asyncio.CancelledError:
+                self._release()
+                raise
+            except Exception as e:
+                self._release()
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                self._count("medai_llm_retries_total", caller, params["model"], "retry")
+                logger.warning(f"LLM call from {caller} failed ({e}); retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def chat(
+        self,
+        caller: str,
+        priority: Priority,
+        messages: List[Dict[str, Any]],
+        model: str = DEFAULT_MODEL,
+        cache: bool = False,
+        cache_ttl_s: Optional[float] = None,
+        prompt_version: Optional[str] = None,
+        **params
+    ):
+        """
+        Chat completion; returns the provider's response object
+
+        With cache=True the completion may come from the response cache, or
+        from an identical call already in flight. Only opt in for prompts
+        without patient-specific free text. prompt_version labels the call's
+        template (name@vN) for the cached-prompt-token metrics.
+        """
+        if not cache:
+            return await self._chat(caller, priority, messages, model, prompt_version, **params)
+
+        key = self.cache.key(model, messages, params)
+        content = self.cache.get(key)
+        if content is not None:
+            self.cache.record(caller, "hit")
+            return CachedCompletion(content, model)
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.cache.record(caller, "coalesced")
+            return await asyncio.shield(pending)
+
+        self.cache.record(caller, "miss")
+        call = asyncio.ensure_future(self._chat(caller, priority, messages, model, prompt_version, **params))
+        self._pending[key] = call
+
+        def finished(task: asyncio.Future):
+            self._pending.pop(key, None)
+            if not task.cancelled() and task.exception() is None:
+                self.cache.put(key, model, task.result().choices[0].message.content, cache_ttl_s)
+
+        call.add_done_callback(finished)
+        # Shielded so waiters coalesced onto this call survive the first caller going away
+        return await asyncio.shield(call)
+
+    async def _chat(
+        self,
+        caller: str,
+        priority: Priority,
+        messages: List[Dict[str, Any]],
+        model: str,
+        prompt_version: Optional[str] = None,
+        **params
+    ):
+        estimate = self._estimate_tokens(messages, params.get("max_tokens"))
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self._create_with_retries(
+                caller, priority, estimate, {"model": model, "messages": messages, **params}
+            )
+            self._release()
+            outcome = "ok"
+        finally:
+            elapsed = time.perf_counter() - start
+            self.latency.observe(elapsed, caller=caller, model=model, outcome=outcome)
+
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            cached_tokens = _cached_prompt_tokens(usage)
+            self._record_usage(caller, model, usage.prompt_tokens, usage.completion_tokens, estimate, cached_tokens)
+            if prompt_version:
+                self._record_prompt(prompt_version, usage.prompt_tokens, cached_tokens, elapsed)
+        return response
+
+    async def chat_stream(
+        self,
+        caller: str,
+        priority: Priority,
+        messages: List[Dict[str, Any]],
+        model: str = DEFAULT_MODEL,
+        prompt_version: Optional[str] = None,
+        **params
+    ) -> AsyncIterator[str]:
+        """
+        Streaming chat completion yielding content deltas
+
+        Only opening the stream is retried; the slot is held until the stream ends.
+        Streams report no usage, so they are left out of the per-prompt
+        cached-token figures; prompt_version is accepted for symmetry with chat.
+        """
+        estimate = self._estimate_tokens(messages, params.get("max_tokens"))
+        start = time.perf_counter()
+        outcome = "error"
+        chunks = 0
+        stream = await self._create_with_retries(
+            caller, priority, estimate, {"model": model, "messages": messages, "stream": True, **params}
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks += 1
+                    yield chunk.choices[0].delta.content
+            outcome = "ok"
+        finally:
+            try:
+                # A client that disconnects mid-stream closes this generator early; close the
+                # upstream response too, so the provider stops generating and the pooled
+                # connection is freed
+                await self._close_stream(stream)
+            finally:
+                self._release()
+                self.latency.observe(time.perf_counter() - start, caller=caller, model=model, outcome=outcome)
+                # Streams carry no usage block; each content chunk is roughly one token
+                prompt_tokens = estimate - (params.get("max_tokens") or 0)
+                self._record_usage(caller, model, prompt_tokens, chunks, estimate)
+
+    @staticmethod
+    async def _close_stream(stream: Any):
+        response = getattr(stream, "response", None)
+        if response is not None:
+            # Shielded so a cancelled request still finishes closing the connection
+            await asyncio.shield(response.aclose())
+
+    # Metrics
+
+    def _record_usage(
+        self,
+        caller: str,
+        model: str,
+        prompt_tokens: float,
+        completion_tokens: float,
+        estimate: float,
+        cached_tokens: float = 0
+    ):
+        self._count("medai_llm_tokens_total", caller, model, "prompt", prompt_tokens)
+        self._count("medai_llm_tokens_total", caller, model, "prompt_cached", cached_tokens)
+        self._count("medai_llm_tokens_total", caller, model, "completion", completion_tokens)
+        # Admission reserved the estimate; refund what was not used
+        unused = estimate - prompt_tokens - completion_tokens
+        if unused > 0:
+            self.tokens.give_back(unused)
+
+    def _record_prompt(self, prompt_version: str, prompt_tokens: float, cached_tokens: float, elapsed: float):
+        usage = self._prompt_usage.setdefault(prompt_version, [0, 0, 0])
+        usage[0] += 1
+        usage[1] += prompt_tokens
+        usage[2] += cached_tokens
+        self.prompt_latency.observe(elapsed, prompt=prompt_version, prefix_cache="hit" if cached_tokens else "miss")
+        logger.debug(f"{prompt_version}: {cached_tokens:.0f} of {prompt_tokens:.0f} prompt tokens served from the provider cache")
+
+    def _count(self, name: str, caller: str, model: str, kind: str, amount: float = 1):
+        key = (name, caller, model, kind)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Current admission state and cumulative token counts"""
+        tokens: Dict[str, Dict[str, float]] = {}
+        retries = 0
+        for (name, caller, _, kind), value in self._counters.items():
+            if name == "medai_llm_tokens_total":
+                tokens.setdefault(caller, {"prompt": 0, "prompt_cached": 0, "completion": 0})[kind] += round(value)
+            else:
+                retries += value
+        return {
+            "in_flight": self._in_flight,
+            "waiting": sum(1 for waiter in self._waiters if not waiter[2].done()),
+            "max_concurrency": self.max_concurrency,
+            "workers": self.workers,
+            "requests_per_minute": self.requests.capacity,
+            "tokens_per_minute": self.tokens.capacity,
+            "requests_available": round(self.requests.level, 1),
+            "tokens_available": round(self.tokens.level),
+            "retries": int(retries),
+            "tokens_by_caller": tokens,
+            "prompt_cache": {
+                version: {
+                    "calls": int(calls),
+                    "prompt_tokens": round(prompt_tokens),
+                    "cached_tokens": round(cached_tokens),
+                    "cached_percent": round(100.0 * cached_tokens / prompt_tokens, 1) if prompt_tokens else 0.0
+                }
+                for version, (calls, prompt_tokens, cached_tokens) in self._prompt_usage.items()
+            },
+            "response_cache": self.cache.get_stats()
+        }
+
+    def _collect_metrics(self) -> List[MetricSample]:
+        samples = [
+            MetricSample("medai_llm_in_flight", self._in_flight, {}, "gauge", "LLM calls currently in flight"),
+            MetricSample("medai_llm_waiting", sum(1 for waiter in self._waiters if not waiter[2].done()), {},
+                         "gauge", "LLM calls waiting for admission")
+        ]
+        for (name, caller, model, kind), value in self._counters.items():
+            if name == "medai_llm_tokens_total":
+                samples.append(MetricSample(name, value, {"caller": caller, "model": model, "kind": kind},
+                                            "counter", "LLM tokens by caller and kind"))
+            else:
+                samples.append(MetricSample(name, value, {"caller": caller, "model": model},
+                                            "counter", "LLM call retries after transient errors"))
+        for version, (_, prompt_tokens, cached_tokens) in self._prompt_usage.items():
+            samples.append(MetricSample("medai_llm_prompt_tokens_total", cached_tokens, {"prompt": version, "kind": "cached"},
+                                        "counter", "Prompt tokens by template version and provider prefix-cache use"))
+            samples.append(MetricSample("medai_llm_prompt_tokens_total", prompt_tokens - cached_tokens, {"prompt": version, "kind": "uncached"},
+                                        "counter", "Prompt tokens by template version and provider prefix-cache use"))
+        return samples
+
+def _cached_prompt_tokens(usage: Any) -> float:
+    """Prompt tokens the provider served from its prefix cache (usage.prompt_tokens_details.cached_tokens)"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
+
+class LLMClient:
+    """Per-service handle onto the shared gateway"""
+
+    def __init__(self, gateway: LLMGateway, caller: str, priority: Priority):
+        self.gateway = gateway
+        self.caller = caller
+        self.priority = priority
+
+    @property
+    def available(self) -> bool:
+        return self.gateway.available
+
+    async def chat(self, messages: List[Dict[str, Any]], priority: Optional[Priority] = None, **params):
+        return await self.gateway.chat(self.caller, self.priority if priority is None else priority, messages, **params)
+
+    def chat_stream(self, messages: List[Dict[str, Any]], priority: Optional[Priority] = None, **params) -> AsyncIterator[str]:
+        return self.gateway.chat_stream(
+            self.caller, self.priority if priority is None else priority, messages, **params
+        )
+
+_gateway: Optional[LLMGateway] = None
+
+def get_llm_gateway() -> LLMGateway:
+    """The process-wide gateway, created on first use"""
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway()
+    return _gateway
@@ -0,0 +1,213 @@
+"""
+Prompt-response cache for deterministic LLM calls
+
+Completions are keyed by (model, normalised messages, sampling params). Two
+tiers are used:
+- an in-process LRU with a TTL
+- an optional SQLite table shared by every worker on the host
+
+The gateway only consults the cache for call sites that opt in. Prompts that
+embed patient-specific free text are never cached implicitly.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.metrics import MetricSample, register_collector
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Params that change the completion; anything else (timeouts, user ids) is ignored
+KEY_PARAMS = ("temperature", "max_tokens", "top_p", "stop", "presence_penalty", "frequency_penalty", "response_format")
+
+class CachedCompletion:
+    """The subset of a chat completion response that call sites read"""
+
+    def __init__(self, content: str, model: str):
+        self.model = model
+        self.choices = [SimpleNamespace(
+            index=0,
+            message=SimpleNamespace(role="assistant", content=content),
+            finish_reason="stop"
+        )]
+        self.usage = None
+        self.cached = True
+
+class LLMResponseCache:
+    """
+    TTL- and size-bounded completion cache
+
+    Args:
+        capacity: In-process entries (LLM_CACHE_SIZE)
+        ttl_s: Default entry lifetime (LLM_CACHE_TTL_S)
+        db_path: SQLite file for the shared tier; None disables it (LLM_CACHE_DB)
+        disk_capacity: Rows kept in the shared tier
+    """
+
+    def __init__(
+        self,
+        capacity: int = 2048,
+        ttl_s: float = 86400.0,
+        db_path: Optional[str] = None,
+        disk_capacity: int = 100000
+    ):
+        self.capacity = capacity
+        self.ttl_s = ttl_s
+        self.db_path = db_path
+        self.disk_capacity = disk_capacity
+
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # key -> (content, expires_at)
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        self.counts: Dict[Tuple[str, str], int] = {}  # (caller, result) -> lookups
+
+        if db_path:
+            self._init_database()
+
+        register_collector(self._collect_metrics)
+
+    def _init_database(self):
+        """Initialize the shared tier"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_llm_responses_expiry
+            ON llm_responses(expires_at)
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def _get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def key(self, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+        """Cache key, insensitive to prompt indentation and whitespace"""
+        normalised = [
+            {"role": message.get("role", "user"), "content": _WHITESPACE.sub(" ", str(message.get("content", ""))).strip()}
+            for message in messages
+        ]
+        payload = {
+            "model": model,
+            "messages": normalised,
+            "params": {name: params[name] for name in KEY_PARAMS if params.get(name) is not None}
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached completion text, checking memory then the shared tier"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    return entry[0]
+                del self._memory[key]
+
+        if not self.db_path:
+            return None
+        try:
+            conn = self._get_connection()
+            row = conn.execute(
+                "SELECT content, expires_at FROM llm_responses WHERE cache_key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM response cache read failed: {e}")
+            return None
+
+        if row is None:
+            return None
+        with self._lock:
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+    def put(self, key: str, model: str, content: str, ttl_s: Optional[float] = None):
+        """Store a completion in both tiers"""
+        now = time.time()
+        expires_at = now + (ttl_s or self.ttl_s)
+        with self._lock:
+            self._remember(key, content, expires_at)
+            self._puts += 1
+            prune = self._puts % 100 == 0
+
+        if not self.db_path:
+            return
+        try:
+            conn = self._get_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (cache_key, model, content, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, content, now, expires_at)
+            )
+            if prune:
+                # Drop expired rows, then the oldest beyond disk_capacity
+                conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (now,))
+                conn.execute('''
+                    DELETE FROM llm_responses WHERE cache_key IN (
+                        SELECT cache_key FROM llm_responses ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.disk_capacity,))
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM response cache write failed: {e}")
+
+    def _remember(self, key: str, content: str, expires_at: float):
+        self._memory[key] = (content, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def record(self, caller: str, result: str):
+        """Count a lookup outcome: hit, miss or coalesced"""
+        key = (caller, result)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lookup counters and sizes"""
+        totals = {"hit": 0, "miss": 0, "coalesced": 0}
+        for (_, result), count in self.counts.items():
+            totals[result] += count
+        lookups = sum(totals.values())
+        return {
+            **totals,
+            "hit_rate": round((totals["hit"] + totals["coalesced"]) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_capacity": self.capacity,
+            "ttl_s": self.ttl_s,
+            "disk_enabled": bool(self.db_path)
+        }
+
+    def _collect_metrics(self) -> List[MetricSample]:
+        samples = [
+            MetricSample("medai_llm_cache_lookups_total", count, {"caller": caller, "result": result},
+                         "counter", "Cacheable LLM calls by caller and result")
+            for (caller, result), count in self.counts.items()
+        ]
+        samples.append(MetricSample("medai_llm_cache_entries", len(self._memory), {},
+                                    "gauge", "Completions held in the in-process tier"))
+        return samples
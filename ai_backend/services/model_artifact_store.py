@@ -0,0 +1,127 @@
+"""
+Versioned model artifact store
+
+Each version is a directory of uncompressed joblib files plus metadata.json,
+written under a temporary name and renamed into place so readers never see a
+partial version. A LATEST pointer file names the version served by default.
+Loading with mmap_mode maps numpy arrays straight from the page cache, which
+makes loads fast and lets worker processes share the underlying pages.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Tuple
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+class ModelArtifactStore:
+    """Directory-backed store of versioned model artifacts"""
+
+    def __init__(self, root_dir: str, model_name: str):
+        self.root_dir = root_dir
+        self.model_name = model_name
+        self.model_dir = os.path.join(root_dir, model_name)
+
+    def _version_dir(self, version: str) -> str:
+        return os.path.join(self.model_dir, version)
+
+    def list_versions(self) -> List[str]:
+        """List stored versions, oldest first"""
+        if not os.path.isdir(self.model_dir):
+            return []
+        return sorted(
+            entry for entry in os.listdir(self.model_dir)
+            if not entry.startswith(".") and os.path.isfile(os.path.join(self.model_dir, entry, "metadata.json"))
+        )
+
+    def latest_version(self) -> Optional[str]:
+        """Get the version named by the LATEST pointer"""
+        try:
+            with open(os.path.join(self.model_dir, "LATEST"), "r") as f:
+                version = f.read().strip()
+            return version or None
+        except FileNotFoundError:
+            return None
+
+    def save(self, artifacts: Dict[str, Any], metadata: Dict[str, Any], promote: bool = True) -> str:
+        """
+        Save a new version atomically
+
+        Args:
+            artifacts: Mapping of artifact name to picklable object
+            metadata: Extra metadata stored alongside the artifacts
+            promote: Point LATEST at the new version
+
+        Returns:
+            The new version identifier
+        """
+        os.makedirs(self.model_dir, exist_ok=True)
+        version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+        staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=self.model_dir)
+        try:
+            for name, artifact in artifacts.items():
+                # Uncompressed so the arrays can be memory-mapped on load
+                joblib.dump(artifact, os.path.join(staging_dir, f"{name}.joblib"))
+
+            metadata = dict(metadata)
+            metadata.update({
+                "model_name": self.model_name,
+                "version": version,
+                "artifacts": sorted(artifacts),
+                "created_at": datetime.now().isoformat()
+            })
+            with open(os.path.join(staging_dir, "metadata.json"), "w") as f:
+                json.dump(metadata, f, indent=2)
+
+            os.rename(staging_dir, self._version_dir(version))
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        if promote:
+            self.promote(version)
+
+        logger.info(f"Saved {self.model_name} artifacts version {version}")
+        return version
+
+    def promote(self, version: str):
+        """Atomically point LATEST at an existing version"""
+        if not os.path.isdir(self._version_dir(version)):
+            raise ValueError(f"Unknown {self.model_name} version: {version}")
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".LATEST-", dir=self.model_dir)
+        with os.fdopen(fd, "w") as f:
+            f.write(version)
+        os.replace(tmp_path, os.path.join(self.model_dir, "LATEST"))
+
+    def load(self, version: Optional[str] = None, mmap_mode: Optional[str] = "r") -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Load a version (LATEST by default)
+
+        Returns:
+            (artifacts, metadata); metadata includes the load time in ms
+        """
+        version = version or self.latest_version()
+        if version is None:
+            raise FileNotFoundError(f"No stored artifacts for {self.model_name} in {self.model_dir}")
+
+        start_time = time.perf_counter()
+        version_dir = self._version_dir(version)
+        with open(os.path.join(version_dir, "metadata.json"), "r") as f:
+            metadata = json.load(f)
+
+        artifacts = {
+            name: joblib.load(os.path.join(version_dir, f"{name}.joblib"), mmap_mode=mmap_mode)
+            for name in metadata["artifacts"]
+        }
+        metadata["load_time_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
+
+        return artifacts, metadata
@@ -15,15 +15,13 @@ from sklearn.preprocessing import StandardScaler
 import joblib
 import os
 from datetime import datetime
-import openai
+
+from services.llm_gateway import Priority, get_llm_gateway
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load OpenAI API key from environment
-openai.api_key = os.getenv('OPENAI_API_KEY')
-
 class ExplanationType(Enum):
     LIME = "lime"
     SHAP = "shap"
@@ -61,6 +59,7 @@ class ModelExplainer:
         self.class_names = []
         self.explainer = None
         self.shap_explainer = None
+        self.llm = get_llm_gateway().client("model_explainer", Priority.STANDARD)
         
         if model_path and os.path.exists(model_path):
             self.load_model(model_path)
@@ -291,7 +290,7 @@ class ModelExplainer:
                                          prediction: int, confidence_score: float) -> Dict[str, Any]:
         """Generate explanation using OpenAI GPT-4"""
         try:
-            if not openai.api_key:
+            if not self.llm.available:
                 logger.warning("OpenAI API key not found, using fallback explanation")
                 return self._generate_fallback_explanation(np.array([[0]]))
             
@@ -318,7 +317,7 @@ class ModelExplainer:
             - recommendations: list of next steps
             """
             
-            response = await openai.ChatCompletion.acreate(
+            response = await self.llm.chat(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "You are a medical AI assistant providing clear, accurate explanations of diagnoses."},
@@ -667,7 +666,7 @@ class ModelExplainer:
             'classes': self.class_names,
             'features': self.feature_names,
             'explanation_types': [e.value for e in ExplanationType],
-            'openai_available': bool(openai.api_key)
+            'openai_available': self.llm.available
         }
 
 # Global instance for easy access
@@ -0,0 +1,181 @@
+"""
+Model lifecycle management
+
+Services register a blocking loader per model instead of firing an orphaned
+load task from __init__. Each model moves through unloaded -> loading ->
+ready (or failed). Loads run in a worker thread, start at application
+startup or on first use depending on policy, and callers await readiness
+with a timeout so early requests wait briefly instead of hitting None.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ModelState(Enum):
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+class LoadPolicy(Enum):
+    STARTUP = "startup"  # load when the application starts
+    LAZY = "lazy"  # load on first use
+
+class ModelUnavailableError(RuntimeError):
+    """A model failed to load or did not become ready in time"""
+
+def _process_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _tensor_bytes(value: Any) -> int:
+    if hasattr(value, "element_size"):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        # Quantised Linear layers store packed (weight, bias) tuples
+        return sum(_tensor_bytes(item) for item in value)
+    return 0
+
+def _model_bytes(model: Any) -> Optional[int]:
+    """State-dict bytes for torch modules, including wrappers exposing .model"""
+    module = getattr(model, "model", model)
+    if not hasattr(module, "state_dict"):
+        return None
+    try:
+        return sum(_tensor_bytes(value) for value in module.state_dict().values())
+    except Exception:
+        return None
+
+class ManagedModel:
+    """One lazily or eagerly loaded model and its lifecycle state"""
+
+    def __init__(self, name: str, loader: Callable[[], Any], policy: LoadPolicy, retry_after_s: float):
+        self.name = name
+        self.loader = loader
+        self.policy = policy
+        self.retry_after_s = retry_after_s
+
+        self.state = ModelState.UNLOADED
+        self.value: Any = None
+        self.error: Optional[str] = None
+        self.load_time_ms: Optional[float] = None
+        self.memory_bytes: Optional[int] = None
+        self.failed_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        """Begin loading unless already loading or ready (failed loads retry after a back-off)"""
+        if self.state in (ModelState.LOADING, ModelState.READY):
+            return self._task
+        if self.state == ModelState.FAILED and time.time() - self.failed_at < self.retry_after_s:
+            return self._task
+
+        self.state = ModelState.LOADING
+        self.error = None
+        self._task = asyncio.create_task(self._load())
+        return self._task
+
+    async def _load(self):
+        loop = asyncio.get_running_loop()
+        rss_before = _process_rss_bytes()
+        start_time = time.perf_counter()
+        try:
+            value = await loop.run_in_executor(None, self.loader)
+        except Exception as e:
+            self.state = ModelState.FAILED
+            self.error = str(e)
+            self.failed_at = time.time()
+            logger.error(f"Model {self.name} failed to load: {e}")
+            return
+
+        self.load_time_ms = round((time.perf_counter() - start_time) * 1000, 2)
+        rss_after = _process_rss_bytes()
+        # State-dict bytes when measurable; otherwise the (approximate) RSS growth
+        self.memory_bytes = _model_bytes(value)
+        if self.memory_bytes is None and rss_before is not None and rss_after is not None:
+            self.memory_bytes = max(0, rss_after - rss_before)
+        self.value = value
+        self.state = ModelState.READY
+        logger.info(f"Model {self.name} ready in {self.load_time_ms} ms")
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state.value,
+            "policy": self.policy.value,
+            "load_time_ms": self.load_time_ms,
+            "memory_mb": round(self.memory_bytes / 2 ** 20, 1) if self.memory_bytes is not None else None,
+            "error": self.error
+        }
+
+class ModelLifecycleManager:
+    """
+    Registry of a service's models
+
+    Args:
+        service_name: Used in logs and status
+        policy: Default load policy ("startup" or "lazy"); MODEL_LOAD_POLICY overrides
+        wait_timeout_s: How long get()/wait_ready() wait for a loading model
+        retry_after_s: Back-off before a failed model is loaded again on use
+    """
+
+    def __init__(
+        self,
+        service_name: str,
+        policy: Optional[str] = None,
+        wait_timeout_s: float = 30.0,
+        retry_after_s: float = 60.0
+    ):
+        self.service_name = service_name
+        self.policy = LoadPolicy(policy or os.getenv("MODEL_LOAD_POLICY", LoadPolicy.STARTUP.value))
+        self.wait_timeout_s = wait_timeout_s
+        self.retry_after_s = retry_after_s
+        self.models: Dict[str, ManagedModel] = {}
+
+    def register(self, name: str, loader: Callable[[], Any], policy: Optional[str] = None):
+        """Register a blocking loader; it runs in a worker thread"""
+        self.models[name] = ManagedModel(
+            name, loader, LoadPolicy(policy) if policy else self.policy, self.retry_after_s
+        )
+
+    async def start(self):
+        """Kick off loading for startup-policy models (called from the app startup hook)"""
+        for model in self.models.values():
+            if model.policy == LoadPolicy.STARTUP:
+                model.start()
+
+    async def get(self, name: str, timeout: Optional[float] = None) -> Any:
+        """Return a ready model, loading it on first use and waiting up to timeout"""
+        model = self.models[name]
+        if model.state != ModelState.READY:
+            task = model.start()
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout or self.wait_timeout_s)
+            except asyncio.TimeoutError:
+                raise ModelUnavailableError(f"{self.service_name}: model {name} is still loading")
+
+        if model.state != ModelState.READY:
+            raise ModelUnavailableError(f"{self.service_name}: model {name} failed to load: {model.error}")
+        return model.value
+
+    async def wait_ready(self, names: Optional[List[str]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Wait for several models concurrently; returns name -> model"""
+        names = names or list(self.models)
+        values = await asyncio.gather(*(self.get(name, timeout) for name in names))
+        return dict(zip(names, values))
+
+    def is_ready(self, names: Optional[List[str]] = None) -> bool:
+        names = names or list(self.models)
+        return all(self.models[name].state == ModelState.READY for name in names)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Per-model state, load time and memory"""
+        return {name: model.get_status() for name, model in self.models.items()}
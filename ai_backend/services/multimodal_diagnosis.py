@@ -2,8 +2,10 @@ import asyncio
 import json
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, AsyncIterator
 import numpy as np
 from PIL import Image
 import io
@@ -12,12 +14,19 @@ import base64
 # AI/ML imports
 import torch
 import torch.nn as nn
-from transformers import AutoTokenizer, AutoModel
-import openai
-from openai import AsyncOpenAI
+from transformers import AutoModel
+
+from services.embedding_cache import EmbeddingCache
+from services.llm_gateway import Priority, get_llm_gateway
+from services.text_encoder import TextEncoder
+from services.model_lifecycle import ModelLifecycleManager
 
 logger = logging.getLogger(__name__)
 
+TEXT_ENCODER_MODEL = "microsoft/BiomedNLP-PubMedBERT-base-uncased-abstract"
+IMAGE_ENCODER_MODEL = "microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224"
+EMBEDDING_DIM = 768
+
 class MultimodalDiagnosisService:
     """
     Multimodal AI diagnosis service that combines:
@@ -28,7 +37,7 @@ class MultimodalDiagnosisService:
     """
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_llm_gateway().client("multimodal_diagnosis", Priority.INTERACTIVE)
         self.model_version = "v1.3.7"
         self.confidence_threshold = 0.75
         
@@ -37,27 +46,52 @@ class MultimodalDiagnosisService:
         self.image_encoder = None
         self.fusion_model = None
         
-        # Load models asynchronously
-        asyncio.create_task(self._load_models())
+        # Text and image encoders run side by side off the event loop
+        self.encoder_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("MULTIMODAL_ENCODER_WORKERS", 2)),
+            thread_name_prefix="multimodal-encoder"
+        )
+        
+        # Encoder outputs keyed by normalised text / image hash; set
+        # EMBEDDING_CACHE_DIR to share a memory-mapped tier across workers
+        cache_options = {
+            "dim": EMBEDDING_DIM,
+            "capacity": int(os.getenv("EMBEDDING_CACHE_SIZE", 4096)),
+            "disk_dir": os.getenv("EMBEDDING_CACHE_DIR"),
+            "disk_slots": int(os.getenv("EMBEDDING_CACHE_DISK_SLOTS", 65536))
+        }
+        self.text_cache = EmbeddingCache("multimodal_text", TEXT_ENCODER_MODEL, **cache_options)
+        self.image_cache = EmbeddingCache("multimodal_image", IMAGE_ENCODER_MODEL, **cache_options)
+        
+        # Models load at startup or on first use (MODEL_LOAD_POLICY); requests await readiness
+        self.models = ModelLifecycleManager("multimodal", wait_timeout_s=float(os.getenv("MODEL_WAIT_TIMEOUT_S", 30)))
+        self.models.register("text_encoder", self._load_text_encoder)
+        self.models.register("image_encoder", self._load_image_encoder)
+        self.models.register("fusion_model", self._load_fusion_model)
     
-    async def _load_models(self):
-        """Load multimodal models asynchronously"""
-        try:
-            # Initialize text encoder (for symptoms and lab data)
-            self.text_encoder = AutoModel.from_pretrained("microsoft/BiomedNLP-PubMedBERT-base-uncased-abstract")
-            self.text_tokenizer = AutoTokenizer.from_pretrained("microsoft/BiomedNLP-PubMedBERT-base-uncased-abstract")
-            
-            # Initialize image encoder (for medical scans)
-            self.image_encoder = AutoModel.from_pretrained("microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224")
-            
-            # Initialize fusion model for combining modalities
-            self.fusion_model = self._create_fusion_model()
-            
-            logger.info("Multimodal models loaded successfully")
-            
-        except Exception as e:
-            logger.error(f"Error loading multimodal models: {e}")
-            raise
+    def _load_text_encoder(self) -> TextEncoder:
+        """Initialize text encoder (for symptoms and lab data)"""
+        # int8 weights and length-bucketed micro-batching for CPU serving
+        text_encoder = TextEncoder(
+            TEXT_ENCODER_MODEL,
+            quantize=os.getenv("TEXT_ENCODER_QUANTIZE", "true").lower() == "true",
+            max_batch_size=int(os.getenv("TEXT_ENCODER_MAX_BATCH", 16)),
+            max_wait_ms=float(os.getenv("TEXT_ENCODER_MAX_WAIT_MS", 5)),
+            executor=self.encoder_executor
+        )
+        text_encoder.load()
+        self.text_encoder = text_encoder
+        return text_encoder
+    
+    def _load_image_encoder(self):
+        """Initialize image encoder (for medical scans)"""
+        self.image_encoder = AutoModel.from_pretrained(IMAGE_ENCODER_MODEL)
+        return self.image_encoder
+    
+    def _load_fusion_model(self):
+        """Initialize fusion model for combining modalities"""
+        self.fusion_model = self._create_fusion_model()
+        return self.fusion_model
     
     def _create_fusion_model(self):
         """Create fusion model to combine text and image features"""
@@ -84,7 +118,7 @@ class MultimodalDiagnosisService:
     async def analyze_multimodal(
         self,
         symptoms: str,
-        images: List[Dict[str, Any]] = None,  # List of {image_data, image_type, metadata}
+        images: List[Dict[str, Any]] = None,  # List of {image_data, image_type, metadata}; image_data is bytes, an array or base64
         lab_data: Dict[str, Any] = None,
         patient_demographics: Dict[str, Any] = None,
         medical_history: str = None
@@ -103,45 +137,119 @@ class MultimodalDiagnosisService:
             Unified diagnosis with confidence scores and explanations
         """
         try:
-            # Step 1: Process text inputs (symptoms, lab data, history)
-            text_features = await self._process_text_inputs(
-                symptoms, lab_data, medical_history
-            )
-            
-            # Step 2: Process medical images
-            image_features = await self._process_images(images) if images else None
-            
-            # Step 3: Combine modalities for unified diagnosis
-            diagnosis_result = await self._generate_unified_diagnosis(
-                text_features, image_features, patient_demographics
+            diagnosis_result, timings = await self._run_diagnosis(
+                symptoms, images, lab_data, patient_demographics, medical_history
             )
             
             # Step 4: Generate detailed explanation
+            explanation_start = time.perf_counter()
             explanation = await self._generate_patient_explanation(
                 diagnosis_result, symptoms, patient_demographics
             )
+            timings["explanation_ms"] = self._elapsed_ms(explanation_start)
             
             return {
-                "diagnosis": diagnosis_result["primary_diagnosis"],
-                "confidence": diagnosis_result["confidence"],
-                "differential_diagnoses": diagnosis_result["differential_diagnoses"],
-                "recommended_tests": diagnosis_result["recommended_tests"],
-                "urgency_level": diagnosis_result["urgency_level"],
+                **self._format_diagnosis(diagnosis_result, images, lab_data),
                 "explanation": explanation,
-                "model_version": self.model_version,
-                "timestamp": datetime.now().isoformat(),
-                "modalities_used": self._get_modalities_used(images, lab_data)
+                "timings": timings
             }
             
         except Exception as e:
             logger.error(f"Error in multimodal analysis: {e}")
             raise
     
+    async def analyze_multimodal_stream(
+        self,
+        symptoms: str,
+        images: List[Dict[str, Any]] = None,
+        lab_data: Dict[str, Any] = None,
+        patient_demographics: Dict[str, Any] = None,
+        medical_history: str = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of analyze_multimodal
+        
+        Yields {"event", "data"} items: one "diagnosis" event with the
+        structured fields as soon as fusion finishes, "explanation" events
+        with text deltas as GPT produces them, then "done" with timings.
+        """
+        diagnosis_result, timings = await self._run_diagnosis(
+            symptoms, images, lab_data, patient_demographics, medical_history
+        )
+        yield {
+            "event": "diagnosis",
+            "data": {**self._format_diagnosis(diagnosis_result, images, lab_data), "timings": dict(timings)}
+        }
+        
+        explanation_start = time.perf_counter()
+        async for delta in self._stream_patient_explanation(diagnosis_result, symptoms, patient_demographics):
+            if "explanation_first_token_ms" not in timings:
+                timings["explanation_first_token_ms"] = self._elapsed_ms(explanation_start)
+            yield {"event": "explanation", "data": {"delta": delta}}
+        timings["explanation_ms"] = self._elapsed_ms(explanation_start)
+        
+        yield {"event": "done", "data": {"timings": timings}}
+    
+    async def _run_diagnosis(
+        self,
+        symptoms: str,
+        images: Optional[List[Dict[str, Any]]],
+        lab_data: Optional[Dict[str, Any]],
+        patient_demographics: Optional[Dict[str, Any]],
+        medical_history: Optional[str]
+    ) -> tuple:
+        """Steps 1-3: encode every modality and fuse them; returns (diagnosis_result, timings)"""
+        timings = {}
+        
+        # Wait (briefly) for the models this request needs
+        ready_start = time.perf_counter()
+        await self.models.wait_ready(
+            ["text_encoder", "fusion_model"] + (["image_encoder"] if images else [])
+        )
+        timings["model_wait_ms"] = self._elapsed_ms(ready_start)
+        
+        encoding_start = time.perf_counter()
+        
+        # Steps 1-2: Encode text (symptoms, lab data, history) and images concurrently
+        text_features, image_features = await asyncio.gather(
+            self._process_text_inputs(symptoms, lab_data, medical_history, timings),
+            self._process_images(images, timings) if images else self._no_images()
+        )
+        timings["encoding_ms"] = self._elapsed_ms(encoding_start)
+        
+        # Step 3: Combine modalities for unified diagnosis
+        fusion_start = time.perf_counter()
+        diagnosis_result = await self._generate_unified_diagnosis(
+            text_features, image_features, patient_demographics
+        )
+        timings["fusion_ms"] = self._elapsed_ms(fusion_start)
+        
+        return diagnosis_result, timings
+    
+    def _format_diagnosis(
+        self,
+        diagnosis_result: Dict[str, Any],
+        images: Optional[List[Dict[str, Any]]],
+        lab_data: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Structured response fields shared by the plain and streaming endpoints"""
+        return {
+            "diagnosis": diagnosis_result["primary_diagnosis"],
+            "confidence": diagnosis_result["confidence"],
+            "differential_diagnoses": diagnosis_result["differential_diagnoses"],
+            "recommended_tests": diagnosis_result["recommended_tests"],
+            "urgency_level": diagnosis_result["urgency_level"],
+            "model_version": self.model_version,
+            "timestamp": datetime.now().isoformat(),
+            "modalities_used": self._get_modalities_used(images, lab_data)
+        }
+    
     async def _process_text_inputs(
         self, 
         symptoms: str, 
         lab_data: Dict[str, Any] = None, 
-        medical_history: str = None
+        medical_history: str = None,
+        timings: Optional[Dict[str, float]] = None
     ) -> torch.Tensor:
         """Process text inputs using medical BERT"""
         try:
@@ -153,19 +261,17 @@ class MultimodalDiagnosisService:
             if medical_history:
                 text_input += f" Medical History: {medical_history}"
             
-            # Tokenize and encode
-            inputs = self.text_tokenizer(
-                text_input,
-                return_tensors="pt",
-                max_length=512,
-                truncation=True,
-                padding=True
-            )
-            
-            with torch.no_grad():
-                outputs = self.text_encoder(**inputs)
-                # Use [CLS] token representation
-                text_features = outputs.last_hidden_state[:, 0, :]
+            start_time = time.perf_counter()
+            cache_key = self.text_cache.text_key(text_input)
+            cached = self.text_cache.get(cache_key)
+            if cached is not None:
+                text_features = torch.from_numpy(cached).unsqueeze(0)
+            else:
+                # Concurrent requests share length-bucketed forward passes
+                text_features = await self.text_encoder.encode(text_input)
+                self.text_cache.put(cache_key, text_features[0].numpy())
+            if timings is not None:
+                timings["text_encoding_ms"] = self._elapsed_ms(start_time)
             
             return text_features
             
@@ -173,38 +279,84 @@ class MultimodalDiagnosisService:
             logger.error(f"Error processing text inputs: {e}")
             raise
     
-    async def _process_images(self, images: List[Dict[str, Any]]) -> torch.Tensor:
+    async def _no_images(self) -> None:
+        return None
+    
+    async def _process_images(
+        self,
+        images: List[Dict[str, Any]],
+        timings: Optional[Dict[str, float]] = None
+    ) -> Optional[torch.Tensor]:
         """Process medical images using vision transformer"""
         try:
-            image_features_list = []
+            start_time = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            image_features = await loop.run_in_executor(self.encoder_executor, self._encode_images, images)
+            if timings is not None:
+                timings["image_encoding_ms"] = self._elapsed_ms(start_time)
+                timings["image_count"] = len(images)
             
-            for image_data in images:
-                # Decode image data
-                if isinstance(image_data["image_data"], str):
-                    # Base64 encoded
-                    image_bytes = base64.b64decode(image_data["image_data"])
-                else:
-                    image_bytes = image_data["image_data"]
+            return image_features
                 
+        except Exception as e:
+            logger.error(f"Error processing images: {e}")
+            raise
+    
+    def _encode_images(self, images: List[Dict[str, Any]]) -> Optional[torch.Tensor]:
+        """
+        Decode and preprocess every uncached image, then encode them in one batch
+        
+        Runs in the encoder executor. Returns the mean image embedding with
+        shape (1, dim), matching the text features.
+        """
+        embeddings: List[Optional[torch.Tensor]] = []
+        misses = []
+        for index, image_data in enumerate(images):
+            # Cached images skip decoding and encoding entirely
+            cache_key = self.image_cache.image_key(image_data["image_data"])
+            cached = self.image_cache.get(cache_key)
+            embeddings.append(torch.from_numpy(cached) if cached is not None else None)
+            if cached is None:
+                misses.append((index, cache_key, image_data))
+        
+        if misses:
+            pixel_batches = []
+            for _, _, image_data in misses:
                 # Load and preprocess image
-                image = Image.open(io.BytesIO(image_bytes))
+                image = self._load_image(image_data["image_data"])
                 image = self._preprocess_image(image)
                 
-                # Encode image
-                with torch.no_grad():
-                    inputs = self.image_encoder.preprocess(image)
-                    outputs = self.image_encoder.encode_image(inputs)
-                    image_features_list.append(outputs)
+                pixels = self.image_encoder.preprocess(image)
+                pixel_batches.append(pixels.unsqueeze(0) if pixels.dim() == 3 else pixels)
             
-            # Average features from multiple images
-            if image_features_list:
-                return torch.mean(torch.stack(image_features_list), dim=0)
-            else:
-                return None
-                
-        except Exception as e:
-            logger.error(f"Error processing images: {e}")
-            raise
+            # Single forward pass over every uncached image
+            with torch.no_grad():
+                outputs = self.image_encoder.encode_image(torch.cat(pixel_batches, dim=0))
+            
+            for (index, cache_key, _), output in zip(misses, outputs):
+                embeddings[index] = output
+                self.image_cache.put(cache_key, output.numpy())
+        
+        if not embeddings:
+            return None
+        
+        # Average features from multiple images
+        return torch.mean(torch.stack(embeddings), dim=0, keepdim=True)
+    
+    def _elapsed_ms(self, start_time: float) -> float:
+        return round((time.perf_counter() - start_time) * 1000, 2)
+    
+    def _load_image(self, image_data: Any) -> Image.Image:
+        """Open raw upload bytes, a decoded array or a base64 string (JSON clients)"""
+        if isinstance(image_data, Image.Image):
+            return image_data
+        if isinstance(image_data, np.ndarray):
+            return Image.fromarray(image_data)
+        if isinstance(image_data, str):
+            image_data = base64.b64decode(image_data)
+        
+        # BytesIO shares the bytes buffer, so decoding makes no extra copy
+        return Image.open(io.BytesIO(image_data))
     
     def _preprocess_image(self, image: Image.Image) -> Image.Image:
         """Preprocess image for medical vision model"""
@@ -249,7 +401,7 @@ class MultimodalDiagnosisService:
             
             # Generate diagnosis using fusion model
             with torch.no_grad():
-                logits = self.fusion_model(text_features, image_features) if image_features else text_features
+                logits = self.fusion_model(text_features, image_features) if image_features is not None else text_features
                 probabilities = torch.softmax(logits, dim=1)
             
             # Get top diagnoses
@@ -291,15 +443,13 @@ class MultimodalDiagnosisService:
             logger.error(f"Error generating unified diagnosis: {e}")
             raise
     
-    async def _generate_patient_explanation(
+    def _build_explanation_prompt(
         self,
         diagnosis_result: Dict[str, Any],
         symptoms: str,
         patient_demographics: Dict[str, Any]
     ) -> str:
-        """Generate patient-friendly explanation using GPT"""
-        try:
-            prompt = f"""
+        return f"""
             As a medical AI assistant, explain the diagnosis to a patient in simple terms.
             
             Patient Symptoms: {symptoms}
@@ -315,8 +465,18 @@ class MultimodalDiagnosisService:
             
             Keep the language simple and avoid medical jargon.
             """
+    
+    async def _generate_patient_explanation(
+        self,
+        diagnosis_result: Dict[str, Any],
+        symptoms: str,
+        patient_demographics: Dict[str, Any]
+    ) -> str:
+        """Generate patient-friendly explanation using GPT"""
+        try:
+            prompt = self._build_explanation_prompt(diagnosis_result, symptoms, patient_demographics)
             
-            response = await self.client.chat.completions.create(
+            response = await self.llm.chat(
                 model="gpt-4",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=500,
@@ -329,6 +489,33 @@ class MultimodalDiagnosisService:
             logger.error(f"Error generating patient explanation: {e}")
             return "Unable to generate explanation at this time."
     
+    async def _stream_patient_explanation(
+        self,
+        diagnosis_result: Dict[str, Any],
+        symptoms: str,
+        patient_demographics: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        """Stream the patient-friendly explanation as GPT produces it"""
+        streamed = False
+        try:
+            prompt = self._build_explanation_prompt(diagnosis_result, symptoms, patient_demographics)
+            
+            stream = self.llm.chat_stream(
+                model="gpt-4",
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=500,
+                temperature=0.7
+            )
+            
+            async for delta in stream:
+                streamed = True
+                yield delta
+            
+        except Exception as e:
+            logger.error(f"Error streaming patient explanation: {e}")
+            if not streamed:
+                yield "Unable to generate explanation at this time."
+    
     def _get_diagnosis_names(self) -> List[str]:
         """Get list of diagnosis names (simplified)"""
         return [
@@ -394,9 +581,15 @@ class MultimodalDiagnosisService:
         """Get status of multimodal models"""
         return {
             "model_version": self.model_version,
+            "models": self.models.get_status(),
             "text_encoder_loaded": self.text_encoder is not None,
+            "text_encoder": self.text_encoder.get_stats() if self.text_encoder is not None else None,
             "image_encoder_loaded": self.image_encoder is not None,
             "fusion_model_loaded": self.fusion_model is not None,
             "confidence_threshold": self.confidence_threshold,
+            "embedding_cache": {
+                "text": self.text_cache.get_stats(),
+                "image": self.image_cache.get_stats()
+            },
             "last_updated": datetime.now().isoformat()
         } 
\ No newline at end of file
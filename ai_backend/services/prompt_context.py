@@ -0,0 +1,326 @@
+"""
+Token-aware context compaction for copilot prompts
+
+NoteContext fields grow without bound for long-history patients (every lab,
+every study, years of history). The ContextBuilder fits the clinical detail
+sections a task uses into that task's token budget:
+- tokens are counted locally with tiktoken, falling back to a character
+  estimate when the encoding is not available (set TIKTOKEN_CACHE_DIR on
+  offline hosts)
+- sections are ranked by a per-task weight plus their overlap with the chief
+  complaint and symptoms, and the budget is shared out in that order
+- lab, imaging and vitals entries keep abnormal and complaint-related results
+  first
+- medical history keeps the most recent entries verbatim and reduces older
+  ones to their first clause
+- compacted history is cached per patient
+
+Short safety-relevant fields (chief complaint, symptoms, medications,
+allergies) and the doctor's own notes are never compacted. Full versus sent
+tokens per endpoint are exported on /metrics.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # counts fall back to the character estimate
+    tiktoken = None
+
+from services.llm_gateway import CHARS_PER_TOKEN
+from utils.metrics import MetricSample, register_collector
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"[a-z0-9]+")
+_YEAR = re.compile(r"\b(?:19|20)\d{2}\b")
+_ENTRY_SPLIT = re.compile(r"\n+|(?<=[.;])\s+")
+_CLAUSE_SPLIT = re.compile(r"[,;(]|\.\s")
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "for", "from", "has", "had", "in", "is", "no", "not",
+    "of", "on", "or", "patient", "the", "to", "was", "with"
+}
+
+_NORMAL_STATUSES = {"normal", "negative", "unremarkable", "within normal limits", "wnl"}
+
+@dataclass
+class TaskProfile:
+    """Context budget for one copilot task"""
+    budget_tokens: int
+    weights: Dict[str, float]  # compressible NoteContext section -> base relevance
+
+TASK_PROFILES: Dict[str, TaskProfile] = {
+    "soap_note": TaskProfile(1500, {
+        "vital_signs": 1.0, "physical_exam": 1.0, "lab_results": 0.9, "scan_results": 0.8,
+        "medical_history": 0.6, "family_history": 0.3, "social_history": 0.3
+    }),
+    "visit_summary": TaskProfile(1200, {
+        "vital_signs": 0.8, "physical_exam": 1.0, "lab_results": 0.9, "scan_results": 0.9
+    }),
+    "diagnosis": TaskProfile(1500, {
+        "vital_signs": 0.9, "physical_exam": 1.0, "lab_results": 1.0, "scan_results": 0.9, "medical_history": 0.7
+    }),
+    "lab_suggestions": TaskProfile(800, {"vital_signs": 0.8, "physical_exam": 1.0, "medical_history": 0.7}),
+    "patient_explanation": TaskProfile(300, {"medical_history": 1.0}),
+    "follow_up": TaskProfile(600, {"medical_history": 1.0}),
+    "cpt_codes": TaskProfile(800, {"physical_exam": 1.0, "lab_results": 0.9, "scan_results": 0.9})
+}
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model("gpt-4")
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable, estimating tokens from length: {e}")
+        return None
+
+def count_tokens(text: str) -> int:
+    """GPT-4 token count of text, computed locally"""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def _terms(text: str) -> set:
+    return {word for word in _WORD.findall(text.lower()) if len(word) > 2 and word not in _STOPWORDS}
+
+def _render(value: Any) -> str:
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return ", ".join(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return "" if value is None else str(value)
+
+class ContextBuilder:
+    """
+    Per-task context compaction with a per-patient history cache
+
+    Args:
+        profiles: Task budgets and section weights; defaults to TASK_PROFILES
+        cache_size: Compacted histories kept in memory (CONTEXT_CACHE_SIZE)
+    """
+
+    def __init__(self, profiles: Optional[Dict[str, TaskProfile]] = None, cache_size: Optional[int] = None):
+        self.profiles = profiles or TASK_PROFILES
+        self.cache_size = cache_size or int(os.getenv("CONTEXT_CACHE_SIZE", "1024"))
+
+        self._history_cache: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self.usage: Dict[str, List[int]] = {}  # endpoint -> [calls, full tokens, sent tokens]
+
+        register_collector(self._collect_metrics)
+
+    def compact(self, context: Any, task: str) -> Dict[str, str]:
+        """
+        Rendered sections of a NoteContext for one task, within its budget
+
+        Returns section name -> prompt text for every section in the task's
+        profile; sections that fit are rendered unchanged.
+        """
+        profile = self.profiles[task]
+        rendered = {name: _render(getattr(context, name, None)) for name in profile.weights}
+        tokens = {name: count_tokens(text) for name, text in rendered.items()}
+        full_tokens = sum(tokens.values())
+
+        if full_tokens > profile.budget_tokens:
+            query = _terms(f"{context.chief_complaint} {' '.join(context.symptoms or [])}")
+            scores = {
+                name: weight * (1 + self._overlap(rendered[name], query))
+                for name, weight in profile.weights.items()
+            }
+            allocation = self._allocate(tokens, scores, profile.budget_tokens)
+            for name, limit in allocation.items():
+                if tokens[name] <= limit:
+                    continue
+                value = getattr(context, name)
+                if name == "medical_history":
+                    rendered[name] = self._compact_history(context.patient_id, rendered[name], limit, query)
+                elif isinstance(value, dict):
+                    rendered[name] = self._compact_results(value, limit, query)
+                else:
+                    rendered[name] = self._compact_text(rendered[name], limit, query)
+
+        sent_tokens = sum(count_tokens(text) for text in rendered.values())
+        with self._lock:
+            usage = self.usage.setdefault(task, [0, 0, 0])
+            usage[0] += 1
+            usage[1] += full_tokens
+            usage[2] += sent_tokens
+        return rendered
+
+    def _overlap(self, text: str, query: set) -> float:
+        if not query:
+            return 0.0
+        return len(query & _terms(text)) / len(query)
+
+    def _allocate(self, tokens: Dict[str, int], scores: Dict[str, float], budget: int) -> Dict[str, int]:
+        """Share the budget by score; sections needing less than their share pass the rest on"""
+        allocation = {}
+        remaining = {name for name, count in tokens.items() if count > 0}
+        left = budget
+        while remaining:
+            total = sum(scores[name] for name in remaining) or 1.0
+            fits = [name for name in remaining if tokens[name] <= left * scores[name] / total]
+            if not fits:
+                for name in remaining:
+                    allocation[name] = int(left * scores[name] / total)
+                break
+            for name in fits:
+                allocation[name] = tokens[name]
+                left -= tokens[name]
+                remaining.discard(name)
+        return allocation
+
+    def _compact_results(self, results: Dict[str, Any], limit: int, query: set) -> str:
+        """Keep abnormal and complaint-related results first, in their original order"""
+        def rank(item: Tuple[int, Tuple[str, Any]]) -> Tuple[int, int]:
+            index, (key, value) = item
+            status = str(value.get("status") or value.get("flag") or "").lower() if isinstance(value, dict) else ""
+            abnormal = bool(status) and status not in _NORMAL_STATUSES
+            related = bool(query & _terms(f"{key} {_render(value)}"))
+            return (-(2 * abnormal + related), index)
+
+        ranked = sorted(enumerate(results.items()), key=rank)
+        kept = []
+        used = count_tokens("{} (+0 more results omitted)")
+        for index, (key, value) in ranked:
+            cost = count_tokens(json.dumps({key: value}))
+            if used + cost > limit:
+                continue
+            kept.append((index, key, value))
+            used += cost
+
+        kept.sort()
+        text = json.dumps({key: value for _, key, value in kept})
+        omitted = len(results) - len(kept)
+        return f"{text} (+{omitted} more results omitted)" if omitted else text
+
+    def _compact_text(self, text: str, limit: int, query: set) -> str:
+        """Keep the sentences most related to the complaint, in their original order"""
+        sentences = [s.strip() for s in _ENTRY_SPLIT.split(text) if s.strip()]
+        ranked = sorted(range(len(sentences)), key=lambda i: (-len(query & _terms(sentences[i])), i))
+        kept, used = [], count_tokens(" [...]")
+        for i in ranked:
+            cost = count_tokens(sentences[i]) + 1
+            if used + cost > limit:
+                continue
+            kept.append(i)
+            used += cost
+        return " ".join(sentences[i] for i in sorted(kept)) + (" [...]" if len(kept) < len(sentences) else "")
+
+    def _compact_history(self, patient_id: str, history: str, limit: int, query: set) -> str:
+        """Recent history verbatim, older entries as one-clause summaries; cached per patient"""
+        key = (patient_id, hashlib.sha1(history.encode("utf-8")).hexdigest(), limit, frozenset(query))
+        with self._lock:
+            cached = self._history_cache.get(key)
+            if cached is not None:
+                self._history_cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+
+        compacted = self._summarise_history(history, limit, query)
+
+        with self._lock:
+            self._history_cache[key] = compacted
+            while len(self._history_cache) > self.cache_size:
+                self._history_cache.popitem(last=False)
+        return compacted
+
+    def _summarise_history(self, history: str, limit: int, query: set) -> str:
+        # One entry per line when the history has lines, otherwise per sentence
+        lines = [line.strip() for line in history.splitlines() if line.strip()]
+        entries = lines if len(lines) > 1 else [e.strip() for e in _ENTRY_SPLIT.split(history) if e.strip()]
+
+        # Undated entries take the year of the nearest dated entry before them
+        years, year = [], 0
+        for entry in entries:
+            found = [int(y) for y in _YEAR.findall(entry)]
+            year = max(found) if found else year
+            years.append(year)
+        newest_first = sorted(range(len(entries)), key=lambda i: (years[i], i), reverse=True)
+
+        # Most recent entries verbatim, within roughly two thirds of the budget
+        recent, used = [], 0
+        for i in newest_first:
+            cost = count_tokens(entries[i]) + 1
+            if used + cost > limit * 2 // 3:
+                break
+            recent.append(i)
+            used += cost
+
+        # Older entries shrink to their first clause, complaint-related ones first
+        older = [i for i in newest_first if i not in recent]
+        older.sort(key=lambda i: (-len(query & _terms(entries[i])), newest_first.index(i)))
+        header = "Earlier history (summarised): "
+        used += count_tokens(header) + count_tokens(" (+00 older entries omitted)")
+        summaries = []
+        for i in older:
+            words = _CLAUSE_SPLIT.split(entries[i])[0].split()
+            clause = " ".join(words[:12]).rstrip(".")
+            cost = count_tokens(clause) + 1
+            if used + cost > limit:
+                continue
+            summaries.append((i, clause))
+            used += cost
+
+        parts = []
+        if summaries:
+            summaries.sort()
+            parts.append(header + "; ".join(clause for _, clause in summaries))
+        omitted = len(older) - len(summaries)
+        if omitted:
+            parts.append(f"(+{omitted} older entries omitted)")
+        parts.extend(entries[i] for i in sorted(recent))
+        return "\n".join(parts)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Prompt-token savings per endpoint and history cache counters"""
+        with self._lock:
+            endpoints = {
+                task: {
+                    "calls": calls,
+                    "full_tokens": full,
+                    "sent_tokens": sent,
+                    "saved_tokens": full - sent,
+                    "saved_percent": round(100.0 * (full - sent) / full, 1) if full else 0.0
+                }
+                for task, (calls, full, sent) in self.usage.items()
+            }
+            return {
+                "endpoints": endpoints,
+                "history_cache": {
+                    "hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                    "entries": len(self._history_cache)
+                },
+                "tokenizer": "tiktoken" if _encoding() is not None else "estimate"
+            }
+
+    def _collect_metrics(self) -> List[MetricSample]:
+        samples = []
+        with self._lock:
+            for task, (calls, full, sent) in self.usage.items():
+                samples.append(MetricSample("medai_prompt_context_tokens_total", full, {"endpoint": task, "kind": "full"},
+                                            "counter", "Copilot context tokens before and after compaction"))
+                samples.append(MetricSample("medai_prompt_context_tokens_total", sent, {"endpoint": task, "kind": "sent"},
+                                            "counter", "Copilot context tokens before and after compaction"))
+        return samples
@@ -0,0 +1,352 @@
+"""
+Versioned, cache-friendly prompt templates for copilot tasks
+
+Providers cache the longest prompt prefix they have seen recently (OpenAI
+from 1024 tokens, in 128-token steps) and bill and serve those tokens faster.
+A prefix only matches if it is byte-for-byte identical, so every template
+is laid out the same way:
+- system message: the copilot preamble shared by every task, then the task's
+  static instructions (no placeholders, checked at compile time)
+- user message: the variable data only, ordered from most to least stable
+  (patient history, then the visit, then the request's options), so
+  repeated calls for the same patient share as much prefix as possible
+
+Templates are compiled once at startup: dedented, validated and measured.
+Bump a template's version whenever its instructions change; calls are
+labelled name@vN, so cached-token and latency metrics stay comparable
+across versions.
+"""
+
+import hashlib
+import string
+from dataclasses import dataclass
+from typing import Dict, List, Set
+
+from services.prompt_context import count_tokens
+
+COPILOT_PREAMBLE = """
+You are a medical AI assistant supporting clinicians with documentation and clinical decision support.
+The task instructions come first; the patient information and request details follow in the user message.
+"""
+
+@dataclass
+class PromptTemplate:
+    """Source form of a task prompt"""
+    name: str
+    version: int
+    instructions: str  # static; appended to the preamble as the system message
+    context: str  # str.format template for the user message
+
+@dataclass
+class CompiledPrompt:
+    """A template ready to render: fixed system prefix plus a user-message template"""
+    name: str
+    version: int
+    system: str
+    user_template: str
+    fields: Set[str]
+    prefix_tokens: int
+    prefix_hash: str
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def render(self, **values: str) -> List[Dict[str, str]]:
+        """Chat messages for one call; raises KeyError for a missing field"""
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user_template.format(**values)}
+        ]
+
+def _normalise(text: str) -> str:
+    # Source templates are indented to match the code; the provider sees none of it
+    return "\n".join(line.strip() for line in text.strip().splitlines())
+
+def _fields(template: str) -> Set[str]:
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+
+def compile_template(template: PromptTemplate) -> CompiledPrompt:
+    """Dedent and validate a template and measure its static prefix"""
+    system = _normalise(COPILOT_PREAMBLE) + "\n\n" + _normalise(template.instructions)
+    if _fields(system):
+        raise ValueError(f"Prompt {template.name} has placeholders in its static prefix: {sorted(_fields(system))}")
+    user_template = _normalise(template.context)
+    fields = _fields(user_template)
+    if "" in fields or any(not field.isidentifier() for field in fields):
+        raise ValueError(f"Prompt {template.name} has unnamed or invalid placeholders")
+    return CompiledPrompt(
+        name=template.name,
+        version=template.version,
+        system=system,
+        user_template=user_template,
+        fields=fields,
+        prefix_tokens=count_tokens(system),
+        prefix_hash=hashlib.sha1(system.encode("utf-8")).hexdigest()[:12]
+    )
+
+def compile_templates(templates: Dict[str, PromptTemplate] = None) -> Dict[str, CompiledPrompt]:
+    """Compile every template; a broken template fails at startup rather than mid-request"""
+    templates = templates or COPILOT_TEMPLATES
+    return {name: compile_template(template) for name, template in templates.items()}
+
+# Patient-level sections shared by the templates that carry them, most stable first
+_PATIENT_HISTORY = """
+Patient ID: {patient_id}
+Medical History: {medical_history}
+Current Medications: {current_medications}
+Allergies: {allergies}
+"""
+
+COPILOT_TEMPLATES: Dict[str, PromptTemplate] = {
+    "soap_note": PromptTemplate(
+        name="soap_note",
+        version=1,
+        instructions="""
+        Generate a comprehensive SOAP note from the patient information and doctor's notes.
+
+        Please structure the response as:
+
+        SUBJECTIVE:
+        - Chief complaint
+        - History of present illness
+        - Review of systems
+        - Past medical history
+        - Medications and allergies
+        - Social and family history
+
+        OBJECTIVE:
+        - Vital signs
+        - Physical examination findings
+        - Lab results
+        - Imaging results
+
+        ASSESSMENT:
+        - Primary diagnosis
+        - Differential diagnoses
+        - Problem list
+
+        PLAN:
+        - Treatment plan
+        - Medications
+        - Follow-up recommendations
+        - Patient education
+
+        Ensure the note is:
+        1. Clinically accurate and evidence-based
+        2. Well-structured and professional
+        3. Complete and comprehensive
+        4. Appropriate for medical documentation
+
+        Follow the style preference given with the request.
+        """,
+        context=_PATIENT_HISTORY + """
+        Family History: {family_history}
+        Social History: {social_history}
+
+        Visit Date: {visit_date}
+        Chief Complaint: {chief_complaint}
+        Symptoms: {symptoms}
+        Vital Signs: {vital_signs}
+        Physical Examination: {physical_exam}
+        Lab Results: {lab_results}
+        Imaging Results: {scan_results}
+
+        Doctor's Notes: {doctor_notes}
+
+        Style preference: {style_preference}
+        """
+    ),
+    "visit_summary": PromptTemplate(
+        name="visit_summary",
+        version=1,
+        instructions="""
+        Create a summary of the patient visit, of the summary type given with the request.
+
+        The summary should include:
+        1. Key findings and observations
+        2. Clinical decisions made
+        3. Treatment plan initiated
+        4. Follow-up recommendations
+        5. Important patient education provided
+        6. Any concerns or red flags identified
+
+        Style: Professional, concise, and clinically relevant
+        """,
+        context="""
+        Visit Information:
+        - Date: {visit_date}
+        - Chief complaint: {chief_complaint}
+
+        Patient Data:
+        - Symptoms: {symptoms}
+        - Vital signs: {vital_signs}
+        - Physical exam: {physical_exam}
+        - Lab results: {lab_results}
+        - Imaging: {scan_results}
+
+        Doctor's notes: {doctor_notes}
+
+        Summary type: {summary_type}
+        """
+    ),
+    "lab_suggestions": PromptTemplate(
+        name="lab_suggestions",
+        version=1,
+        instructions="""
+        Suggest appropriate laboratory tests based on the clinical information.
+
+        Please suggest laboratory tests that are:
+        1. Clinically indicated based on symptoms and presentation
+        2. Evidence-based and guideline-recommended
+        3. Cost-effective and appropriate for the clinical setting
+        4. Prioritized by urgency and clinical importance
+
+        For each suggested test, provide:
+        - Test name and code
+        - Clinical rationale
+        - Expected results interpretation
+        - Urgency level (routine, urgent, stat)
+
+        Organize suggestions by:
+        - Essential tests (must have)
+        - Recommended tests (should have)
+        - Optional tests (consider if resources allow)
+        """,
+        context=_PATIENT_HISTORY + """
+        Chief complaint: {chief_complaint}
+        Symptoms: {symptoms}
+        Vital signs: {vital_signs}
+        Physical exam findings: {physical_exam}
+
+        Suspected conditions: {suspected_conditions}
+        """
+    ),
+    "diagnosis": PromptTemplate(
+        name="diagnosis",
+        version=1,
+        instructions="""
+        Provide diagnostic suggestions based on the clinical information.
+
+        Please provide:
+        1. Primary diagnosis with confidence level
+        2. Differential diagnoses (top 3-5 alternatives)
+        3. Clinical reasoning for each diagnosis
+        4. Red flags or concerning features
+        5. Recommended next steps for confirmation
+
+        Focus on:
+        - Evidence-based diagnostic criteria
+        - Clinical presentation patterns
+        - Risk factors and comorbidities
+        - Age and gender-specific considerations
+        """,
+        context=_PATIENT_HISTORY + """
+        Chief complaint: {chief_complaint}
+        Symptoms: {symptoms}
+        Vital signs: {vital_signs}
+        Physical exam findings: {physical_exam}
+        Lab results: {lab_results}
+        Imaging results: {scan_results}
+        """
+    ),
+    "patient_explanation": PromptTemplate(
+        name="patient_explanation",
+        version=1,
+        instructions="""
+        Explain the diagnosis to the patient in simple, understandable terms, at the education level and in the language given with the request.
+
+        Please provide an explanation that includes:
+        1. What the diagnosis means in simple terms
+        2. What caused this condition (if known)
+        3. What symptoms to expect
+        4. How it will be treated
+        5. What the patient can do to help themselves
+        6. When to seek immediate medical attention
+        7. What to expect in terms of recovery
+
+        Guidelines:
+        - Use simple, non-medical language
+        - Avoid jargon and complex medical terms
+        - Be encouraging but realistic
+        - Include practical advice
+        - Address common concerns and fears
+        - Provide hope and positive outlook when appropriate
+        """,
+        context="""
+        Age and relevant history: {medical_history}
+        Chief complaint: {chief_complaint}
+        Symptoms: {symptoms}
+
+        Diagnosis: {diagnosis}
+
+        Education level: {education_level}
+        Language: {language}
+        """
+    ),
+    "follow_up": PromptTemplate(
+        name="follow_up",
+        version=1,
+        instructions="""
+        Suggest a comprehensive follow-up plan for the case.
+
+        Please provide a follow-up plan that includes:
+        1. Recommended follow-up timeline
+        2. Monitoring parameters to track
+        3. Signs and symptoms to watch for
+        4. When to return for follow-up
+        5. When to seek immediate medical attention
+        6. Lifestyle modifications if applicable
+        7. Medication monitoring if applicable
+        8. Referral recommendations if needed
+
+        Consider:
+        - Standard of care for the diagnosis
+        - Patient's individual risk factors
+        - Treatment response monitoring
+        - Prevention of complications
+        - Patient education needs
+        """,
+        context="""
+        Medical history: {medical_history}
+        Current medications: {current_medications}
+
+        Chief complaint: {chief_complaint}
+        Diagnosis: {diagnosis}
+        Treatment initiated: {treatment_initiated}
+        """
+    ),
+    "cpt_codes": PromptTemplate(
+        name="cpt_codes",
+        version=1,
+        instructions="""
+        Suggest appropriate CPT codes for the visit.
+
+        Please suggest CPT codes for:
+        1. Evaluation and Management (E&M) codes based on visit complexity
+        2. Procedure codes if any procedures were performed
+        3. Lab test codes for ordered tests
+        4. Imaging codes for ordered studies
+
+        For each code, provide:
+        - CPT code and description
+        - Documentation requirements
+        - Modifiers if applicable
+        - Rationale for code selection
+
+        Ensure compliance with:
+        - CPT coding guidelines
+        - Documentation requirements
+        - Medical necessity criteria
+        """,
+        context="""
+        Chief complaint: {chief_complaint}
+        Physical exam findings: {physical_exam}
+        Lab tests ordered: {lab_results}
+        Imaging ordered: {scan_results}
+
+        Visit complexity: {visit_complexity}
+        Procedures performed: {procedures_performed}
+        """
+    )
+}
@@ -1,47 +1,266 @@
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-import joblib
+from sklearn.preprocessing import StandardScaler
+import os
+import threading
 import time
-from typing import Dict, List, Any, Optional
+import sklearn
+from typing import Dict, List, Any, Optional, Sequence
 import logging
-from models.response_models import RecoveryPrediction
+from models.response_models import RecoveryPrediction, RecoveryPredictionCase
+from services.model_artifact_store import ModelArtifactStore
+from services.compiled_forest import CompiledForest
 
 logger = logging.getLogger(__name__)
 
+# Bumped whenever feature preparation changes; stored artifacts with another
+# schema were trained on different features and must not be served
+FEATURE_SCHEMA_VERSION = 2
+
+# Column order of the model feature matrix
+FEATURE_NAMES = [
+    'age_norm', 'gender', 'scan_confidence', 'scan_severity',
+    'lab_abnormalities', 'lab_urgency', 'visit_frequency',
+    'diagnosis', 'symptoms_count'
+]
+
+# Ordinal codes shared by scan severity and lab urgency
+SEVERITY_CODES = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}
+
+# Vocabulary index reserved for categories not seen at training time
+UNKNOWN_CATEGORY = 0
+
+def _severity_code(level) -> float:
+    if level not in SEVERITY_CODES:
+        raise ValueError(f"unknown level {level!r}; expected one of {list(SEVERITY_CODES)}")
+    return float(SEVERITY_CODES[level])
+
+# Sweepable inputs for sensitivity analysis: input name -> (feature column, encoder)
+SWEEP_AXES = {
+    "patient_age": (FEATURE_NAMES.index("age_norm"), lambda age: (float(age) - 50) / 15),
+    "patient_gender": (FEATURE_NAMES.index("gender"), lambda gender: float(gender == "male")),
+    "scan_severity": (FEATURE_NAMES.index("scan_severity"), _severity_code),
+    "lab_abnormalities": (FEATURE_NAMES.index("lab_abnormalities"), float),
+    "lab_urgency": (FEATURE_NAMES.index("lab_urgency"), _severity_code),
+    "visit_frequency": (FEATURE_NAMES.index("visit_frequency"), float)
+}
+
+# Default per-tree quantiles reported in confidence_interval (lower, median, upper)
+DEFAULT_INTERVAL_QUANTILES = (0.1, 0.5, 0.9)
+
 class RecoveryPredictionService:
-    def __init__(self):
+    def __init__(self, artifact_dir: Optional[str] = None, model_version: Optional[str] = None, autoload: bool = True):
         self.model_status = "loading"
+        self.model_version = None
+        self.model_metadata: Dict[str, Any] = {}
         self.recovery_model = None
         self.complication_model = None
         self.scaler = None
-        self.label_encoder = None
-        self.symptom_encoder = None
-        self.diagnosis_encoder = None
-        self.load_models()
-        
-    def load_models(self):
-        """Load pre-trained recovery prediction models"""
+        self.diagnosis_vocabulary: Dict[str, int] = {}
+        # Guards the model set so scoring never sees a half-swapped version
+        self._swap_lock = threading.RLock()
+        # Flat-array forests for low-latency scoring; None falls back to sklearn
+        self.use_compiled_inference = os.getenv("RECOVERY_COMPILED_INFERENCE", "true").lower() == "true"
+        self.compiled_max_batch = int(os.getenv("RECOVERY_COMPILED_MAX_BATCH", 256))
+        self.compiled_recovery: Optional[CompiledForest] = None
+        self.compiled_complication: Optional[CompiledForest] = None
+        self.interval_quantiles = self._parse_quantiles(
+            os.getenv("RECOVERY_INTERVAL_QUANTILES", ",".join(str(q) for q in DEFAULT_INTERVAL_QUANTILES))
+        )
+        self.sweep_max_points = int(os.getenv("RECOVERY_SWEEP_MAX_POINTS", 100000))
+        # Each worker process holds its own models; follow LATEST unless pinned
+        self.follow_latest = model_version is None
+        self.refresh_interval_s = float(os.getenv("RECOVERY_MODEL_REFRESH_S", 30))
+        self._refresh_lock = threading.Lock()
+        self._last_refresh_check = time.monotonic()
+        self.artifact_store = ModelArtifactStore(
+            artifact_dir or os.getenv("RECOVERY_MODEL_DIR", "model_artifacts"), "recovery"
+        )
+        if autoload:
+            self.load_models(model_version)
+        
+    def load_models(self, version: Optional[str] = None):
+        """Load pre-trained recovery prediction models from the artifact store"""
         try:
-            # Initialize models (in production, these would be pre-trained)
-            self.recovery_model = RandomForestRegressor(n_estimators=100, random_state=42)
-            self.complication_model = RandomForestClassifier(n_estimators=100, random_state=42)
-            self.scaler = StandardScaler()
-            self.label_encoder = LabelEncoder()
-            self.symptom_encoder = LabelEncoder()
-            self.diagnosis_encoder = LabelEncoder()
+            try:
+                artifacts, metadata = self.artifact_store.load(version)
+            except FileNotFoundError:
+                artifacts, metadata = None, {}
             
-            # Train on synthetic data for demo (in production, use real medical data)
-            self._train_models()
+            if artifacts is None or metadata.get("feature_schema_version") != FEATURE_SCHEMA_VERSION:
+                # First start without usable artifacts: train once and persist so
+                # later starts (and other workers) load instead of retraining
+                logger.warning(
+                    "No compatible recovery model artifacts found; training in-process. "
+                    "Run `python -m services.recovery_prediction train` to build them offline."
+                )
+                self.train_models()
+                self._compile_models()
+                self.save_models()
+                self.model_status = "loaded"
+                return
             
+            if metadata.get("sklearn_version") != sklearn.__version__:
+                logger.warning(
+                    f"Recovery models were trained with scikit-learn {metadata.get('sklearn_version')}, "
+                    f"running {sklearn.__version__}"
+                )
+            
+            self._set_artifacts(artifacts)
+            self.model_version = metadata["version"]
+            self.model_metadata = metadata
             self.model_status = "loaded"
-            logger.info("Recovery prediction models loaded successfully")
+            logger.info(f"Recovery prediction models {self.model_version} loaded in {metadata['load_time_ms']} ms")
             
         except Exception as e:
             self.model_status = "error"
             logger.error(f"Failed to load recovery prediction models: {e}")
     
+    def _set_artifacts(self, artifacts: Dict[str, Any]):
+        compiled = artifacts.get("compiled_forests")
+        compiled_recovery, compiled_complication = self._compile_forests(
+            artifacts["recovery_model"],
+            artifacts["complication_model"],
+            CompiledForest.from_arrays(compiled["recovery_model"]) if compiled else None,
+            CompiledForest.from_arrays(compiled["complication_model"]) if compiled else None
+        )
+        
+        with self._swap_lock:
+            self.recovery_model = artifacts["recovery_model"]
+            self.complication_model = artifacts["complication_model"]
+            self.scaler = artifacts["scaler"]
+            self.diagnosis_vocabulary = artifacts["encoders"]["diagnosis_vocabulary"]
+            self.compiled_recovery = compiled_recovery
+            self.compiled_complication = compiled_complication
+    
+    def refresh_models(self, force: bool = False) -> bool:
+        """
+        Swap in the version LATEST names if another process promoted it
+        
+        A retraining round installs its models only in the worker that ran
+        it; the others pick the new version up here, at most once every
+        refresh_interval_s. Returns True when a new version was swapped in.
+        """
+        now = time.monotonic()
+        if not self.follow_latest or (not force and now - self._last_refresh_check < self.refresh_interval_s):
+            return False
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        
+        try:
+            self._last_refresh_check = now
+            latest = self.artifact_store.latest_version()
+            if latest is None or latest == self.model_version:
+                return False
+            
+            artifacts, metadata = self.artifact_store.load(latest)
+            if metadata.get("feature_schema_version") != FEATURE_SCHEMA_VERSION:
+                logger.warning(f"Recovery models {latest} use another feature schema; keeping {self.model_version}")
+                return False
+            
+            self._set_artifacts(artifacts)
+            self.model_version = metadata["version"]
+            self.model_metadata = metadata
+            self.model_status = "loaded"
+            logger.info(f"Recovery prediction models {self.model_version} reloaded in {metadata['load_time_ms']} ms")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to refresh recovery prediction models: {e}")
+            return False
+        finally:
+            self._refresh_lock.release()
+    
+    def _get_artifacts(self) -> Dict[str, Any]:
+        with self._swap_lock:
+            artifacts = {
+                "recovery_model": self.recovery_model,
+                "complication_model": self.complication_model,
+                "scaler": self.scaler,
+                "encoders": {
+                    "diagnosis_vocabulary": self.diagnosis_vocabulary
+                }
+            }
+            if self.compiled_recovery is not None:
+                artifacts["compiled_forests"] = {
+                    "recovery_model": self.compiled_recovery.to_arrays(),
+                    "complication_model": self.compiled_complication.to_arrays()
+                }
+        return artifacts
+    
+    def _compile_models(self):
+        """Compile the current forests and verify parity with sklearn"""
+        self.compiled_recovery, self.compiled_complication = self._compile_forests(
+            self.recovery_model, self.complication_model
+        )
+    
+    def _compile_forests(
+        self,
+        recovery_model,
+        complication_model,
+        compiled_recovery: Optional[CompiledForest] = None,
+        compiled_complication: Optional[CompiledForest] = None
+    ) -> tuple:
+        """Compile both forests (unless given precompiled) and check parity; (None, None) disables"""
+        if not self.use_compiled_inference:
+            return None, None
+        
+        try:
+            if compiled_recovery is None or compiled_complication is None:
+                compiled_recovery = CompiledForest.from_sklearn(recovery_model)
+                compiled_complication = CompiledForest.from_sklearn(complication_model, positive_class=1)
+            
+            probe = np.random.default_rng(0).normal(size=(64, len(FEATURE_NAMES)))
+            compiled_recovery.check_parity(recovery_model, probe)
+            compiled_complication.check_parity(complication_model, probe)
+            return compiled_recovery, compiled_complication
+        except Exception as e:
+            logger.warning(f"Compiled recovery inference disabled: {e}")
+            return None, None
+    
+    def install_models(self, artifacts: Dict[str, Any], metadata: Optional[Dict[str, Any]] = None, promote: bool = True) -> str:
+        """
+        Persist a new model set and swap it in atomically
+        
+        Compilation and the parity check run before the swap; requests that
+        are already scoring finish on the previous models.
+        """
+        artifacts = dict(artifacts)
+        artifacts.pop("compiled_forests", None)
+        self._set_artifacts(artifacts)
+        return self.save_models(metadata, promote=promote)
+    
+    def train_models(self) -> Dict[str, Any]:
+        """Fit fresh models (offline training job)"""
+        start_time = time.time()
+        
+        self.recovery_model = RandomForestRegressor(n_estimators=100, random_state=42)
+        self.complication_model = RandomForestClassifier(n_estimators=100, random_state=42)
+        self.scaler = StandardScaler()
+        
+        # Train on synthetic data for demo (in production, use real medical data)
+        self._train_models()
+        
+        return {"training_time_s": round(time.time() - start_time, 2)}
+    
+    def save_models(self, metadata: Optional[Dict[str, Any]] = None, promote: bool = True) -> str:
+        """Persist the current models as a new artifact version"""
+        metadata = dict(metadata or {})
+        metadata.update({
+            "sklearn_version": sklearn.__version__,
+            "feature_schema_version": FEATURE_SCHEMA_VERSION,
+            "feature_names": FEATURE_NAMES,
+            "diagnosis_vocabulary_size": len(self.diagnosis_vocabulary),
+            "n_estimators": {
+                "recovery_model": len(self.recovery_model.estimators_),
+                "complication_model": len(self.complication_model.estimators_)
+            }
+        })
+        self.model_version = self.artifact_store.save(self._get_artifacts(), metadata, promote=promote)
+        self.model_metadata = metadata
+        return self.model_version
+    
     def _train_models(self):
         """Train models on synthetic data for demonstration"""
         # Generate synthetic training data
@@ -117,8 +336,14 @@ class RecoveryPredictionService:
         # Convert to DataFrame
         df = pd.DataFrame(data)
         
+        # Build the diagnosis vocabulary once; a small share of rows is moved to
+        # the unknown bucket so the forests learn a sensible fallback for it
+        self.diagnosis_vocabulary = self._build_vocabulary(df['diagnosis'])
+        unknown_mask = np.random.rand(n_samples) < 0.05
+        
         # Prepare features for training
         X = self._prepare_features(df)
+        X[unknown_mask, FEATURE_NAMES.index('diagnosis')] = UNKNOWN_CATEGORY
         y_recovery = df['recovery_days'].values
         y_complication = (df['complication_risk'] > 0.5).astype(int)  # Binary classification
         
@@ -209,43 +434,66 @@ class RecoveryPredictionService:
         
         return min(0.95, base_risk)  # Cap at 95%
     
+    @staticmethod
+    def _normalize_category(value: Optional[str]) -> str:
+        return value.strip().lower() if value else ""
+    
+    def _build_vocabulary(self, values) -> Dict[str, int]:
+        """Map each training category to a stable index; 0 is the unknown bucket"""
+        categories = sorted({self._normalize_category(v) for v in values} - {""})
+        return {category: i + 1 for i, category in enumerate(categories)}
+    
+    def _encode_diagnosis(self, diagnosis: Optional[str]) -> int:
+        return self.diagnosis_vocabulary.get(self._normalize_category(diagnosis), UNKNOWN_CATEGORY)
+    
     def _prepare_features(self, df: pd.DataFrame) -> np.ndarray:
         """Prepare features for model input"""
-        features = []
+        return np.column_stack([
+            (df['age'].to_numpy(dtype=float) - 50) / 15,
+            (df['gender'] == 'male').to_numpy(dtype=float),
+            df['scan_confidence'].to_numpy(dtype=float),
+            df['scan_severity'].map(SEVERITY_CODES).to_numpy(dtype=float),
+            df['lab_abnormalities'].to_numpy(dtype=float),
+            df['lab_urgency'].map(SEVERITY_CODES).to_numpy(dtype=float),
+            df['visit_frequency'].to_numpy(dtype=float),
+            df['diagnosis'].map(self._encode_diagnosis).to_numpy(dtype=float),
+            df['symptoms'].str.split(', ').str.len().to_numpy(dtype=float)
+        ])
+    
+    def _score(self, features: np.ndarray, quantiles: Optional[Sequence[float]] = None) -> tuple:
+        """
+        Scale a feature matrix and run both models once over all rows
         
-        for _, row in df.iterrows():
-            # Age (normalized)
-            age_norm = (row['age'] - 50) / 15
-            
-            # Gender (encoded)
-            gender_encoded = 1 if row['gender'] == 'male' else 0
-            
-            # Scan features
-            scan_confidence = row['scan_confidence']
-            scan_severity_encoded = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}[row['scan_severity']]
-            
-            # Lab features
-            lab_abnormalities = row['lab_abnormalities']
-            lab_urgency_encoded = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}[row['lab_urgency']]
-            
-            # Visit frequency
-            visit_frequency = row['visit_frequency']
-            
-            # Diagnosis (encoded)
-            diagnosis_encoded = self.diagnosis_encoder.fit_transform([row['diagnosis']])[0]
-            
-            # Symptoms (count and severity)
-            symptoms_count = len(row['symptoms'].split(', '))
-            
-            feature_vector = [
-                age_norm, gender_encoded, scan_confidence, scan_severity_encoded,
-                lab_abnormalities, lab_urgency_encoded, visit_frequency,
-                diagnosis_encoded, symptoms_count
-            ]
-            
-            features.append(feature_vector)
+        The recovery estimate is the mean of the per-tree predictions; the
+        same per-tree matrix gives the empirical quantiles, shape
+        (n_rows, len(quantiles)), so the interval costs no extra model pass.
+        """
+        quantiles = self.interval_quantiles if quantiles is None else quantiles
+        
+        # Take one consistent model set; a concurrent swap does not affect this call
+        with self._swap_lock:
+            scaler = self.scaler
+            recovery_model, complication_model = self.recovery_model, self.complication_model
+            compiled_recovery, compiled_complication = self.compiled_recovery, self.compiled_complication
+        
+        if compiled_recovery is not None and len(features) <= self.compiled_max_batch:
+            # Same arithmetic as StandardScaler.transform without its input validation
+            features_scaled = (features - scaler.mean_) / scaler.scale_
+            per_tree_days = compiled_recovery.predict_per_tree(features_scaled)
+            complication_probs = compiled_complication.predict(features_scaled)
+        else:
+            features_scaled = scaler.transform(features)
+            # Trees expect float32, as RandomForestRegressor.predict converts internally
+            features_tree = features_scaled.astype(np.float32)
+            per_tree_days = np.column_stack([
+                tree.predict(features_tree, check_input=False)
+                for tree in recovery_model.estimators_
+            ])
+            complication_probs = complication_model.predict_proba(features_scaled)[:, 1]
         
-        return np.array(features)
+        recovery_days = per_tree_days.mean(axis=1)
+        recovery_quantiles = np.quantile(per_tree_days, quantiles, axis=1).T
+        return recovery_days, complication_probs, recovery_quantiles
     
     async def predict_recovery(
         self,
@@ -255,97 +503,261 @@ class RecoveryPredictionService:
         bloodwork_analysis: Optional[Dict] = None,
         patient_age: Optional[int] = None,
         patient_gender: Optional[str] = None,
-        visit_frequency: int = 1
+        visit_frequency: int = 1,
+        quantiles: Optional[Sequence[float]] = None
     ) -> RecoveryPrediction:
         """
         Predict recovery time and complication risk
+        
+        quantiles overrides the configured per-tree quantiles reported in
+        confidence_interval.
         """
+        self.refresh_models()
+        
         try:
+            case = {
+                "symptoms": symptoms,
+                "diagnosis": diagnosis,
+                "scan_analysis": scan_analysis,
+                "bloodwork_analysis": bloodwork_analysis,
+                "patient_age": patient_age,
+                "patient_gender": patient_gender,
+                "visit_frequency": visit_frequency
+            }
+            
             # Prepare input features
-            features = self._prepare_prediction_features(
-                symptoms, diagnosis, scan_analysis, bloodwork_analysis,
-                patient_age, patient_gender, visit_frequency
+            features = self._prepare_batch_features([case])
+            
+            # Make predictions
+            quantiles = self._parse_quantiles(quantiles) if quantiles is not None else self.interval_quantiles
+            recovery_days, complication_probs, recovery_quantiles = self._score(features, quantiles)
+            
+            return self._build_prediction(
+                case, recovery_days[0], complication_probs[0], quantiles, recovery_quantiles[0]
             )
             
-            # Scale features
-            features_scaled = self.scaler.transform([features])
+        except Exception as e:
+            logger.error(f"Error predicting recovery: {e}")
+            raise
+    
+    async def predict_recovery_batch(
+        self,
+        cases: List[Dict[str, Any]],
+        quantiles: Optional[Sequence[float]] = None
+    ) -> List[RecoveryPrediction]:
+        """
+        Predict recovery time and complication risk for many cases at once
+        
+        Each case has the same keys as the predict_recovery arguments. The
+        feature matrix is built column-wise and each model runs once.
+        Predictions are returned in input order.
+        """
+        self.refresh_models()
+        
+        try:
+            features = self._prepare_batch_features(cases)
+            quantiles = self._parse_quantiles(quantiles) if quantiles is not None else self.interval_quantiles
+            recovery_days, complication_probs, recovery_quantiles = self._score(features, quantiles)
             
-            # Make predictions
-            recovery_days = self.recovery_model.predict(features_scaled)[0]
-            complication_prob = self.complication_model.predict_proba(features_scaled)[0][1]
+            return [
+                self._build_prediction(case, days, prob, quantiles, row_quantiles)
+                for case, days, prob, row_quantiles in zip(cases, recovery_days, complication_probs, recovery_quantiles)
+            ]
             
-            # Calculate confidence intervals
-            confidence_interval = self._calculate_confidence_interval(recovery_days)
+        except Exception as e:
+            logger.error(f"Error predicting recovery batch: {e}")
+            raise
+    
+    async def sensitivity_sweep(
+        self,
+        base_case: Dict[str, Any],
+        grid: Dict[str, List[Any]],
+        include_intervals: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Score a base case under every combination of perturbed inputs
+        
+        Args:
+            base_case: Same keys as the predict_recovery arguments
+            grid: Input name (see SWEEP_AXES) -> values to try, e.g.
+                {"visit_frequency": [1, 2, 4], "lab_urgency": ["low", "high"]}
+            include_intervals: Also return the outer per-tree quantiles
+        
+        Returns:
+            Axes in grid order and response surfaces as nested lists indexed
+            [axis0][axis1]..., plus the unperturbed base prediction
+        """
+        self.refresh_models()
+        
+        try:
+            unknown = sorted(set(grid) - set(SWEEP_AXES))
+            if unknown:
+                raise ValueError(f"Unsupported sweep inputs: {unknown}; expected any of {sorted(SWEEP_AXES)}")
+            if not grid or any(len(values) == 0 for values in grid.values()):
+                raise ValueError("Sweep grid needs at least one value per input")
             
-            # Generate risk factors
-            risk_factors = self._identify_risk_factors(
-                symptoms, diagnosis, scan_analysis, bloodwork_analysis,
-                patient_age, patient_gender, visit_frequency
-            )
+            axes = list(grid)
+            shape = tuple(len(grid[axis]) for axis in axes)
+            n_points = int(np.prod(shape))
+            if n_points > self.sweep_max_points:
+                raise ValueError(f"Sweep grid has {n_points} points; the limit is {self.sweep_max_points}")
             
-            # Generate recommendations
-            recommendations = self._generate_recovery_recommendations(
-                diagnosis, recovery_days, complication_prob, risk_factors
-            )
+            base_features = self._prepare_batch_features([base_case])
             
-            # Generate follow-up schedule
-            follow_up_schedule = self._generate_follow_up_schedule(
-                diagnosis, recovery_days, complication_prob
-            )
+            # Row 0 is the base case; the Cartesian grid follows in C order
+            features = np.repeat(base_features, n_points + 1, axis=0)
+            encoded_axes = [self._encode_sweep_axis(axis, grid[axis]) for axis in axes]
+            mesh = np.meshgrid(*encoded_axes, indexing="ij")
+            for axis, values in zip(axes, mesh):
+                features[1:, SWEEP_AXES[axis][0]] = values.ravel()
             
-            return RecoveryPrediction(
-                estimated_recovery_days=max(1, int(recovery_days)),
-                confidence_interval=confidence_interval,
-                complication_risk=float(complication_prob),
-                risk_factors=risk_factors,
-                recommendations=recommendations,
-                follow_up_schedule=follow_up_schedule
-            )
+            quantiles = (self.interval_quantiles[0], self.interval_quantiles[-1]) if include_intervals else ()
+            recovery_days, complication_probs, recovery_quantiles = self._score(features, quantiles)
+            
+            surface = {
+                "recovery_days": recovery_days[1:].reshape(shape).round(2).tolist(),
+                "complication_risk": complication_probs[1:].reshape(shape).round(4).tolist()
+            }
+            if include_intervals:
+                surface["recovery_lower"] = recovery_quantiles[1:, 0].reshape(shape).round(2).tolist()
+                surface["recovery_upper"] = recovery_quantiles[1:, -1].reshape(shape).round(2).tolist()
+            
+            return {
+                "axes": {axis: list(grid[axis]) for axis in axes},
+                "shape": list(shape),
+                "points": n_points,
+                "base": {
+                    "recovery_days": round(float(recovery_days[0]), 2),
+                    "complication_risk": round(float(complication_probs[0]), 4)
+                },
+                "surface": surface
+            }
             
         except Exception as e:
-            logger.error(f"Error predicting recovery: {e}")
+            logger.error(f"Error running recovery sensitivity sweep: {e}")
             raise
     
-    def _prepare_prediction_features(
+    def _encode_sweep_axis(self, axis: str, values: List[Any]) -> np.ndarray:
+        """Encode one grid axis to feature values; ValueError names the axis on a bad value"""
+        encoder = SWEEP_AXES[axis][1]
+        encoded = []
+        for value in values:
+            try:
+                encoded.append(encoder(value))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Invalid {axis} value {value!r} in sweep grid: {e}")
+        return np.array(encoded, dtype=float)
+    
+    def _build_prediction(
         self,
-        symptoms: str,
-        diagnosis: str,
-        scan_analysis: Optional[Dict],
-        bloodwork_analysis: Optional[Dict],
-        patient_age: Optional[int],
-        patient_gender: Optional[str],
-        visit_frequency: int
-    ) -> np.ndarray:
-        """Prepare features for prediction"""
+        case: Dict[str, Any],
+        recovery_days: float,
+        complication_prob: float,
+        quantiles: Sequence[float],
+        quantile_days: np.ndarray
+    ) -> RecoveryPrediction:
+        """Turn raw model outputs for one case into a RecoveryPrediction"""
+        symptoms = case.get("symptoms") or ""
+        diagnosis = case.get("diagnosis") or ""
+        
+        # Calculate confidence intervals
+        confidence_interval = self._calculate_confidence_interval(quantiles, quantile_days)
+        
+        # Generate risk factors
+        risk_factors = self._identify_risk_factors(
+            symptoms, diagnosis, case.get("scan_analysis"), case.get("bloodwork_analysis"),
+            case.get("patient_age"), case.get("patient_gender"), case.get("visit_frequency") or 1
+        )
+        
+        # Generate recommendations
+        recommendations = self._generate_recovery_recommendations(
+            diagnosis, recovery_days, complication_prob, risk_factors
+        )
+        
+        # Generate follow-up schedule
+        follow_up_schedule = self._generate_follow_up_schedule(
+            diagnosis, recovery_days, complication_prob
+        )
+        
+        return RecoveryPrediction(
+            estimated_recovery_days=max(1, int(recovery_days)),
+            confidence_interval=confidence_interval,
+            complication_risk=float(complication_prob),
+            risk_factors=risk_factors,
+            recommendations=recommendations,
+            follow_up_schedule=follow_up_schedule
+        )
+    
+    def _prepare_batch_features(self, cases: List[Dict[str, Any]]) -> np.ndarray:
+        """Build the feature matrix for a list of cases, one column at a time"""
         # Age (normalized, default to 50 if not provided)
-        age = patient_age if patient_age else 50
-        age_norm = (age - 50) / 15
+        ages = np.array([case.get("patient_age") or 50 for case in cases], dtype=float)
         
         # Gender (encoded)
-        gender_encoded = 1 if patient_gender == 'male' else 0
+        genders = np.array([case.get("patient_gender") == 'male' for case in cases], dtype=float)
         
         # Scan features
-        scan_confidence = scan_analysis.get('overall_confidence', 0.5) if scan_analysis else 0.5
-        scan_severity = self._extract_scan_severity(scan_analysis)
-        scan_severity_encoded = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}[scan_severity]
+        scans = [case.get("scan_analysis") for case in cases]
+        scan_confidence = np.array([scan.get('overall_confidence', 0.5) if scan else 0.5 for scan in scans], dtype=float)
+        scan_severity = np.array([SEVERITY_CODES[self._extract_scan_severity(scan)] for scan in scans], dtype=float)
         
         # Lab features
-        lab_abnormalities = self._count_lab_abnormalities(bloodwork_analysis)
-        lab_urgency = self._extract_lab_urgency(bloodwork_analysis)
-        lab_urgency_encoded = {'low': 0, 'medium': 1, 'high': 2, 'critical': 3}[lab_urgency]
+        labs = [case.get("bloodwork_analysis") for case in cases]
+        lab_abnormalities = np.array([self._count_lab_abnormalities(lab) for lab in labs], dtype=float)
+        lab_urgency = np.array([SEVERITY_CODES[self._extract_lab_urgency(lab)] for lab in labs], dtype=float)
+        
+        # Visit frequency
+        visit_frequency = np.array([case.get("visit_frequency") or 1 for case in cases], dtype=float)
         
         # Diagnosis (encoded)
-        diagnosis_encoded = self.diagnosis_encoder.fit_transform([diagnosis])[0]
+        diagnoses = np.array([self._encode_diagnosis(case.get("diagnosis")) for case in cases], dtype=float)
         
         # Symptoms (count)
-        symptoms_count = len(symptoms.split(',')) if symptoms else 0
-        
-        return np.array([
-            age_norm, gender_encoded, scan_confidence, scan_severity_encoded,
-            lab_abnormalities, lab_urgency_encoded, visit_frequency,
-            diagnosis_encoded, symptoms_count
+        symptoms_count = np.array(
+            [len(case["symptoms"].split(',')) if case.get("symptoms") else 0 for case in cases],
+            dtype=float
+        )
+        
+        return np.column_stack([
+            (ages - 50) / 15, genders, scan_confidence, scan_severity,
+            lab_abnormalities, lab_urgency, visit_frequency,
+            diagnoses, symptoms_count
         ])
     
+    def validate_case(self, case: Any) -> Dict[str, Any]:
+        """
+        Check a predict_recovery input before it is stored for retraining
+        
+        Raises ValueError when the case does not match RecoveryPredictionCase
+        or names a scan severity or lab urgency outside SEVERITY_CODES.
+        """
+        case = RecoveryPredictionCase.model_validate(case).model_dump()
+        
+        scan = case["scan_analysis"]
+        if scan:
+            conditions = scan.get("conditions") or []
+            if not isinstance(conditions, list) or not all(isinstance(c, dict) for c in conditions):
+                raise ValueError("scan_analysis.conditions must be a list of objects")
+            for condition in conditions:
+                severity = condition.get("severity", "low")
+                if severity not in SEVERITY_CODES:
+                    raise ValueError(f"Unknown scan severity {severity!r}; expected one of {list(SEVERITY_CODES)}")
+            try:
+                float(scan.get("overall_confidence", 0.5))
+            except (TypeError, ValueError):
+                raise ValueError(f"scan_analysis.overall_confidence must be a number, got {scan.get('overall_confidence')!r}")
+        
+        lab = case["bloodwork_analysis"]
+        if lab:
+            urgency = lab.get("urgency_level", "low")
+            if urgency not in SEVERITY_CODES:
+                raise ValueError(f"Unknown lab urgency {urgency!r}; expected one of {list(SEVERITY_CODES)}")
+            lab_values = lab.get("lab_values") or []
+            if not isinstance(lab_values, list) or not all(isinstance(v, dict) for v in lab_values):
+                raise ValueError("bloodwork_analysis.lab_values must be a list of objects")
+        
+        return case
+    
     def _extract_scan_severity(self, scan_analysis: Optional[Dict]) -> str:
         """Extract severity from scan analysis"""
         if not scan_analysis or 'conditions' not in scan_analysis:
@@ -379,15 +791,30 @@ class RecoveryPredictionService:
         
         return bloodwork_analysis.get('urgency_level', 'low')
     
-    def _calculate_confidence_interval(self, recovery_days: float) -> Dict[str, int]:
-        """Calculate confidence interval for recovery prediction"""
-        # Simple confidence interval based on prediction uncertainty
-        uncertainty = recovery_days * 0.2  # 20% uncertainty
+    def _parse_quantiles(self, quantiles) -> tuple:
+        """Validate quantiles given as a sequence or a comma-separated string"""
+        if isinstance(quantiles, str):
+            quantiles = [q for q in quantiles.split(",") if q.strip()]
+        parsed = tuple(sorted({float(q) for q in quantiles}))
+        if not parsed or parsed[0] < 0.0 or parsed[-1] > 1.0:
+            raise ValueError(f"Quantiles must be between 0 and 1, got {quantiles}")
+        return parsed
+    
+    def _calculate_confidence_interval(self, quantiles: Sequence[float], quantile_days: np.ndarray) -> Dict[str, int]:
+        """
+        Calculate confidence interval from per-tree recovery quantiles
         
-        return {
-            "lower": max(1, int(recovery_days - uncertainty)),
-            "upper": int(recovery_days + uncertainty)
+        Each quantile is reported as pNN (e.g. p10, p90); lower and upper are
+        the outermost requested quantiles.
+        """
+        interval = {
+            f"p{round(q * 100, 1):g}": max(1, int(round(days)))
+            for q, days in zip(quantiles, quantile_days)
         }
+        interval["lower"] = max(1, int(np.floor(quantile_days[0])))
+        interval["upper"] = max(interval["lower"], int(np.ceil(quantile_days[-1])))
+        
+        return interval
     
     def _identify_risk_factors(
         self,
@@ -523,6 +950,40 @@ class RecoveryPredictionService:
         return {
             "model_name": "Recovery Prediction Model",
             "status": self.model_status,
-            "version": "1.0.0",
-            "last_updated": "2024-01-01"
-        } 
\ No newline at end of file
+            "version": self.model_version,
+            "last_updated": self.model_metadata.get("created_at"),
+            "load_time_ms": self.model_metadata.get("load_time_ms"),
+            "compiled_inference": self.compiled_recovery is not None,
+            "interval_quantiles": list(self.interval_quantiles),
+            "available_versions": self.artifact_store.list_versions()
+        }
+
+if __name__ == "__main__":
+    import argparse
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    parser = argparse.ArgumentParser(description="Offline training for recovery prediction models")
+    parser.add_argument("--artifact-dir", default=None, help="Artifact root (default: $RECOVERY_MODEL_DIR or model_artifacts)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser("train", help="Train and store a new model version")
+    train.add_argument("--no-promote", action="store_true", help="Store without pointing LATEST at it")
+    subparsers.add_parser("list", help="List stored versions")
+    promote = subparsers.add_parser("promote", help="Point LATEST at an existing version")
+    promote.add_argument("version")
+    args = parser.parse_args()
+    
+    service = RecoveryPredictionService(artifact_dir=args.artifact_dir, autoload=False)
+    store = service.artifact_store
+    
+    if args.command == "train":
+        stats = service.train_models()
+        version = service.save_models(stats, promote=not args.no_promote)
+        print(f"Trained recovery models version {version} in {stats['training_time_s']} s")
+    elif args.command == "list":
+        latest = store.latest_version()
+        for version in store.list_versions():
+            print(f"{version}{'  (latest)' if version == latest else ''}")
+    else:
+        store.promote(args.version)
+        print(f"LATEST -> {args.version}") 
\ No newline at end of file
@@ -0,0 +1,389 @@
+"""
+Incremental retraining of recovery models from labelled outcomes
+
+Doctor feedback that carries an observed outcome (actual recovery days and
+whether complications occurred) is accumulated in SQLite. Once enough new
+outcomes arrive, a background worker grows copies of the current forests with
+warm_start on a rolling window of recent outcomes, trims the oldest trees so
+the ensemble stays bounded, and scores old and new models on a fixed holdout.
+Candidates that do not regress are persisted as a new artifact version and
+swapped into RecoveryPredictionService without interrupting requests. Other
+worker processes pick the version up from the artifact store's LATEST pointer
+(RecoveryPredictionService.refresh_models).
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class RecoveryOutcome:
+    """Observed outcome for a case the recovery models scored"""
+    outcome_id: str
+    case: Dict[str, Any]  # same keys as RecoveryPredictionService.predict_recovery
+    recovery_days: float
+    had_complications: bool
+    recorded_at: float
+
+class RecoveryOutcomeStore:
+    """
+    SQLite log of labelled recovery outcomes
+
+    Each outcome is assigned to the training or holdout split once, from a
+    hash of its id, so the holdout stays fixed across retraining rounds.
+    """
+
+    def __init__(self, db_path: str = "recovery_outcomes.db", holdout_fraction: float = 0.2):
+        self.db_path = db_path
+        self.holdout_fraction = holdout_fraction
+        self._lock = threading.Lock()
+
+        self._init_database()
+
+    def _init_database(self):
+        """Initialize the outcome log"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS recovery_outcomes (
+                outcome_id TEXT PRIMARY KEY,
+                case_json TEXT NOT NULL,
+                recovery_days REAL NOT NULL,
+                had_complications INTEGER NOT NULL,
+                recorded_at REAL NOT NULL,
+                holdout INTEGER NOT NULL,
+                consumed_at REAL,
+                model_version TEXT,
+                rejected_reason TEXT
+            )
+        ''')
+
+        # Logs created before malformed cases were rejected lack the column
+        existing = {row[1] for row in cursor.execute("PRAGMA table_info(recovery_outcomes)")}
+        if "rejected_reason" not in existing:
+            cursor.execute("ALTER TABLE recovery_outcomes ADD COLUMN rejected_reason TEXT")
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outcomes_split_time
+            ON recovery_outcomes(holdout, recorded_at)
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def _get_connection(self):
+        """Get database connection"""
+        return sqlite3.connect(self.db_path)
+
+    def _is_holdout(self, outcome_id: str) -> bool:
+        bucket = int(hashlib.sha1(outcome_id.encode()).hexdigest()[:8], 16) % 10000
+        return bucket < self.holdout_fraction * 10000
+
+    def add(self, outcomes: List[RecoveryOutcome]) -> int:
+        """Store outcomes, ignoring ids already present; returns the number added"""
+        rows = [
+            (
+                outcome.outcome_id, json.dumps(outcome.case), float(outcome.recovery_days),
+                int(bool(outcome.had_complications)), outcome.recorded_at, int(self._is_holdout(outcome.outcome_id))
+            )
+            for outcome in outcomes
+        ]
+        if not rows:
+            return 0
+
+        with self._lock:
+            conn = self._get_connection()
+            before = conn.total_changes
+            conn.executemany('''
+                INSERT OR IGNORE INTO recovery_outcomes
+                (outcome_id, case_json, recovery_days, had_complications, recorded_at, holdout)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            added = conn.total_changes - before
+            conn.commit()
+            conn.close()
+
+        return added
+
+    def count_unconsumed(self) -> int:
+        """Training outcomes not yet seen by a retraining round"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM recovery_outcomes WHERE holdout = 0 AND consumed_at IS NULL')
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+
+    def recent(self, limit: int, holdout: bool = False) -> List[RecoveryOutcome]:
+        """Most recent outcomes from one split, newest first"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT outcome_id, case_json, recovery_days, had_complications, recorded_at
+            FROM recovery_outcomes
+            WHERE holdout = ? AND rejected_reason IS NULL
+            ORDER BY recorded_at DESC
+            LIMIT ?
+        ''', (int(holdout), limit))
+        rows = cursor.fetchall()
+        conn.close()
+
+        return [
+            RecoveryOutcome(outcome_id, json.loads(case_json), recovery_days, bool(had_complications), recorded_at)
+            for outcome_id, case_json, recovery_days, had_complications, recorded_at in rows
+        ]
+
+    def mark_consumed(self, outcome_ids: List[str], model_version: Optional[str] = None):
+        """Record that a retraining round used these outcomes (and the version it produced, if accepted)"""
+        with self._lock:
+            conn = self._get_connection()
+            conn.executemany(
+                'UPDATE recovery_outcomes SET consumed_at = ?, model_version = ? WHERE outcome_id = ?',
+                [(time.time(), model_version, outcome_id) for outcome_id in outcome_ids]
+            )
+            conn.commit()
+            conn.close()
+
+    def mark_rejected(self, reasons: Dict[str, str]):
+        """Retire outcomes whose stored case cannot be scored so no later round reads them"""
+        with self._lock:
+            conn = self._get_connection()
+            conn.executemany(
+                'UPDATE recovery_outcomes SET consumed_at = ?, rejected_reason = ? WHERE outcome_id = ?',
+                [(time.time(), reason, outcome_id) for outcome_id, reason in reasons.items()]
+            )
+            conn.commit()
+            conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get storage statistics"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT holdout, COUNT(*) FROM recovery_outcomes WHERE rejected_reason IS NULL GROUP BY holdout')
+        counts = dict(cursor.fetchall())
+        cursor.execute('SELECT COUNT(*) FROM recovery_outcomes WHERE rejected_reason IS NOT NULL')
+        rejected = cursor.fetchone()[0]
+        conn.close()
+
+        return {
+            "training_outcomes": counts.get(0, 0),
+            "holdout_outcomes": counts.get(1, 0),
+            "rejected_outcomes": rejected,
+            "database_path": self.db_path
+        }
+
+class RecoveryRetrainer:
+    """
+    Grows the recovery forests from new outcomes and hot-swaps accepted models
+
+    Args:
+        recovery_service: RecoveryPredictionService to update
+        outcome_store: Labelled outcome log (created from env if omitted)
+        window: Most recent training outcomes used per round
+        min_new_outcomes: New training outcomes needed before a round starts
+        min_holdout: Holdout outcomes needed to validate a candidate
+        trees_per_update: Trees added to each forest per round
+        max_estimators: Oldest trees are dropped beyond this size
+        tolerance: Allowed relative holdout regression (MAE / Brier score)
+    """
+
+    def __init__(
+        self,
+        recovery_service,
+        outcome_store: Optional[RecoveryOutcomeStore] = None,
+        window: int = 5000,
+        min_new_outcomes: int = 200,
+        min_holdout: int = 50,
+        trees_per_update: int = 20,
+        max_estimators: int = 300,
+        tolerance: float = 0.02
+    ):
+        self.recovery_service = recovery_service
+        self.outcome_store = outcome_store or RecoveryOutcomeStore(
+            db_path=os.getenv("RECOVERY_OUTCOMES_DB", "recovery_outcomes.db")
+        )
+        self.window = window
+        self.min_new_outcomes = min_new_outcomes
+        self.min_holdout = min_holdout
+        self.trees_per_update = trees_per_update
+        self.max_estimators = max_estimators
+        self.tolerance = tolerance
+
+        # Single worker: at most one round at a time, off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recovery-retrain")
+        self._task: Optional[asyncio.Task] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    def add_outcomes(self, outcomes: List[Dict[str, Any]]) -> int:
+        """
+        Queue labelled outcomes for the next round
+
+        Each item needs case, actual_recovery_days and had_complications;
+        outcome_id (e.g. the feedback id) makes re-submission idempotent.
+        """
+        records = [
+            RecoveryOutcome(
+                outcome_id=item.get("outcome_id") or str(uuid.uuid4()),
+                case=item["case"],
+                recovery_days=float(item["actual_recovery_days"]),
+                had_complications=bool(item["had_complications"]),
+                recorded_at=item.get("recorded_at") or time.time()
+            )
+            for item in outcomes
+        ]
+        return self.outcome_store.add(records)
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def maybe_retrain(self, force: bool = False) -> Dict[str, Any]:
+        """Start a background round if enough new outcomes have accumulated"""
+        if self.is_running:
+            return {"status": "running"}
+
+        pending = self.outcome_store.count_unconsumed()
+        if pending == 0 or (pending < self.min_new_outcomes and not force):
+            return {"status": "waiting", "new_outcomes": pending, "required": self.min_new_outcomes}
+
+        self._task = asyncio.create_task(self._run())
+        return {"status": "started", "new_outcomes": pending}
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            self.last_result = await loop.run_in_executor(self._executor, self.retrain)
+        except Exception as e:
+            logger.error(f"Recovery retraining failed: {e}")
+            self.last_result = {"status": "failed", "error": str(e), "finished_at": datetime.now().isoformat()}
+
+    def retrain(self) -> Dict[str, Any]:
+        """Run one retraining round synchronously (background worker or offline job)"""
+        start_time = time.time()
+        service = self.recovery_service
+
+        training = self._valid_outcomes(self.outcome_store.recent(self.window, holdout=False))
+        holdout = self._valid_outcomes(self.outcome_store.recent(self.window, holdout=True))
+        if len(holdout) < self.min_holdout:
+            return {"status": "skipped", "reason": f"need {self.min_holdout} holdout outcomes, have {len(holdout)}"}
+
+        # Grow from the newest promoted version, even if another worker installed it
+        service.refresh_models(force=True)
+        current = service._get_artifacts()
+        parent_version = service.model_version
+        scaler = current["scaler"]
+
+        # The scaler and vocabulary stay fixed so existing trees remain valid
+        X_train = scaler.transform(service._prepare_batch_features([o.case for o in training]))
+        X_holdout = scaler.transform(service._prepare_batch_features([o.case for o in holdout]))
+        y_days = np.array([o.recovery_days for o in training])
+        y_complications = np.array([int(o.had_complications) for o in training])
+
+        recovery_model = self._grow(current["recovery_model"], X_train, y_days)
+        if len(np.unique(y_complications)) == len(current["complication_model"].classes_):
+            complication_model = self._grow(current["complication_model"], X_train, y_complications)
+        else:
+            # warm_start needs every class present; keep the current classifier
+            complication_model = current["complication_model"]
+
+        holdout_days = np.array([o.recovery_days for o in holdout])
+        holdout_complications = np.array([float(o.had_complications) for o in holdout])
+        metrics = {
+            "current": self._evaluate(current["recovery_model"], current["complication_model"], X_holdout, holdout_days, holdout_complications),
+            "candidate": self._evaluate(recovery_model, complication_model, X_holdout, holdout_days, holdout_complications)
+        }
+        accepted = all(
+            metrics["candidate"][name] <= metrics["current"][name] * (1 + self.tolerance) + 1e-12
+            for name in ("recovery_mae", "complication_brier")
+        )
+
+        result = {
+            "status": "accepted" if accepted else "rejected",
+            "parent_version": parent_version,
+            "training_outcomes": len(training),
+            "holdout_outcomes": len(holdout),
+            "holdout_metrics": metrics,
+            "n_estimators": {
+                "recovery_model": len(recovery_model.estimators_),
+                "complication_model": len(complication_model.estimators_)
+            }
+        }
+
+        version = None
+        if accepted:
+            artifacts = dict(current, recovery_model=recovery_model, complication_model=complication_model)
+            version = service.install_models(artifacts, {
+                "parent_version": parent_version,
+                "retrained_from_outcomes": len(training),
+                "holdout_metrics": metrics
+            })
+            result["version"] = version
+
+        self.outcome_store.mark_consumed([o.outcome_id for o in training], version)
+
+        result["training_time_s"] = round(time.time() - start_time, 2)
+        result["finished_at"] = datetime.now().isoformat()
+        logger.info(f"Recovery retraining {result['status']} ({result['training_time_s']} s): {metrics}")
+        return result
+
+    def _valid_outcomes(self, outcomes: List[RecoveryOutcome]) -> List[RecoveryOutcome]:
+        """Drop outcomes whose case fails validation, marking them rejected in the store"""
+        valid, rejected = [], {}
+        for outcome in outcomes:
+            try:
+                outcome.case = self.recovery_service.validate_case(outcome.case)
+                valid.append(outcome)
+            except ValueError as e:
+                rejected[outcome.outcome_id] = str(e)
+
+        if rejected:
+            logger.warning(f"Rejected {len(rejected)} recovery outcomes with malformed cases")
+            self.outcome_store.mark_rejected(rejected)
+        return valid
+
+    def _grow(self, forest, X: np.ndarray, y: np.ndarray):
+        """Copy a fitted forest, add trees fitted on (X, y), and drop the oldest beyond max_estimators"""
+        candidate = copy.deepcopy(forest)
+        candidate.set_params(warm_start=True, n_estimators=len(candidate.estimators_) + self.trees_per_update)
+        candidate.fit(X, y)
+
+        if len(candidate.estimators_) > self.max_estimators:
+            candidate.estimators_ = candidate.estimators_[-self.max_estimators:]
+            candidate.n_estimators = self.max_estimators
+
+        return candidate
+
+    def _evaluate(self, recovery_model, complication_model, X: np.ndarray, days: np.ndarray, complications: np.ndarray) -> Dict[str, float]:
+        positive = list(complication_model.classes_).index(1) if 1 in complication_model.classes_ else -1
+        probs = complication_model.predict_proba(X)[:, positive]
+        return {
+            "recovery_mae": round(float(np.mean(np.abs(recovery_model.predict(X) - days))), 4),
+            "complication_brier": round(float(np.mean((probs - complications) ** 2)), 4)
+        }
+
+    def get_status(self) -> Dict[str, Any]:
+        """Retraining pipeline status"""
+        return {
+            "running": self.is_running,
+            "new_outcomes": self.outcome_store.count_unconsumed(),
+            "min_new_outcomes": self.min_new_outcomes,
+            "model_version": self.recovery_service.model_version,
+            "last_result": self.last_result,
+            **self.outcome_store.get_stats()
+        }
@@ -1,7 +1,6 @@
 import asyncio
 import json
 import logging
-import os
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Tuple
 import numpy as np
@@ -17,8 +16,8 @@ import base64
 from sklearn.cluster import DBSCAN
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
-import openai
-from openai import AsyncOpenAI
+
+from services.llm_gateway import Priority, get_llm_gateway
 
 logger = logging.getLogger(__name__)
 
@@ -53,7 +52,7 @@ class SymptomTimelineService:
     """
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.llm = get_llm_gateway().client("symptom_timeline", Priority.STANDARD)
         self.model_version = "v1.2.1"
         
         # Initialize clustering for pattern detection
@@ -0,0 +1,96 @@
+import bisect
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+@dataclass
+class MetricSample:
+    """One Prometheus sample"""
+    name: str
+    value: float
+    labels: Dict[str, str] = field(default_factory=dict)
+    kind: str = "gauge"  # gauge, counter or histogram
+    help: str = ""
+    family: str = ""  # metric family for HELP/TYPE, when it differs from name (histogram series)
+
+_collectors: List[Callable[[], Iterable[MetricSample]]] = []
+_lock = threading.Lock()
+
+def register_collector(collector: Callable[[], Iterable[MetricSample]]):
+    """Register a callable that yields samples each time /metrics is scraped"""
+    with _lock:
+        _collectors.append(collector)
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in sorted(labels.items())) + "}"
+
+def render_prometheus() -> str:
+    """Render all registered collectors in the Prometheus text exposition format"""
+    with _lock:
+        collectors = list(_collectors)
+
+    grouped: Dict[str, List[MetricSample]] = {}
+    for collector in collectors:
+        for sample in collector():
+            grouped.setdefault(sample.family or sample.name, []).append(sample)
+
+    lines = []
+    for family, samples in grouped.items():
+        if samples[0].help:
+            lines.append(f"# HELP {family} {samples[0].help}")
+        lines.append(f"# TYPE {family} {samples[0].kind}")
+        for sample in samples:
+            lines.append(f"{sample.name}{_format_labels(sample.labels)} {float(sample.value)}")
+
+    return "\n".join(lines) + "\n"
+
+class Histogram:
+    """
+    Prometheus histogram with fixed buckets, keyed by label values
+
+    Registers itself on creation; observe() is thread-safe.
+    """
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # label values -> bucket counts + [sum, count]
+        self._lock = threading.Lock()
+
+        register_collector(self._collect)
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(label, "")) for label in self.label_names)
+        with self._lock:
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _collect(self) -> List[MetricSample]:
+        samples = []
+        with self._lock:
+            series_items = [(key, list(series)) for key, series in self._series.items()]
+
+        for key, series in series_items:
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                samples.append(MetricSample(f"{self.name}_bucket", cumulative, {**labels, "le": f"{bound:g}"},
+                                            "histogram", self.help, self.name))
+            samples.append(MetricSample(f"{self.name}_bucket", series[-1], {**labels, "le": "+Inf"}, "histogram", self.help, self.name))
+            samples.append(MetricSample(f"{self.name}_sum", series[-2], labels, "histogram", self.help, self.name))
+            samples.append(MetricSample(f"{self.name}_count", series[-1], labels, "histogram", self.help, self.name))
+        return samples
@@ -0,0 +1,19 @@
+import json
+from typing import Any, AsyncIterator, Dict
+
+from fastapi.responses import StreamingResponse
+
+# Keep proxies (nginx) from buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def format_sse(event: str, data: Any) -> str:
+    """Encode one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def sse_response(events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    """Stream {"event", "data"} items as text/event-stream"""
+    async def encode():
+        async for item in events:
+            yield format_sse(item["event"], item["data"])
+
+    return StreamingResponse(encode(), media_type="text/event-stream", headers=SSE_HEADERS)